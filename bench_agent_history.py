@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import functools
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, Dict, List
+
+# 回放一次已记录的规划，对比"Agent 保留会话历史"（旧行为）与"每次调用使用新的 Agent"（当前行为）
+# 各阶段的 prompt token 数：
+#   python bench_agent_history.py --checkpoint storage/checkpoints/深圳3天/<run_id> --city 深圳 --days 3
+#   python bench_agent_history.py                          # 没有检查点时用 深圳3天旅游信息.json 合成一次记录
+#   python bench_agent_history.py --live                   # 搜索结果回放，模型真实调用（需要 QWEN_API_KEY）
+#
+# 离线回放不调用模型：每次调用把提示词和记录中的模型输出写入真实的 camel ChatAgent，
+# prompt token 数取自 agent.memory.get_context()，即 ChatAgent 这一步实际会发给模型的上下文。
+# 离线回放没有真实延迟，只有 --live 才报告耗时。
+
+# 回放时不受上游限流影响
+os.environ.setdefault("RATE_LIMIT_MODELSCOPE", "1000,1000,16")
+os.environ.setdefault("LLM_HEDGE_ENABLED", "0")
+
+import part2  # noqa: E402
+from checkpoint import CheckpointStore  # noqa: E402
+
+if TYPE_CHECKING:
+    from camel.agents import ChatAgent
+
+STAGES = ["guides", "attractions", "must_eat", "local_food"]
+
+
+def recording_from_plan(plan_file: str) -> Dict[str, Any]:
+    """用已保存的攻略合成一次规划记录：各阶段的搜索结果和模型输出都是由攻略内容拼出来的，不是真实运行的记录"""
+    with open(plan_file, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    days = int(plan.get("days", 3))
+
+    def results(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {"result_id": i + 1, "title": item["name"], "url": item.get("图片url", ""), "description": item.get("describe", "")}
+            for i, item in enumerate(items[:5])
+        ]
+
+    spots, foods, shops = plan.get("景点", []), plan.get("美食", []), plan.get("美食店铺", [])
+    search = {
+        "guides": results(spots[5:] + spots[:5]),
+        "attractions": results(spots),
+        "must_eat": results(foods),
+        "local_food": results(foods[5:] + shops),
+    }
+    return {
+        "source": f"合成记录（{os.path.basename(plan_file)}）",
+        "city": plan["city"],
+        "days": days,
+        "search": search,
+        "rerank": {stage: items[:days] for stage, items in search.items()},
+        "base_guide": json.dumps(plan.get("base路线", {}), ensure_ascii=False),
+        "attractions": json.dumps({"attractions": [{"name": s["name"], "description": s.get("describe", "")} for s in spots]},
+                                  ensure_ascii=False),
+        "foods": json.dumps({"foods": [{"name": s["name"], "description": s.get("describe", "")} for s in foods],
+                             "food_shop": [{"name": s["name"], "description": s.get("describe", "")} for s in shops]},
+                            ensure_ascii=False),
+        "images": {item["name"]: item.get("图片url", "") for item in spots + foods + shops},
+    }
+
+
+def recording_from_checkpoint(path: str, city: str, days: int) -> Dict[str, Any]:
+    """读取一次真实运行留下的检查点目录作为记录"""
+    def load(stage: str, default: Any = None) -> Any:
+        try:
+            with open(os.path.join(path, f"{stage}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    return {
+        "source": f"检查点 {path}",
+        "city": city,
+        "days": days,
+        "search": {stage: load(f"search_{stage}", []) for stage in STAGES},
+        "rerank": {stage: load(f"rerank_{stage}", []) for stage in STAGES},
+        "base_guide": load("base_guide", "{}"),
+        "attractions": load("attractions", '{"attractions": []}'),
+        "foods": load("foods", '{"foods": [], "food_shop": []}'),
+        "images": {},
+    }
+
+
+class MemoryReplayAgent:
+    """
+    包装真实的 camel ChatAgent，不调用模型。
+
+    step 按 ChatAgent.step 的顺序写入会话记忆：先写入用户提示词，读取 memory.get_context() 的 token 数
+    作为本次的 prompt tokens，再写入记录中的模型输出。reset 和是否复用 Agent 都由 part2 决定。
+    """
+
+    def __init__(self, agent: "ChatAgent", responses: List[str]):
+        self.agent = agent
+        self.responses = responses
+
+    def reset(self) -> None:
+        self.agent.reset()
+
+    def step(self, prompt: str):
+        from camel.messages import BaseMessage
+        from camel.types import OpenAIBackendRole
+
+        content = self.responses.pop(0) if self.responses else "{}"
+        self.agent.update_memory(BaseMessage.make_user_message("user", prompt), OpenAIBackendRole.USER)
+        _, prompt_tokens = self.agent.memory.get_context()
+        self.agent.update_memory(BaseMessage.make_assistant_message("assistant", content), OpenAIBackendRole.ASSISTANT)
+        _, context_tokens = self.agent.memory.get_context()
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": context_tokens - prompt_tokens}
+        return SimpleNamespace(msgs=[SimpleNamespace(content=content)], info={"usage": usage})
+
+
+def replay(recording: Dict[str, Any], stateless: bool, live: bool) -> Dict[str, Dict[str, Any]]:
+    part2.PLANNER_STATELESS_AGENTS = stateless
+    city, days = recording["city"], recording["days"]
+    planner_stub = part2.TravelPlanner.__new__(part2.TravelPlanner)
+    planner_stub.city, planner_stub.days = city, days
+    queries = {query: stage for stage, query, _, _ in planner_stub.rerank_stages()}
+
+    responses = {
+        "reranker": ["```json\n" + json.dumps(recording["rerank"][stage], ensure_ascii=False) + "\n```" for stage in STAGES],
+        "base_guide": [recording["base_guide"]],
+        "attraction": [recording["attractions"]],
+        "food": [recording["foods"]],
+    }
+    system_roles = {system_message: role for role, (_, system_message) in part2.AGENT_ROLES.items()}
+
+    originals = (part2.create_agent, part2.search_serper, part2.search_serper_images, part2.get_plan_index,
+                 part2.update_pool, part2.TravelPlanner.save_plan, part2.CheckpointStore)
+    with tempfile.TemporaryDirectory() as root:
+        if not live:
+            # 只创建 ChatAgent 和模型对象，不会发出请求；没有配置密钥时用占位值
+            os.environ.setdefault("QWEN_API_KEY", "replay")
+            part2.create_agent = lambda task, system_message, **kwargs: MemoryReplayAgent(
+                originals[0](task, system_message, **kwargs), responses[system_roles[system_message]])
+        part2.search_serper = lambda query, num_results=5: recording["search"].get(queries.get(query), [])
+        part2.search_serper_images = lambda query, num_results=1: [
+            {"image": recording["images"].get(query.split(" ")[1] if " " in query else query, "")}]
+        part2.get_plan_index = lambda: SimpleNamespace(find_image=lambda city, name: "")
+        part2.update_pool = lambda *args, **kwargs: None
+        part2.TravelPlanner.save_plan = lambda self, result: None
+        part2.CheckpointStore = functools.partial(CheckpointStore, root=root)
+        try:
+            planner = part2.TravelPlanner(city=city, days=days, use_pool=False)
+            planner.process_attractions_and_food()
+        finally:
+            (part2.create_agent, part2.search_serper, part2.search_serper_images, part2.get_plan_index,
+             part2.update_pool, part2.TravelPlanner.save_plan, part2.CheckpointStore) = originals
+
+    return planner.token_usage
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Agent 会话历史对 token 用量和耗时的影响")
+    parser.add_argument("--plan", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "深圳3天旅游信息.json"))
+    parser.add_argument("--checkpoint", help="真实运行留下的检查点目录，需同时指定 --city 和 --days")
+    parser.add_argument("--city")
+    parser.add_argument("--days", type=int)
+    parser.add_argument("--live", action="store_true", help="真实调用模型（搜索结果仍然回放）")
+    args = parser.parse_args()
+
+    if args.checkpoint:
+        recording = recording_from_checkpoint(args.checkpoint, args.city, args.days)
+    else:
+        recording = recording_from_plan(args.plan)
+
+    results = {}
+    for label, stateless in (("before", False), ("after", True)):
+        started = time.monotonic()
+        results[label] = replay(recording, stateless, args.live)
+        print(f"{label}: 回放耗时 {time.monotonic() - started:.2f} 秒", file=sys.stderr)
+
+    print(f"\n记录来源：{recording['source']}")
+    if args.live:
+        print("prompt tokens 和耗时：模型返回的 usage 和实际耗时")
+    else:
+        print("prompt tokens：ChatAgent.memory.get_context()（未调用模型，不报告耗时）")
+    # 离线回放只比较 token 数；耗时列只在 --live 时输出
+    columns = ("prompt_tokens", "seconds") if args.live else ("prompt_tokens",)
+    header = "".join(f"{label + ' ' + column:>22}" for column in columns for label in ("before", "after"))
+    print(f"\n{'阶段':<16}{header}")
+    totals = {column: {"before": 0, "after": 0} for column in columns}
+    for stage in results["after"]:
+        row = {label: results[label].get(stage, {}) for label in ("before", "after")}
+        cells = []
+        for column in columns:
+            for label in ("before", "after"):
+                value = row[label].get(column, 0)
+                totals[column][label] += value
+                cells.append(f"{value:>22}")
+        print(f"{stage:<16}{''.join(cells)}")
+    print(f"{'合计':<16}" + "".join(f"{round(totals[column][label], 2):>22}"
+                                  for column in columns for label in ("before", "after")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import re
+import sys
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+# 统计各服务模块的导入耗时：python bench_startup.py [--top 15] [--max-ms 1500] [模块 ...]
+DEFAULT_MODULES = ["part1", "part2", "part3"]
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str) -> Tuple[int, List[Tuple[str, int]]]:
+    """
+    在新的解释器中导入模块，解析 -X importtime 的输出。
+
+    Returns:
+        tuple: (总耗时微秒, [(模块名, 累计耗时微秒), ...])，
+        累计耗时只统计顶层导入，避免嵌套重复计算。
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+
+    cumulative: Dict[str, int] = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative_us, indent, name = match.groups()
+        cumulative[name] = int(cumulative_us)
+        if len(indent) == 1:
+            total += int(cumulative_us)
+    ranked = sorted(cumulative.items(), key=lambda item: item[1], reverse=True)
+    return total, ranked
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="服务启动（模块导入）耗时基准")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=15, help="列出累计耗时最高的导入数量")
+    parser.add_argument("--max-ms", type=float, default=None, help="任一模块导入超过该毫秒数时返回非零退出码")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        try:
+            total, ranked = measure(module)
+        except RuntimeError as e:
+            print(str(e))
+            failed = True
+            continue
+        print(f"== {module}: {total / 1000:.1f} ms")
+        for name, cumulative_us in ranked[:args.top]:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+        if args.max_ms is not None and total / 1000 > args.max_ms:
+            print(f"  超过阈值 {args.max_ms} ms")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
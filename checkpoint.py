@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import threading
+from typing import Any, List, Optional
+from storage import STORAGE_DIR
+
+# 检查点保存在 storage/checkpoints 下，与生成的旅游信息放在一起
+CHECKPOINT_DIR = os.path.join(STORAGE_DIR, "checkpoints")
+# 失败、降级后没有重试的运行留下的检查点保留多少小时，<= 0 表示不清理
+CHECKPOINT_TTL_HOURS = float(os.getenv("CHECKPOINT_TTL_HOURS", "48"))
+# 每个进程最多隔多久扫描一次过期的检查点
+CHECKPOINT_PURGE_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_PURGE_INTERVAL_SECONDS", "3600"))
+
+# run id 的格式与 new_run_id() 一致：12 位小写十六进制
+_RUN_ID = re.compile(r"[0-9a-f]{12}")
+
+
+def new_run_id() -> str:
+    """生成一次规划任务的 run id"""
+    return uuid.uuid4().hex[:12]
+
+
+def is_valid_run_id(run_id) -> bool:
+    """客户端传入的 run id 会拼进检查点目录，只接受 new_run_id() 生成的格式"""
+    return isinstance(run_id, str) and _RUN_ID.fullmatch(run_id) is not None
+
+
+class CheckpointStore:
+    """
+    按 (city, days, run_id) 保存流水线各阶段的中间结果。
+
+    每个阶段写成一个 JSON 文件；写入先落到临时文件再原子替换，
+    进程中途崩溃也不会留下半截的检查点。重试时带上同一个 run_id，
+    已完成的阶段直接从检查点读取，不再重复搜索和调用模型。
+    """
+
+    def __init__(self, city: str, days: int, run_id: Optional[str] = None, root: str = CHECKPOINT_DIR):
+        if run_id is not None and not is_valid_run_id(run_id):
+            raise ValueError(f"无效的 run_id: {run_id!r}")
+        self.city = city
+        self.days = days
+        self.run_id = run_id or new_run_id()
+        # clear() 会删除整个目录，路径必须落在检查点根目录之下（城市名同样来自客户端）
+        root = os.path.realpath(root)
+        self.path = os.path.realpath(os.path.join(root, f"{city}{days}天", self.run_id))
+        if os.path.dirname(os.path.dirname(self.path)) != root:
+            raise ValueError(f"检查点路径超出 {root}: {city}{days}天/{self.run_id}")
+
+    def _stage_file(self, stage: str) -> str:
+        return os.path.join(self.path, f"{stage}.json")
+
+    def has(self, stage: str) -> bool:
+        return os.path.exists(self._stage_file(stage))
+
+    def load(self, stage: str, default: Any = None) -> Any:
+        try:
+            with open(self._stage_file(stage), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except json.JSONDecodeError:
+            print(f"检查点 {stage} 已损坏，将重新执行该阶段")
+            return default
+
+    def save(self, stage: str, value: Any) -> None:
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_file = self._stage_file(stage) + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_file, self._stage_file(stage))
+        except Exception as e:
+            # 检查点只是加速重试，写入失败不影响本次规划
+            print(f"保存检查点 {stage} 失败: {str(e)}")
+
+    def discard(self, stage: str) -> None:
+        """丢弃某个阶段的检查点，重试时该阶段会重新执行"""
+        try:
+            os.remove(self._stage_file(stage))
+        except FileNotFoundError:
+            pass
+
+    def stages(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            name[:-len(".json")] for name in os.listdir(self.path) if name.endswith(".json")
+        )
+
+    def clear(self) -> None:
+        """规划成功后清理本次运行的所有检查点"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _last_write(path: str) -> float:
+    """运行目录及其中检查点文件最后一次写入的时间"""
+    latest = os.path.getmtime(path)
+    for name in os.listdir(path):
+        try:
+            latest = max(latest, os.path.getmtime(os.path.join(path, name)))
+        except OSError:
+            pass
+    return latest
+
+
+def purge_expired(root: str = CHECKPOINT_DIR, ttl_hours: float = CHECKPOINT_TTL_HOURS) -> int:
+    """
+    删除超过 ttl_hours 没有写入的运行目录，返回删除的数量。
+
+    成功的运行会自己 clear()；留下来的是失败、降级或被放弃的运行，过期后用同一个 run_id 重试只会从头开始。
+    """
+    if ttl_hours <= 0:
+        return 0
+    cutoff = time.time() - ttl_hours * 3600
+    removed = 0
+    try:
+        plan_dirs = os.listdir(root)
+    except FileNotFoundError:
+        return 0
+    for plan_dir in plan_dirs:
+        plan_dir = os.path.join(root, plan_dir)
+        try:
+            run_dirs = os.listdir(plan_dir)
+        except (NotADirectoryError, FileNotFoundError):
+            continue
+        for run_id in run_dirs:
+            run_dir = os.path.join(plan_dir, run_id)
+            try:
+                if os.path.isdir(run_dir) and _last_write(run_dir) < cutoff:
+                    shutil.rmtree(run_dir, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+        try:
+            os.rmdir(plan_dir)  # 只会删除已经清空的目录
+        except OSError:
+            pass
+    return removed
+
+
+_last_purge = 0.0
+_purge_lock = threading.Lock()
+
+
+def maybe_purge_expired(root: str = CHECKPOINT_DIR, ttl_hours: float = CHECKPOINT_TTL_HOURS,
+                        interval: float = CHECKPOINT_PURGE_INTERVAL_SECONDS) -> int:
+    """每次规划前调用；每个进程每 interval 秒最多扫描一次"""
+    global _last_purge
+    with _purge_lock:
+        now = time.monotonic()
+        if _last_purge and now - _last_purge < interval:
+            return 0
+        _last_purge = now
+    removed = purge_expired(root, ttl_hours)
+    if removed:
+        print(f"已清理 {removed} 个过期的检查点目录")
+    return removed
@@ -0,0 +1,59 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# /get_travel_plan 的默认总时限（秒），请求体中的 timeout 可以覆盖；0 表示不限时
+PLAN_SLA_SECONDS = float(os.getenv("PLAN_SLA_SECONDS", "240"))
+# 剩余时间少于该值时跳过可选的搜索阶段（local_food），把时间留给 base 攻略和实体提取
+PLAN_OPTIONAL_STAGE_RESERVE_SECONDS = float(os.getenv("PLAN_OPTIONAL_STAGE_RESERVE_SECONDS", "120"))
+# 剩余时间少于该值时不再请求 Serper 图片搜索，只使用已缓存的图片
+PLAN_IMAGE_RESERVE_SECONDS = float(os.getenv("PLAN_IMAGE_RESERVE_SECONDS", "5"))
+
+# 当前请求的截止时刻（time.monotonic），None 表示不限时；后台预热等任务不设置
+_deadline: contextvars.ContextVar = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """请求的总时限已用完"""
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float]):
+    """在 with 块内设置请求的总时限；嵌套时取更早的截止时刻"""
+    end = time.monotonic() + seconds if seconds and seconds > 0 else None
+    outer = _deadline.get()
+    if outer is not None and (end is None or outer < end):
+        end = outer
+    token = _deadline.set(end)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的秒数，不限时返回 None"""
+    end = _deadline.get()
+    return None if end is None else max(0.0, end - time.monotonic())
+
+
+def has_time(seconds: float) -> bool:
+    left = remaining()
+    return left is None or left >= seconds
+
+
+def time_left(limit: float) -> float:
+    """单次调用可用的超时时间：不超过 limit，也不超过请求剩余时间"""
+    left = remaining()
+    return limit if left is None else min(limit, left)
+
+
+def check(label: str = "") -> None:
+    if remaining() == 0:
+        raise DeadlineExceeded(f"{label}请求已超过总时限")
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from storage import STORAGE_DIR
+
+# 城市级实体池：景点、美食、店铺及其图片与天数无关，可以在不同天数的攻略之间复用
+ENTITY_POOL_DIR = os.path.join(STORAGE_DIR, "entity_pool")
+ENTITY_POOL_TTL_HOURS = float(os.getenv("ENTITY_POOL_TTL_HOURS", "168"))
+# 每天至少需要多少个景点，实体池才足够直接生成攻略
+ENTITY_POOL_MIN_ATTRACTIONS_PER_DAY = float(os.getenv("ENTITY_POOL_MIN_ATTRACTIONS_PER_DAY", "1"))
+# 用实体池生成 N 天攻略时，每天最多取多少个景点、美食、店铺；攻略摘要最多取 N 条
+ENTITY_POOL_PER_DAY = {
+    "attractions": int(os.getenv("ENTITY_POOL_ATTRACTIONS_PER_DAY", "4")),
+    "foods": int(os.getenv("ENTITY_POOL_FOODS_PER_DAY", "3")),
+    "shops": int(os.getenv("ENTITY_POOL_SHOPS_PER_DAY", "2")),
+    "guides": 1,
+}
+
+# 实体池中的分组名与攻略 JSON 中的字段名
+POOL_SECTIONS = {
+    "attractions": "景点",
+    "foods": "美食",
+    "shops": "美食店铺",
+}
+
+_pool_lock = threading.Lock()
+
+
+def pool_path(city: str) -> str:
+    """城市实体池的文件路径；城市名来自客户端，路径必须落在实体池目录之下"""
+    root = os.path.realpath(ENTITY_POOL_DIR)
+    path = os.path.realpath(os.path.join(root, f"{city}.json"))
+    if not city or os.path.dirname(path) != root:
+        raise ValueError(f"实体池路径超出 {root}: {city}.json")
+    return path
+
+
+def load_pool(city: str, ttl_hours: float = ENTITY_POOL_TTL_HOURS) -> Optional[Dict[str, Any]]:
+    """读取未过期的城市实体池，不存在、已过期或城市名无效时返回 None"""
+    try:
+        with open(pool_path(city), "r", encoding="utf-8") as f:
+            pool = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if ttl_hours > 0 and time.time() - pool.get("updated_at", 0) > ttl_hours * 3600:
+        return None
+    return pool
+
+
+def is_pool_sufficient(pool: Optional[Dict[str, Any]], days: int) -> bool:
+    """实体池是否足以直接生成 days 天的攻略"""
+    if not pool:
+        return False
+    enough_attractions = len(pool.get("attractions", [])) >= days * ENTITY_POOL_MIN_ATTRACTIONS_PER_DAY
+    has_food = bool(pool.get("foods") or pool.get("shops"))
+    return enough_attractions and has_food
+
+
+def select_for_days(pool: Dict[str, Any], days: int) -> Dict[str, Any]:
+    """
+    从实体池中为 days 天的攻略挑选实体。
+
+    每个分组最多取 days × ENTITY_POOL_PER_DAY 个，有图片的实体排在前面，其余保持实体池中的顺序。
+    """
+    selected = dict(pool)
+    for section, per_day in ENTITY_POOL_PER_DAY.items():
+        items = sorted(pool.get(section, []), key=lambda item: not item.get("图片url"))
+        selected[section] = items[:max(1, days) * per_day]
+    return selected
+
+
+def _merge(old: List[Dict[str, Any]], new: List[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    """按 key 合并两组实体，新数据覆盖旧数据，但不会用空图片覆盖已有图片"""
+    merged = {item.get(key): dict(item) for item in old if item.get(key)}
+    for item in new:
+        name = item.get(key)
+        if not name:
+            continue
+        if name in merged and not item.get("图片url") and merged[name].get("图片url"):
+            item = dict(item, **{"图片url": merged[name]["图片url"]})
+        merged[name] = dict(item)
+    return list(merged.values())
+
+
+def update_pool(city: str, plan: Dict[str, Any], guides: Optional[List[Dict[str, Any]]] = None,
+                replace: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    把一份攻略中的实体合并进城市实体池，返回更新后的实体池。
+
+    replace 中列出的分组（如刷新美食后的 "foods"、"shops"）直接用攻略中的内容替换，不与旧数据合并。
+    """
+    replace = set(replace)
+    with _pool_lock:
+        pool = load_pool(city, ttl_hours=0) or {"city": city}
+        for section, plan_key in POOL_SECTIONS.items():
+            old = [] if section in replace else pool.get(section, [])
+            pool[section] = _merge(old, plan.get(plan_key, []), "name")
+        if guides:
+            pool["guides"] = _merge(pool.get("guides", []), guides, "title")
+        pool["updated_at"] = time.time()
+        try:
+            os.makedirs(ENTITY_POOL_DIR, exist_ok=True)
+            tmp_file = pool_path(city) + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(pool, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_file, pool_path(city))
+        except Exception as e:
+            print(f"保存实体池时出错: {str(e)}")
+        return pool
@@ -0,0 +1,52 @@
+import json
+from typing import Any, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson 可选：安装后序列化快数倍，没有时退回标准库 json，输出格式相同（紧凑、不转义中文）
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """紧凑的 UTF-8 JSON，用于网络传输和内部缓存"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """让 jsonify 和 request.get_json 使用 orjson，输出紧凑格式"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None or kwargs.get("indent"):
+            return super().dumps(obj, **kwargs)
+        try:
+            return dumps(obj)
+        except TypeError:
+            # orjson 不支持的类型交给 Flask 默认的处理方式（如 Decimal）
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = dumps_bytes(obj)
+        except TypeError:
+            body = super().dumps(obj).encode("utf-8")
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,271 @@
+import os
+import json
+import math
+import importlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from prompt_budget import truncate_text
+from storage import STORAGE_DIR
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 离线地名库：storage/gazetteer/{城市}.json，格式为 {"名称": [纬度, 经度], ...}
+GAZETTEER_DIR = os.getenv("GAZETTEER_DIR", os.path.join(STORAGE_DIR, "gazetteer"))
+# 仓库自带的示例地名库（目前只有深圳，坐标为近似值），GAZETTEER_DIR 中没有该城市时使用
+GAZETTEER_SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer")
+# 自定义地名库，格式为 "模块名:类名"，类需要实现 lookup(city, name)
+GAZETTEER_CLASS = os.getenv("GAZETTEER_CLASS", "")
+# 至少解析出多少个景点坐标才启用本地路线规划
+GEO_MIN_RESOLVED = int(os.getenv("GEO_MIN_RESOLVED", "2"))
+# 2-opt 最多迭代轮数
+GEO_TWO_OPT_ROUNDS = int(os.getenv("GEO_TWO_OPT_ROUNDS", "20"))
+# 提示词中每天最多列出的可选餐饮数量
+GEO_MEALS_PER_DAY = int(os.getenv("GEO_MEALS_PER_DAY", "4"))
+
+Coord = Tuple[float, float]
+
+
+class Gazetteer:
+    """地名库接口：把城市内的景点或店铺名称解析成 (纬度, 经度)"""
+
+    def lookup(self, city: str, name: str) -> Optional[Coord]:
+        raise NotImplementedError
+
+
+class JsonGazetteer(Gazetteer):
+    """
+    基于本地 JSON 文件的离线地名库。
+
+    先精确匹配名称，再做包含匹配（如"世界之窗景区"能匹配到"世界之窗"），
+    取名称最长的候选，保证结果确定。按顺序在 directories 中查找城市文件，使用第一个存在的。
+    """
+
+    def __init__(self, directories: Sequence[str] = (GAZETTEER_DIR, GAZETTEER_SAMPLE_DIR)):
+        self.directories = [directories] if isinstance(directories, str) else list(directories)
+        self._cache: Dict[str, Dict[str, Coord]] = {}
+
+    def _load(self, city: str) -> Dict[str, Coord]:
+        if city not in self._cache:
+            self._cache[city] = {}
+            for directory in self.directories:
+                try:
+                    with open(os.path.join(directory, f"{city}.json"), "r", encoding="utf-8") as f:
+                        raw = json.load(f)
+                    self._cache[city] = {name: (float(lat), float(lon)) for name, (lat, lon) in raw.items()}
+                    break
+                except FileNotFoundError:
+                    continue
+                except (OSError, ValueError, TypeError):
+                    break
+        return self._cache[city]
+
+    def lookup(self, city: str, name: str) -> Optional[Coord]:
+        places = self._load(city)
+        if not name:
+            return None
+        if name in places:
+            return places[name]
+        candidates = [known for known in places if known in name or name in known]
+        if not candidates:
+            return None
+        return places[max(candidates, key=lambda known: (len(known), known))]
+
+
+_gazetteer: Optional[Gazetteer] = None
+
+
+def get_gazetteer() -> Gazetteer:
+    global _gazetteer
+    if _gazetteer is None:
+        if GAZETTEER_CLASS:
+            module_name, class_name = GAZETTEER_CLASS.split(":")
+            _gazetteer = getattr(importlib.import_module(module_name), class_name)()
+        else:
+            _gazetteer = JsonGazetteer()
+    return _gazetteer
+
+
+def set_gazetteer(gazetteer: Gazetteer) -> None:
+    global _gazetteer
+    _gazetteer = gazetteer
+
+
+def distance_matrix(coords: Sequence[Coord]) -> List[List[float]]:
+    """两两之间的球面距离（公里），有 numpy 时向量化计算"""
+    if np is not None:
+        points = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+        lat, lon = points[:, 0:1], points[:, 1:2]
+        a = (np.sin((lat - lat.T) / 2) ** 2
+             + np.cos(lat) * np.cos(lat.T) * np.sin((lon - lon.T) / 2) ** 2)
+        return (6371.0 * 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))).tolist()
+
+    def haversine(p: Coord, q: Coord) -> float:
+        lat1, lon1, lat2, lon2 = map(math.radians, (p[0], p[1], q[0], q[1]))
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        return 6371.0 * 2 * math.asin(math.sqrt(min(1.0, a)))
+
+    return [[haversine(p, q) for q in coords] for p in coords]
+
+
+def k_medoids(dist: List[List[float]], k: int, max_iter: int = 20) -> List[List[int]]:
+    """
+    带容量约束的 k-medoids 聚类，每簇最多 ceil(n/k) 个点，保证每天的景点数量均衡。
+
+    初始中心点取总距离最小的点，再依次取离已有中心最远的点，结果完全确定。
+    """
+    n = len(dist)
+    k = max(1, min(k, n))
+    capacity = math.ceil(n / k)
+    medoids = [min(range(n), key=lambda i: (sum(dist[i]), i))]
+    while len(medoids) < k:
+        medoids.append(max(
+            (i for i in range(n) if i not in medoids),
+            key=lambda i: (min(dist[i][m] for m in medoids), -i)
+        ))
+
+    clusters: List[List[int]] = []
+    for _ in range(max_iter):
+        # 按距离从近到远分配，簇满了就分给下一个最近的中心
+        assignment = {}
+        sizes = [0] * k
+        pairs = sorted((dist[i][m], i, c) for i in range(n) for c, m in enumerate(medoids))
+        for _, i, c in pairs:
+            if i not in assignment and sizes[c] < capacity:
+                assignment[i] = c
+                sizes[c] += 1
+        clusters = [[i for i in range(n) if assignment[i] == c] for c in range(k)]
+
+        new_medoids = [
+            min(members, key=lambda i: (sum(dist[i][j] for j in members), i)) if members else medoids[c]
+            for c, members in enumerate(clusters)
+        ]
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+    return clusters
+
+
+def _route_length(dist: List[List[float]], route: List[int]) -> float:
+    return sum(dist[a][b] for a, b in zip(route, route[1:]))
+
+
+def order_stops(dist: List[List[float]], members: List[int]) -> List[int]:
+    """最近邻构造一条不回起点的路线，再用 2-opt 消除交叉"""
+    if len(members) <= 2:
+        return list(members)
+    # 从离其他点最远的端点出发
+    start = max(members, key=lambda i: (sum(dist[i][j] for j in members), -i))
+    route = [start]
+    remaining = [i for i in members if i != start]
+    while remaining:
+        nearest = min(remaining, key=lambda j: (dist[route[-1]][j], j))
+        route.append(nearest)
+        remaining.remove(nearest)
+
+    for _ in range(GEO_TWO_OPT_ROUNDS):
+        improved = False
+        for i in range(1, len(route) - 1):
+            for j in range(i + 1, len(route)):
+                candidate = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                if _route_length(dist, candidate) < _route_length(dist, route) - 1e-9:
+                    route = candidate
+                    improved = True
+        if not improved:
+            break
+    return route
+
+
+def plan_days(data: Dict[str, Any], days: int, gazetteer: Optional[Gazetteer] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    为攻略数据生成确定的每日骨架：景点按地理位置聚类到每一天并排好顺序，
+    美食分配到离当天景点最近的一天。
+
+    Returns:
+        list: [{"day": 1, "stops": [...], "meals": [...], "total_km": 12.3}, ...]；
+        能解析坐标的景点太少时返回 None，由模型自行规划。
+    """
+    gazetteer = gazetteer or get_gazetteer()
+    city = data.get("city", "")
+    days = max(1, int(days))
+
+    spots = data.get("景点", [])
+    located = []
+    unlocated = []
+    for spot in spots:
+        coord = gazetteer.lookup(city, spot.get("name", ""))
+        (located if coord else unlocated).append((spot, coord))
+    if len(located) < GEO_MIN_RESOLVED:
+        return None
+
+    dist = distance_matrix([coord for _, coord in located])
+    clusters = [order_stops(dist, members) for members in k_medoids(dist, days)]
+    # 按每天第一站的经度、纬度排列天数，保证结果可复现
+    clusters.sort(key=lambda route: (located[route[0]][1][1], located[route[0]][1][0]) if route else (math.inf, math.inf))
+    while len(clusters) < days:
+        clusters.append([])
+
+    plan = []
+    for day, route in enumerate(clusters, 1):
+        stops = []
+        for position, index in enumerate(route):
+            spot, coord = located[index]
+            leg = dist[route[position - 1]][index] if position else 0.0
+            stops.append(dict(spot, lat=coord[0], lon=coord[1], leg_km=round(leg, 1)))
+        plan.append({
+            "day": day,
+            "stops": stops,
+            "meals": [],
+            "total_km": round(_route_length(dist, route), 1),
+        })
+
+    # 无法定位的景点放到景点最少的那天末尾
+    for spot, _ in unlocated:
+        target = min(plan, key=lambda d: (len(d["stops"]), d["day"]))
+        target["stops"].append(dict(spot, leg_km=None))
+
+    # 美食：能定位的放到最近的一天，其余轮流分配
+    foods = data.get("美食", []) + data.get("美食店铺", [])
+    turn = 0
+    for food in foods:
+        coord = gazetteer.lookup(city, food.get("name", ""))
+        located_days = [d for d in plan if any("lat" in s for s in d["stops"])]
+        if coord and located_days:
+            def nearest_km(d):
+                points = [(s["lat"], s["lon"]) for s in d["stops"] if "lat" in s]
+                return min(distance_matrix([coord] + points)[0][1:])
+            target = min(located_days, key=lambda d: (nearest_km(d), d["day"]))
+        else:
+            target = plan[turn % len(plan)]
+            turn += 1
+        target["meals"].append(food)
+    return plan
+
+
+def format_skeleton(plan: List[Dict[str, Any]], url_mapper=None, desc_chars: Optional[int] = None) -> str:
+    """把每日骨架渲染成提示词文本，图片URL可替换成短id，描述可截断到 desc_chars 个字符"""
+    def picurl(url: str) -> str:
+        return url_mapper.shorten(url) if url_mapper is not None else url
+
+    def describe(text) -> str:
+        return truncate_text(text, desc_chars) if desc_chars else text
+
+    lines = []
+    for day in plan:
+        lines.append(f"Day{day['day']}（景点间合计约 {day['total_km']} 公里）：")
+        for i, stop in enumerate(day["stops"], 1):
+            leg = f"，距上一站约 {stop['leg_km']} 公里" if stop.get("leg_km") else ""
+            lines.append(f"  {i}. {stop.get('name', '')}{leg}")
+            if stop.get("describe"):
+                lines.append(f"     - 描述：{describe(stop['describe'])}")
+            if stop.get("图片url"):
+                lines.append(f"     - 图片URL：{picurl(stop['图片url'])}")
+        if day["meals"]:
+            lines.append("  可选餐饮：")
+            for meal in day["meals"][:GEO_MEALS_PER_DAY]:
+                lines.append(f"   - {meal.get('name', '')}：{describe(meal.get('describe', ''))}")
+                if meal.get("图片url"):
+                    lines.append(f"     - 图片URL：{picurl(meal['图片url'])}")
+    return "\n".join(lines)
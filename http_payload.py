@@ -0,0 +1,77 @@
+import os
+import gzip
+from typing import Optional
+
+from flask import Flask, Response, request
+
+from fast_json import FastJSONProvider
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+# 只压缩这些类型
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "application/x-ndjson")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择压缩方式：优先 br（安装了 brotli 时），其次 gzip"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    # mtime=0 保证相同内容压缩结果相同，ETag 才能稳定
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def finalize_response(response: Response) -> Response:
+    """
+    after_request 钩子：压缩响应体，并为 GET 请求加上 ETag、处理 If-None-Match（返回 304）。
+
+    流式响应和 send_file 的文件响应保持原样。
+    """
+    if response.is_streamed or response.direct_passthrough or response.status_code != 200:
+        return response
+
+    if response.mimetype in COMPRESSIBLE_TYPES and "Content-Encoding" not in response.headers:
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+        if encoding and len(data) >= COMPRESS_MIN_BYTES:
+            response.set_data(compress(data, encoding))
+            response.headers["Content-Encoding"] = encoding
+
+    # ETag 按实际发送的内容计算，不同压缩方式的表示各有自己的 ETag
+    if request.method in ("GET", "HEAD"):
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+def install(app: Flask) -> None:
+    """为服务启用 orjson 序列化、响应压缩和条件请求"""
+    app.json = FastJSONProvider(app)
+    app.after_request(finalize_response)
@@ -0,0 +1,371 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+if TYPE_CHECKING:
+    from camel.agents import ChatAgent
+
+from dotenv import load_dotenv
+
+from deadline import check, remaining, time_left
+from rate_limit import call_upstream, get_limiter
+
+# camel 导入较慢，只在第一次创建模型或 Agent 时导入，见 create_model / create_agent
+
+load_dotenv()
+
+SMALL = "small"
+LARGE = "large"
+
+MODELSCOPE_URL = "https://api-inference.modelscope.cn/v1"
+
+# 模型档位：小模型负责抽取、重排序等简单任务，大模型只负责生成攻略和行程
+# 每个档位都可以在 .env 中单独配置模型、地址、密钥、超时和限流器名称
+MODEL_TIERS = {
+    SMALL: {
+        "model": os.getenv("MODEL_SMALL", "Qwen/Qwen2.5-7B-Instruct"),
+        "url": os.getenv("MODEL_SMALL_URL", MODELSCOPE_URL),
+        "api_key_env": os.getenv("MODEL_SMALL_API_KEY_ENV", "QWEN_API_KEY"),
+        "timeout": float(os.getenv("MODEL_SMALL_TIMEOUT", "30")),
+        "upstream": os.getenv("MODEL_SMALL_UPSTREAM", "modelscope"),
+    },
+    LARGE: {
+        "model": os.getenv("MODEL_LARGE", "Qwen/Qwen2.5-72B-Instruct"),
+        "url": os.getenv("MODEL_LARGE_URL", MODELSCOPE_URL),
+        "api_key_env": os.getenv("MODEL_LARGE_API_KEY_ENV", "QWEN_API_KEY"),
+        "timeout": float(os.getenv("MODEL_LARGE_TIMEOUT", "180")),
+        "upstream": os.getenv("MODEL_LARGE_UPSTREAM", "modelscope"),
+    },
+}
+
+# 任务 -> 默认档位，可用 MODEL_TIER_<TASK>=large 覆盖
+TASK_TIERS = {
+    "extract": SMALL,      # part1：提取城市和天数
+    "rerank": SMALL,       # part2：搜索结果重排序
+    "entity": SMALL,       # part2：景点、美食实体提取
+    "base_guide": LARGE,   # part2：生成 base 攻略
+    "itinerary": LARGE,    # part3：生成行程
+}
+
+# --- 对冲请求（hedged request）配置 ---
+# 一次调用耗时超过该任务历史延迟的这个分位数时，再发一个相同的请求，取先返回的结果
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# 至少积累多少次延迟样本后才开始对冲，样本太少时分位数不可靠
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# 对冲等待的下限（秒），避免极快的任务也频繁对冲
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "2"))
+# 每个 (任务, 档位) 保留的最近延迟样本数
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# 执行模型调用的线程数（包括被放弃、仍在等待返回的请求）
+LLM_CALL_WORKERS = int(os.getenv("LLM_CALL_WORKERS", "32"))
+# 设置为 0 关闭对冲，只保留单次调用的截止时间
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") != "0"
+
+_models: Dict[Any, Any] = {}
+_models_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=LLM_CALL_WORKERS, thread_name_prefix="llm-call")
+
+
+def tier_for(task: str) -> str:
+    tier = os.getenv(f"MODEL_TIER_{task.upper()}", TASK_TIERS.get(task, LARGE))
+    return tier if tier in MODEL_TIERS else LARGE
+
+
+def create_model(tier: str = LARGE, temperature: Optional[float] = None):
+    """创建（并缓存）某个档位的模型，同一档位和温度的模型在进程内共享"""
+    key = (tier, temperature)
+    with _models_lock:
+        if key not in _models:
+            from camel.configs import QwenConfig
+            from camel.models import ModelFactory
+            from camel.types import ModelPlatformType
+
+            config = MODEL_TIERS[tier]
+            model_config = QwenConfig(temperature=temperature).as_dict() if temperature is not None else None
+            _models[key] = ModelFactory.create(
+                model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+                model_type=config["model"],
+                url=config["url"],
+                api_key=os.getenv(config["api_key_env"]),
+                model_config_dict=model_config,
+                timeout=config["timeout"],
+            )
+        return _models[key]
+
+
+def create_agent(task: str, system_message: str, tier: Optional[str] = None,
+                 temperature: Optional[float] = None, **kwargs) -> "ChatAgent":
+    """按任务路由到对应档位的模型，创建 ChatAgent"""
+    from camel.agents import ChatAgent
+
+    tier = tier or tier_for(task)
+    return ChatAgent(
+        system_message=system_message,
+        model=create_model(tier, temperature),
+        **kwargs
+    )
+
+
+class LatencyStats:
+    """某个 (任务, 档位) 最近的调用延迟，以及对冲请求的次数和胜出次数"""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def hedge_delay(self) -> Optional[float]:
+        """发出对冲请求前的等待时间，样本不足时返回 None（不对冲）"""
+        if len(self.samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(LLM_HEDGE_MIN_DELAY_SECONDS, self.percentile(LLM_HEDGE_PERCENTILE))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_win_rate": round(self.hedge_wins / self.hedged, 3) if self.hedged else None,
+            "timeouts": self.timeouts,
+            "samples": len(self.samples),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+_latency: Dict[Tuple[str, str], LatencyStats] = {}
+_latency_lock = threading.Lock()
+
+
+def latency_stats(task: str, tier: str) -> LatencyStats:
+    with _latency_lock:
+        if (task, tier) not in _latency:
+            _latency[(task, tier)] = LatencyStats()
+        return _latency[(task, tier)]
+
+
+def llm_metrics() -> Dict[str, Dict[str, Any]]:
+    with _latency_lock:
+        stats = dict(_latency)
+    return {f"{task}:{tier}": s.metrics() for (task, tier), s in sorted(stats.items())}
+
+
+def step(agent: "ChatAgent", prompt: str, tier: str = LARGE, abandoned: Optional[threading.Event] = None):
+    """
+    经过该档位对应上游的限流器调用 agent.step。
+
+    abandoned 已设置（hedged_step 已经放弃这次调用）时，拿到限流名额后不再发出请求、立即归还名额。
+    """
+    def call():
+        if abandoned is not None and abandoned.is_set():
+            raise CancelledError("调用已被放弃")
+        return agent.step(prompt)
+
+    return call_upstream(MODEL_TIERS[tier]["upstream"], call)
+
+
+def _submit(fn: Callable[[], Any]):
+    # 在工作线程中保留调用方的上下文（如 rate_limit.priority 设置的优先级）
+    context = contextvars.copy_context()
+    started = time.monotonic()
+    future = _executor.submit(context.run, fn)
+    future.started = started
+    return future
+
+
+def hedged_step(
+    task: str,
+    agent: "ChatAgent",
+    prompt: str,
+    tier: str = LARGE,
+    hedge_factory: Optional[Callable[[str], "ChatAgent"]] = None,
+    deadline: Optional[float] = None,
+):
+    """
+    带截止时间和对冲请求的 step。
+
+    Args:
+        task (str): 任务名，用于统计延迟.
+        agent (ChatAgent): 主请求使用的 Agent.
+        prompt (str): 用户提示词.
+        tier (str): 模型档位.
+        hedge_factory (callable): hedge_factory(tier) -> 新的 ChatAgent。
+            ChatAgent 有会话状态，不能并发使用，对冲请求必须用单独的 Agent；不提供时不对冲.
+        deadline (float): 本次调用最多等待的秒数，默认取档位的超时时间；
+            在 deadline.request_deadline 内调用时不会超过请求剩余的时间.
+
+    Returns:
+        先返回的那个请求的响应。超过截止时间时抛出 TimeoutError。
+        落后的请求无法中断（camel 的调用是阻塞的），只会在后台跑完后被丢弃：
+        还在排队等限流名额的不会再发出；已经发出的继续占用一个并发名额，最长为档位超时时间。
+        因此主请求和对冲请求都必须用调用方独占的 Agent，且上游没有空闲名额时不发对冲请求，
+        避免被放弃的调用占满名额。
+    """
+    stats = latency_stats(task, tier)
+    check(f"{task} 任务：")
+    deadline = time_left(MODEL_TIERS[tier]["timeout"] if deadline is None else deadline)
+    end = time.monotonic() + deadline
+    with stats.lock:
+        stats.calls += 1
+
+    upstream = MODEL_TIERS[tier]["upstream"]
+    abandoned = threading.Event()
+    primary = _submit(lambda: step(agent, prompt, tier, abandoned))
+    pending = {primary}
+    hedge = None
+    delay = stats.hedge_delay() if LLM_HEDGE_ENABLED and hedge_factory is not None else None
+
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            with stats.lock:
+                stats.timeouts += 1
+            abandoned.set()
+            for future in pending:
+                future.cancel()
+            raise TimeoutError(f"{task} 任务的模型调用超过 {deadline:.1f} 秒未返回")
+
+        timeout = remaining
+        if hedge is None and delay is not None:
+            timeout = min(remaining, max(0.0, primary.started + delay - time.monotonic()))
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            pending.discard(future)
+            if future.exception() is not None and pending:
+                # 其中一个失败时继续等另一个
+                continue
+            abandoned.set()
+            for loser in pending:
+                loser.cancel()
+            result = future.result()
+            stats.record(time.monotonic() - future.started)
+            if future is hedge:
+                with stats.lock:
+                    stats.hedge_wins += 1
+            return result
+
+        if hedge is None and delay is not None and time.monotonic() >= primary.started + delay:
+            if not get_limiter(upstream).has_capacity():
+                # 上游已经满载时对冲只会和其他请求抢名额，这次调用不再对冲
+                print(f"{task} 任务的模型调用超过 {delay:.1f} 秒，但 {upstream} 没有空闲名额，不发出对冲请求")
+                delay = None
+                continue
+            print(f"{task} 任务的模型调用超过 {delay:.1f} 秒（p{LLM_HEDGE_PERCENTILE:g}），发出对冲请求")
+            with stats.lock:
+                stats.hedged += 1
+            hedge_agent = hedge_factory(tier)
+            hedge = _submit(lambda: step(hedge_agent, prompt, tier, abandoned))
+            pending.add(hedge)
+
+
+def _record_usage(usage: Optional[Dict[str, Any]], response, tier: str) -> None:
+    """累加一次调用的 token 用量（来自模型返回的 usage，模型未返回时记为 0）"""
+    if usage is None:
+        return
+    tokens = (getattr(response, "info", None) or {}).get("usage") or {}
+    usage["calls"] = usage.get("calls", 0) + 1
+    usage["tier"] = tier
+    for key in ("prompt_tokens", "completion_tokens"):
+        usage[key] = usage.get(key, 0) + (tokens.get(key) or 0)
+
+
+def run_task(
+    task: str,
+    prompt: str,
+    agent_factory: Callable[[str], "ChatAgent"],
+    parse: Optional[Callable[[str], Any]] = None,
+    tier: Optional[str] = None,
+    hedge_factory: Optional[Callable[[str], "ChatAgent"]] = None,
+    deadline: Optional[float] = None,
+    usage: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    按任务档位执行一次模型调用。
+
+    Args:
+        task (str): 任务名，决定默认档位.
+        prompt (str): 用户提示词.
+        agent_factory (callable): agent_factory(tier) -> ChatAgent.
+        parse (callable): 校验模型输出，抛出异常表示解析失败.
+        tier (str): 指定档位，不指定时使用任务的默认档位.
+        hedge_factory (callable): 创建对冲请求用的新 Agent，见 hedged_step.
+        deadline (float): 单次模型调用的截止秒数.
+        usage (dict): 传入时累加本次调用（含升级重试）的 calls、prompt_tokens、completion_tokens 和最终档位.
+
+    Returns:
+        str: 模型输出。小模型的输出解析失败时自动升级到大模型重试一次。
+    """
+    tier = tier or tier_for(task)
+    response = hedged_step(task, agent_factory(tier), prompt, tier, hedge_factory, deadline)
+    _record_usage(usage, response, tier)
+    content = response.msgs[0].content
+    if parse is None:
+        return content
+    try:
+        parse(content)
+        return content
+    except Exception as e:
+        if tier == LARGE:
+            raise
+        print(f"{task} 任务的小模型输出解析失败（{str(e)}），升级到大模型重试")
+    response = hedged_step(task, agent_factory(LARGE), prompt, LARGE, hedge_factory, deadline)
+    _record_usage(usage, response, LARGE)
+    content = response.msgs[0].content
+    parse(content)
+    return content
+
+
+def warm_up(tasks: Iterable[str], temperature: Optional[float] = None) -> None:
+    """提前导入 camel 并创建这些任务会用到的模型，避免第一个请求承担初始化开销"""
+    for tier in sorted({tier_for(task) for task in tasks}):
+        create_model(tier, temperature)
+
+
+def stream_task(task: str, system_message: str, prompt: str,
+                temperature: Optional[float] = None, tier: Optional[str] = None) -> Iterator[str]:
+    """
+    以 token 流的形式执行一次无状态的模型调用，逐段返回生成的文本。
+
+    直接使用 OpenAI 兼容接口的 stream 模式；整个流式输出期间占用该上游的一个并发名额。
+    """
+    from openai import OpenAI
+
+    tier = tier or tier_for(task)
+    config = MODEL_TIERS[tier]
+    client = OpenAI(base_url=config["url"], api_key=os.getenv(config["api_key_env"]), timeout=config["timeout"])
+    request = {
+        "model": config["model"],
+        "messages": [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt},
+        ],
+        "stream": True,
+    }
+    if temperature is not None:
+        request["temperature"] = temperature
+
+    with get_limiter(config["upstream"]).slot(timeout=remaining()):
+        for chunk in client.chat.completions.create(**request):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
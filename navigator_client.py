@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 三个服务的地址，可在 .env 或环境变量中修改
+NAVIGATOR_EXTRACT_URL = os.getenv("NAVIGATOR_EXTRACT_URL", "http://localhost:5001")
+NAVIGATOR_PLAN_URL = os.getenv("NAVIGATOR_PLAN_URL", "http://localhost:5002")
+NAVIGATOR_ITINERARY_URL = os.getenv("NAVIGATOR_ITINERARY_URL", "http://localhost:5004")
+# 连接超时和读取超时（秒）；生成攻略和行程可能需要几分钟
+NAVIGATOR_CONNECT_TIMEOUT = float(os.getenv("NAVIGATOR_CONNECT_TIMEOUT", "5"))
+NAVIGATOR_READ_TIMEOUT = float(os.getenv("NAVIGATOR_READ_TIMEOUT", "600"))
+# 连接失败、GET 遇到 502/503 时的重试次数；攻略生成失败时带上 run_id 续跑的次数
+NAVIGATOR_RETRIES = int(os.getenv("NAVIGATOR_RETRIES", "2"))
+# 重试前退避的初始秒数，之后每次翻倍
+NAVIGATOR_BACKOFF_SECONDS = float(os.getenv("NAVIGATOR_BACKOFF_SECONDS", "0.5"))
+# 每个服务保持的 keep-alive 连接数
+NAVIGATOR_POOL_SIZE = int(os.getenv("NAVIGATOR_POOL_SIZE", "16"))
+
+
+class NavigatorError(Exception):
+    """服务返回错误状态码"""
+
+    def __init__(self, message: str, status_code: int, payload: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload or {}
+
+
+class NavigatorClient:
+    """
+    part1（提取）、part2（攻略）、part3（行程）三个服务的同步客户端。
+
+    所有请求共用一个 requests.Session：连接池复用 keep-alive 连接，连接失败和 GET 的 502/503 自动退避重试，
+    响应默认接受 gzip 压缩。Session 可以在多个线程间共享。
+
+    POST 只在连接失败（请求还没发出）时自动重试：服务端返回 503 说明上游正在限流，原样重发只会从头再跑一遍。
+    生成攻略失败时由 plan() 退避后带上响应里的 run_id 续跑，从上一个成功的阶段继续。
+
+    用法：
+        with NavigatorClient() as client:
+            info = client.extract("我想深圳玩3天")
+            plan = client.plan(info["city"], info["days"])
+            report = client.itinerary_html(info["city"], info["days"])
+    """
+
+    def __init__(
+        self,
+        extract_url: str = NAVIGATOR_EXTRACT_URL,
+        plan_url: str = NAVIGATOR_PLAN_URL,
+        itinerary_url: str = NAVIGATOR_ITINERARY_URL,
+        timeout: Tuple[float, float] = (NAVIGATOR_CONNECT_TIMEOUT, NAVIGATOR_READ_TIMEOUT),
+        retries: int = NAVIGATOR_RETRIES,
+        pool_size: int = NAVIGATOR_POOL_SIZE,
+        backoff: float = NAVIGATOR_BACKOFF_SECONDS,
+    ):
+        self.extract_url = extract_url.rstrip("/")
+        self.plan_url = plan_url.rstrip("/")
+        self.itinerary_url = itinerary_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,  # 读超时说明服务端还在生成，不重复提交
+            status=retries,
+            status_forcelist=(502, 503),
+            # 按状态码重试只用于幂等的请求；连接失败不受此限制，POST 也会重试
+            allowed_methods=frozenset({"GET", "DELETE"}),
+            backoff_factor=backoff,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=3, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "NavigatorClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _request(self, method: str, url: str, payload: Optional[Dict[str, Any]] = None, **kwargs) -> requests.Response:
+        response = self.session.request(method, url, json=payload, timeout=self.timeout, **kwargs)
+        if response.status_code >= 400:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {"error": response.text}
+            message = body.get("message") or body.get("error") or response.reason
+            raise NavigatorError(f"{url} 返回 {response.status_code}: {message}", response.status_code, body)
+        return response
+
+    def _post(self, url: str, payload: Dict[str, Any], **kwargs) -> requests.Response:
+        return self._request("POST", url, payload, **kwargs)
+
+    def extract(self, query: str) -> Dict[str, Any]:
+        """从用户输入中提取城市和天数（part1 /extract_travel_info）"""
+        return self._post(f"{self.extract_url}/extract_travel_info", {"query": query}).json()
+
+    def plan(self, city: str, days: int, refresh: bool = False, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        生成或读取攻略（part2 /get_travel_plan）。
+
+        Args:
+            city (str): 城市.
+            days (int): 天数.
+            refresh (bool): 忽略已保存的攻略，重新生成.
+            timeout (float): 服务端的请求时限（秒），不传时使用服务端的 PLAN_SLA_SECONDS.
+
+        Returns:
+            dict: 服务端响应，data 为攻略内容。生成失败时带上返回的 run_id 重试，从上一个成功的阶段继续。
+        """
+        payload: Dict[str, Any] = {"city": city, "days": days, "refresh": refresh}
+        if timeout is not None:
+            payload["timeout"] = timeout
+        for attempt in range(self.retries + 1):
+            try:
+                return self._post(f"{self.plan_url}/get_travel_plan", payload).json()
+            except NavigatorError as e:
+                run_id = e.payload.get("run_id")
+                if not run_id or attempt == self.retries:
+                    raise
+                wait = self.backoff * 2 ** attempt
+                print(f"{city}{days}天攻略生成失败（{e.status_code}），{wait:.1f} 秒后使用 run_id={run_id} 续跑")
+                time.sleep(wait)
+                payload["run_id"] = run_id
+
+    def stored_plan(self, city: str, days: int) -> Dict[str, Any]:
+        """读取已保存的攻略（part2 GET /travel_plan）"""
+        return self._request("GET", f"{self.plan_url}/travel_plan/{city}/{days}").json()
+
+    def plan_batch(self, items: Iterable[Tuple[str, int]], refresh: bool = False) -> Iterator[Dict[str, Any]]:
+        """批量规划（part2 /get_travel_plans），按完成顺序逐个返回每个城市的结果，最后是汇总"""
+        payload = {"items": [{"city": city, "days": days} for city, days in items], "refresh": refresh}
+        response = self._post(f"{self.plan_url}/get_travel_plans", payload, stream=True)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
+
+    def itinerary_html(self, city: str, days: int, refresh: bool = False, include_html: bool = True) -> Dict[str, Any]:
+        """生成行程 HTML（part3 /generate_itinerary_html）"""
+        payload = {"city": city, "days": days, "refresh": refresh, "include_html": include_html}
+        return self._post(f"{self.itinerary_url}/generate_itinerary_html", payload).json()
+
+    def itinerary_pdf(self, city: str, days: int, output_path: Optional[str] = None) -> bytes:
+        """生成行程 PDF（part3 /generate_itinerary_pdf），指定 output_path 时同时写入文件"""
+        response = self._post(f"{self.itinerary_url}/generate_itinerary_pdf", {"city": city, "days": days})
+        if output_path:
+            with open(output_path, "wb") as f:
+                f.write(response.content)
+        return response.content
+
+    def run_chain(self, query: str, include_html: bool = False) -> Dict[str, Any]:
+        """
+        对一条用户输入执行 提取 → 攻略 → 行程 的完整流程。
+
+        Returns:
+            dict: {"query", "extract", "plan", "itinerary", "error"}；信息不足或某一步失败时后面的步骤为 None。
+        """
+        result: Dict[str, Any] = {"query": query, "extract": None, "plan": None, "itinerary": None, "error": None}
+        try:
+            info = result["extract"] = self.extract(query)
+            if info.get("need_more_info") or not info.get("city") or not info.get("days"):
+                result["error"] = "需要更多信息"
+                return result
+            result["plan"] = self.plan(info["city"], info["days"])
+            result["itinerary"] = self.itinerary_html(info["city"], info["days"], include_html=include_html)
+        except (NavigatorError, requests.RequestException) as e:
+            result["error"] = str(e)
+        return result
+
+    def run_chains(self, queries: List[str], max_workers: int = 4, include_html: bool = False) -> List[Dict[str, Any]]:
+        """并发处理多条用户输入，结果顺序与 queries 相同"""
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda query: self.run_chain(query, include_html), queries))
+
+
+class AsyncNavigatorClient:
+    """
+    asyncio 版本的客户端。
+
+    底层仍是带连接池的 NavigatorClient，每个请求通过 asyncio.to_thread 在线程中执行，
+    不需要额外的 HTTP 依赖；concurrency 限制同时进行的请求数。
+    """
+
+    def __init__(self, concurrency: int = 8, **kwargs):
+        self._client = NavigatorClient(pool_size=max(concurrency, NAVIGATOR_POOL_SIZE), **kwargs)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _call(self, fn, *args, **kwargs):
+        async with self._semaphore:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def extract(self, query: str) -> Dict[str, Any]:
+        return await self._call(self._client.extract, query)
+
+    async def plan(self, city: str, days: int, refresh: bool = False, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await self._call(self._client.plan, city, days, refresh, timeout)
+
+    async def stored_plan(self, city: str, days: int) -> Dict[str, Any]:
+        return await self._call(self._client.stored_plan, city, days)
+
+    async def itinerary_html(self, city: str, days: int, refresh: bool = False,
+                             include_html: bool = True) -> Dict[str, Any]:
+        return await self._call(self._client.itinerary_html, city, days, refresh, include_html)
+
+    async def itinerary_pdf(self, city: str, days: int, output_path: Optional[str] = None) -> bytes:
+        return await self._call(self._client.itinerary_pdf, city, days, output_path)
+
+    async def run_chain(self, query: str, include_html: bool = False) -> Dict[str, Any]:
+        """与 NavigatorClient.run_chain 相同，但每一步单独占用并发名额，多条输入可以交错执行"""
+        result: Dict[str, Any] = {"query": query, "extract": None, "plan": None, "itinerary": None, "error": None}
+        try:
+            info = result["extract"] = await self.extract(query)
+            if info.get("need_more_info") or not info.get("city") or not info.get("days"):
+                result["error"] = "需要更多信息"
+                return result
+            result["plan"] = await self.plan(info["city"], info["days"])
+            result["itinerary"] = await self.itinerary_html(info["city"], info["days"], include_html=include_html)
+        except (NavigatorError, requests.RequestException) as e:
+            result["error"] = str(e)
+        return result
+
+    async def run_chains(self, queries: List[str], include_html: bool = False) -> List[Dict[str, Any]]:
+        return list(await asyncio.gather(*(self.run_chain(query, include_html) for query in queries)))
+
+    async def close(self) -> None:
+        self._client.close()
+
+    async def __aenter__(self) -> "AsyncNavigatorClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+
+if __name__ == "__main__":
+    # 示例：python navigator_client.py "我想深圳玩3天" "去成都玩2天"
+    import sys
+
+    queries = sys.argv[1:] or ["我想深圳玩3天，帮我规划一下行程"]
+    with NavigatorClient() as client:
+        for result in client.run_chains(queries):
+            print(json.dumps({key: result[key] for key in ("query", "error")}, ensure_ascii=False),
+                  "攻略:", bool(result["plan"]), "行程:", (result["itinerary"] or {}).get("file_path"))
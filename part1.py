@@ -7,14 +7,16 @@ from typing import Optional
 from flask import Flask, request, jsonify, Response
 
 from dotenv import load_dotenv
-from camel.configs import QwenConfig
-from camel.models import ModelFactory
-from camel.types import ModelPlatformType
-from camel.agents import ChatAgent
+from model_registry import create_agent, run_task, warm_up as warm_up_models
+from prewarm import log_request
+from service_routes import install as install_service_routes
+from shared_cache import get_shared_cache
 
 load_dotenv()
 
 API_KEY = os.getenv('QWEN_API_KEY')
+# 提取结果的缓存时间
+EXTRACT_CACHE_TTL_HOURS = float(os.getenv('EXTRACT_CACHE_TTL_HOURS', '24'))
 
 SYSTEM_PROMPT = """
 你是一个旅游信息提取助手。你的任务是从用户的输入中提取旅游目的地城市和行程天数，并根据提取情况决定是否需要用户补充信息。
@@ -58,35 +60,38 @@ SYSTEM_PROMPT = """
 """
 
 app = Flask(__name__)
-
-def create_travel_agent():
-    qwen_model = ModelFactory.create(
-        model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
-        model_type="Qwen/Qwen2.5-72B-Instruct",
-        api_key=API_KEY,
-        url="https://api-inference.modelscope.cn/v1",
-        model_config_dict=QwenConfig(temperature=0.2).as_dict(),
-    )
-
-    agent = ChatAgent(
-        system_message=SYSTEM_PROMPT,
-        model=qwen_model,
+# 压缩、条件请求、采样分析和 /metrics/* 路由，见 service_routes
+install_service_routes(app)
+
+def create_travel_agent(tier: Optional[str] = None):
+    # 城市和天数的提取很简单，默认路由到小模型（见 model_registry.TASK_TIERS）
+    agent = create_agent(
+        "extract",
+        SYSTEM_PROMPT,
+        tier=tier,
+        temperature=0.2,
         message_window_size=10,
         output_language='Chinese'
     )
     return agent
 
-travel_agent = create_travel_agent()
+# 每次调用都新建 Agent（模型在进程内共享，创建 Agent 只是构造对象）：
+# 被 hedged_step 放弃的调用返回时只会写入它自己的 Agent，不会污染下一个请求的会话历史。
+# 服务启动时不导入 camel、不连接模型
+
+def warm_up():
+    """可选的预热：提前导入 camel 并创建模型，设置 WARMUP_ON_START=1 时在启动时调用"""
+    warm_up_models(["extract"], temperature=0.2)
+
+def parse_travel_info(content: str) -> dict:
+    return json.loads(content.strip().replace("```json", "").replace("```", "").strip())
 
-def get_travel_info_camel(user_input: str, agent: ChatAgent) -> dict:
+def get_travel_info_camel(user_input: str, agent_factory=create_travel_agent) -> dict:
     try:
-        response = agent.step(user_input)
-        # 回到原始状态
-        agent.reset()
-        if not response or not response.msgs:
-            raise ValueError("模型没有返回任何消息")
-        json_output = response.msgs[0].content.strip().replace("```json", "").replace("```", "").strip()
-        json_output = json.loads(json_output)
+        # 主请求、对冲请求和升级到大模型的重试各用一个新的 Agent，不需要再 reset
+        content = run_task("extract", user_input, agent_factory, parse=parse_travel_info,
+                           hedge_factory=agent_factory)
+        json_output = parse_travel_info(content)
         json_output["query"] = user_input
         return json_output
     except json.JSONDecodeError:
@@ -120,7 +125,15 @@ def extract_travel_info():
         if not request_data or 'query' not in request_data:
             return jsonify({'error': '请求数据无效'}), 400
 
-        result = get_travel_info_camel(request_data['query'], travel_agent)
+        # 相同的输入在所有工作进程间只提取一次；提取失败（response 为空）的结果不缓存
+        query = request_data['query']
+        result = get_shared_cache().get_or_compute(
+            f"extract:{query}",
+            lambda: get_travel_info_camel(query),
+            EXTRACT_CACHE_TTL_HOURS * 3600,
+            should_cache=lambda value: value.get('response') is not None
+        )
+        log_request('extract_travel_info', result['city'], result['days'])
         response = {
             'city': result['city'],
             'days': result['days'],
@@ -134,4 +147,7 @@ def extract_travel_info():
         return jsonify({'error': f'服务器内部错误: {str(e)}'}), 500
 
 if __name__ == "__main__":
+    if os.getenv('WARMUP_ON_START') == '1':
+        warm_up()
+    # 单进程多线程运行；多进程部署用 gunicorn（见 README）
     app.run(host="0.0.0.0", port=5001)
\ No newline at end of file
@@ -1,20 +1,44 @@
-from camel.toolkits import SearchToolkit
-from camel.agents import ChatAgent
-from camel.models import ModelFactory
-from camel.types import ModelPlatformType
-from camel.loaders import Firecrawl
-from typing import List, Dict, Any
-
-from flask import Flask, request, jsonify
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+from prompt_budget import build_base_guide_prompt, build_pool_guide_prompt, count_tokens
+from service_routes import install as install_service_routes
+from rate_limit import BACKGROUND, call_upstream, is_throttled, priority
+from deadline import (PLAN_IMAGE_RESERVE_SECONDS, PLAN_OPTIONAL_STAGE_RESERVE_SECONDS, PLAN_SLA_SECONDS,
+                      check, has_time, remaining, request_deadline, time_left)
+from model_registry import create_agent, run_task, warm_up as warm_up_models
+from entity_pool import POOL_SECTIONS, load_pool, is_pool_sufficient, select_for_days, update_pool
+from plan_index import get_plan_index
+from checkpoint import CHECKPOINT_TTL_HOURS, CheckpointStore, is_valid_run_id, maybe_purge_expired
+from storage import STORAGE_DIR, PLAN_CACHE_TTL_HOURS, plan_path, load_fresh_plan, load_plan
+from shared_cache import get_shared_cache
+from prewarm import PREWARM_REFRESH_MARGIN_HOURS, PrewarmFailed, PrewarmScheduler, itinerary_warmer, log_request
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 import json
 import os
+import re
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from fast_json import dumps as dumps_json
 from dotenv import load_dotenv
 import requests # 确保顶部已导入
-import os
-import json
-import requests # 确保顶部已导入
 
-def search_serper_images(query: str, num_results: int = 1) -> list:
+# camel 只在第一次创建 Agent 时导入（见 model_registry）
+if TYPE_CHECKING:
+    from camel.agents import ChatAgent
+
+def is_upstream_failure(error: Exception) -> bool:
+    """上游限流（重试后仍为 429）或超时：调用方要把它当作失败，而不是"没有结果"。"""
+    return is_throttled(error) or isinstance(error, (TimeoutError, requests.Timeout))
+
+def post_json(url: str, headers: dict, payload: str) -> requests.Response:
+    # 超时不超过请求剩余的时间
+    check("Serper: ")
+    response = requests.post(url, headers=headers, data=payload, timeout=time_left(10))
+    response.raise_for_status()
+    return response
+
+def fetch_serper_images(query: str, num_results: int = 1) -> list:
     """
     使用 Serper API 进行图片搜索，稳定可靠。
 
@@ -43,8 +67,8 @@ def search_serper_images(query: str, num_results: int = 1) -> list:
     }
 
     try:
-        response = requests.post(url, headers=headers, data=payload, timeout=10)
-        response.raise_for_status()
+        # 经过 serper 限流器发出请求，429 时退避重试
+        response = call_upstream("serper", lambda: post_json(url, headers, payload))
         
         search_results = response.json().get('images', [])
         
@@ -60,9 +84,12 @@ def search_serper_images(query: str, num_results: int = 1) -> list:
         return formatted_results
 
     except Exception as e:
+        # 重试后仍被限流或超时时向上抛出，由调用方记录为失败的阶段，而不是当作"没有结果"
+        if is_upstream_failure(e):
+            raise
         print(f"Serper 图片搜索失败: {e}")
         return []
-def search_serper(query: str, num_results: int = 5) -> list:
+def fetch_serper(query: str, num_results: int = 5) -> list:
     """
     使用 Serper API 进行网络搜索，稳定可靠。
     """
@@ -76,8 +103,7 @@ def search_serper(query: str, num_results: int = 5) -> list:
     headers = {'X-API-KEY': api_key, 'Content-Type': 'application/json'}
 
     try:
-        response = requests.post(url, headers=headers, data=payload, timeout=10)
-        response.raise_for_status()
+        response = call_upstream("serper", lambda: post_json(url, headers, payload))
         
         search_results = response.json().get('organic', [])
         
@@ -94,184 +120,342 @@ def search_serper(query: str, num_results: int = 5) -> list:
         return formatted_results
 
     except Exception as e:
+        # 重试后仍被限流或超时时向上抛出，由调用方记录为失败的阶段，而不是当作"没有结果"
+        if is_upstream_failure(e):
+            raise
         print(f"Serper API 搜索失败: {e}")
         return []
 
+def serper_images_key(query: str, num_results: int = 1) -> str:
+    return f"serper:images:{num_results}:{query}"
+
+def search_serper_images(query: str, num_results: int = 1) -> list:
+    """图片搜索，结果在所有工作进程间共享缓存，同一关键词只请求一次 Serper"""
+    return get_shared_cache().get_or_compute(
+        serper_images_key(query, num_results),
+        lambda: fetch_serper_images(query, num_results),
+        SERPER_CACHE_TTL_HOURS * 3600,
+        should_cache=bool,
+        # 其他进程正在搜索同一个关键词时，等待时间也不超过请求剩余的时间
+        max_wait=remaining()
+    )
+
+def serper_search_key(query: str, num_results: int = 5) -> str:
+    return f"serper:search:{num_results}:{query}"
+
+def search_serper(query: str, num_results: int = 5) -> list:
+    """网络搜索，结果在所有工作进程间共享缓存，空结果不缓存"""
+    return get_shared_cache().get_or_compute(
+        serper_search_key(query, num_results),
+        lambda: fetch_serper(query, num_results),
+        SERPER_CACHE_TTL_HOURS * 3600,
+        should_cache=bool,
+        # 其他进程正在搜索同一个关键词时，等待时间也不超过请求剩余的时间
+        max_wait=remaining()
+    )
+
+def is_image_alive(url: str) -> bool:
+    """用 HEAD 请求检查图片链接是否还能访问"""
+    if not url:
+        return False
+    try:
+        response = requests.head(url, timeout=IMAGE_CHECK_TIMEOUT, allow_redirects=True)
+        if response.status_code in (403, 405, 501):
+            # 部分图床不支持 HEAD，改用 GET 只读取响应头
+            response = requests.get(url, timeout=IMAGE_CHECK_TIMEOUT, allow_redirects=True, stream=True)
+            response.close()
+        content_type = response.headers.get('Content-Type', '')
+        return response.status_code < 400 and not content_type.startswith('text/html')
+    except requests.RequestException:
+        return False
+
+def check_image_urls(urls) -> Dict[str, bool]:
+    """并发检查一组图片链接，返回 {url: 是否可访问}"""
+    unique = list(dict.fromkeys(url for url in urls if url))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=IMAGE_CHECK_WORKERS) as pool:
+        return dict(zip(unique, pool.map(is_image_alive, unique)))
+
 import json
 load_dotenv()
 
 # --- API KEY 设置 ---
 # 注意：这里的 GOOGLE_API_KEY 和 SEARCH_ENGINE_ID 是 Google Custom Search API 需要的
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
-os.environ["SEARCH_ENGINE_ID"] = os.getenv("SEARCH_ENGINE_ID")
-os.environ["FIRECRAWL_API_KEY"] = os.getenv("FIRECRAWL_API_KEY")
-os.environ["QWEN_API_KEY"] = os.getenv("QWEN_API_KEY")
+# load_dotenv 已经把 .env 中的值写入 os.environ，这里只检查是否缺失，不再写入 None
+for key in ("GOOGLE_API_KEY", "SEARCH_ENGINE_ID", "FIRECRAWL_API_KEY", "QWEN_API_KEY"):
+    if not os.getenv(key):
+        print(f"未设置 {key}")
+
+# Serper 搜索结果的缓存时间
+SERPER_CACHE_TTL_HOURS = float(os.getenv('SERPER_CACHE_TTL_HOURS', '24'))
+
+# 刷新攻略时检查图片链接的并发数和超时；重新查找图片时取几张候选，选第一张能访问的
+IMAGE_CHECK_WORKERS = int(os.getenv('IMAGE_CHECK_WORKERS', '8'))
+IMAGE_CHECK_TIMEOUT = float(os.getenv('IMAGE_CHECK_TIMEOUT', '5'))
+IMAGE_REFRESH_CANDIDATES = int(os.getenv('IMAGE_REFRESH_CANDIDATES', '3'))
+
+# 重排序、提取和 base 攻略都是一次性任务：每次调用都用新的 Agent，没有会话历史，
+# 否则同一个 Agent 的后续提示词会带上前面所有阶段的搜索结果。设置为 0 恢复旧行为（仅用于对比）
+PLANNER_STATELESS_AGENTS = os.getenv('PLANNER_STATELESS_AGENTS', '1') != '0'
+
+# 批量规划：所有批量请求共用一个线程池，同时规划的城市数不超过 BATCH_MAX_CONCURRENCY，
+# Serper 和模型调用再由各自的限流器控制，吞吐接近上游配额
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '4'))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix='batch-plan')
 
 app = Flask(__name__)
+# 压缩、条件请求、采样分析和 /metrics/* 路由，见 service_routes
+install_service_routes(app)
+
+# 角色 -> (模型路由任务, 系统提示词)
+AGENT_ROLES = {
+    "reranker": ("rerank", "你是一搜索质量打分专家，要从{搜索结果}里找出和{query}里最相关的2条结果，保存他们的结果，保留result_id、title、description、url，严格以json格式输出"),
+    "attraction": ("entity", "你是一个旅游信息提取专家，要根据内容提取出景点信息并返回json格式，严格以json格式输出"),
+    "food": ("entity", "你是一个旅游信息提取专家，要根据内容提取出美食信息并返回json格式，严格以json格式输出"),
+    "base_guide": ("base_guide", "你是一个旅游攻略生成专家，要根据内容生成一个旅游攻略，严格以json格式输出"),
+}
+
+# 模型输出中的 JSON 代码块：```json ... ``` 或 ``` ... ```
+_JSON_FENCE = re.compile(r"```(?:json)?[ \t]*\n?(.*?)```", re.DOTALL)
+
+def clean_json_string(json_str: str) -> str:
+    # ... (数据清理)
+    if '```json' in json_str:
+        json_str = json_str.split('```json')[-1]
+    if '```' in json_str:
+        json_str = json_str.split('```')[0]
+    return json_str.strip()
+
+def summarize_results(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """重排序结果中生成攻略用到的字段"""
+    return [
+        {
+            "result_id": item.get("result_id"),
+            "title": item.get("title"),
+            "description": item.get("description"),
+            "long_description": item.get("long_description"),
+        }
+        for item in items
+    ]
 
 class TravelPlanner:
-    def __init__(self, city: str, days: int):
+    def __init__(self, city: str, days: int, run_id: Optional[str] = None, use_pool: bool = True):
         
         #定义地点和时间，设置默认值
         self.city = city
         self.days = days
         self.res = None         
+        # 各阶段的检查点，失败后用同一个 run_id 重试即可从上一个成功阶段继续
+        self.checkpoints = CheckpointStore(city, days, run_id)
+        self.run_id = self.checkpoints.run_id
+        # 搜索到的攻略摘要，规划完成后写入城市实体池
+        self.guides = None
+        self.use_pool = use_pool
+        # 记录每个提示词的 token 压缩情况
+        self.prompt_reports = {}
+        # 每个阶段的模型调用次数、token 用量和耗时，见 self.ask()
+        self.token_usage = {}
+        # 因请求时限不足而跳过或截断的可选步骤：{步骤: 说明}
+        self.degraded = {}
 
         # --- OPENAI/LLM API 调用准备 (通过 OpenAI 兼容模式) ---
-        # 这一部分初始化了语言模型。虽然你用的是Qwen，但其接口模式是OpenAI兼容的。
-        # 如果要替换成Qwen的原生SDK，需要修改这里的模型创建和所有ChatAgent的实例化过程。
-        self.model = ModelFactory.create(
-            model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
-            model_type="Qwen/Qwen2.5-72B-Instruct",
-            url='https://api-inference.modelscope.cn/v1/',
-            api_key=os.getenv('QWEN_API_KEY')
-        )
-
-        # 初始化各种Agent，它们将使用上面定义的 self.model
-        self.reranker_agent = ChatAgent(
-            system_message="你是一搜索质量打分专家，要从{搜索结果}里找出和{query}里最相关的2条结果，保存他们的结果，保留result_id、title、description、url，严格以json格式输出",
-            model=self.model,
-            output_language='中文'
-        )
-        self.attraction_agent = ChatAgent(
-            system_message="你是一个旅游信息提取专家，要根据内容提取出景点信息并返回json格式，严格以json格式输出",
-            model=self.model,
-            output_language='中文'
-        )
-        self.food_agent = ChatAgent(
-            system_message="你是一个旅游信息提取专家，要根据内容提取出美食信息并返回json格式，严格以json格式输出",
-            model=self.model,
-            output_language='中文'
-        )
-        self.base_guide_agent = ChatAgent(
-            system_message="你是一个旅游攻略生成专家，要根据内容生成一个旅游攻略，严格以json格式输出",
-            model=self.model,
-            output_language='中文'
-        )
+        # 模型由 model_registry 按任务路由：重排序和实体提取用小模型，base攻略用大模型。
+        # PLANNER_STATELESS_AGENTS=0 时按 (角色, 档位) 共享的 Agent，见 self.agent()
+        self.agents = {}
         # --- OPENAI/LLM API 调用准备结束 ---
 
-        # 初始化搜索工具包，它将用于调用 Google 搜索等
+        # 搜索工具包（camel SearchToolkit）目前未使用，需要时通过 self.search_toolkit 延迟创建
         # self.firecrawl = Firecrawl()#后续功能
-        self.search_toolkit = SearchToolkit()
+        self._search_toolkit = None
+
+    @property
+    def search_toolkit(self):
+        if self._search_toolkit is None:
+            from camel.toolkits import SearchToolkit
+            self._search_toolkit = SearchToolkit()
+        return self._search_toolkit
+
+    def agent(self, role: str, tier: str) -> "ChatAgent":
+        """按 (角色, 档位) 获取同一次规划中共享的 Agent（保留会话历史，只在 PLANNER_STATELESS_AGENTS=0 时使用）"""
+        if (role, tier) not in self.agents:
+            task, system_message = AGENT_ROLES[role]
+            self.agents[(role, tier)] = create_agent(task, system_message, tier=tier, output_language='中文')
+        return self.agents[(role, tier)]
+
+    def ask(self, role: str, prompt: str, parse=None, stage: Optional[str] = None) -> str:
+        """
+        调用某个角色的模型，小模型输出无法通过 parse 校验时自动升级到大模型。
+
+        每次调用都是无状态的（使用新的 Agent），提示词大小不随阶段增加；
+        用量按 stage（默认为角色名）记录在 self.token_usage 中。
+        """
+        task, system_message = AGENT_ROLES[role]
+        new_agent = lambda tier: create_agent(task, system_message, tier=tier, output_language='中文')
+        if PLANNER_STATELESS_AGENTS:
+            # 主请求和对冲请求都用新的 Agent：被放弃的调用在后台跑完时只会写入它自己的 Agent，
+            # 不会和后续阶段同时 step 同一个 ChatAgent
+            agent_factory, hedge_factory = new_agent, new_agent
+        else:
+            # 共享的 Agent 不能同时执行两个 step：不发对冲请求
+            agent_factory, hedge_factory = lambda tier: self.agent(role, tier), None
+        usage = {}
+        started = time.monotonic()
+        try:
+            return run_task(task, prompt, agent_factory, parse=parse, hedge_factory=hedge_factory, usage=usage)
+        except Exception:
+            # 超时被放弃的调用可能还在后台写入共享的 Agent，之后不再复用
+            for key in [key for key in self.agents if key[0] == role]:
+                del self.agents[key]
+            raise
+        finally:
+            self.record_usage(stage or role, system_message, prompt, usage, time.monotonic() - started)
+
+    def record_usage(self, stage: str, system_message: str, prompt: str, usage: Dict[str, Any], seconds: float) -> None:
+        if not usage.get("prompt_tokens") and usage.get("calls"):
+            # 模型没有返回 usage 时按本地分词估算（无状态调用下即系统提示词 + 本次提示词）
+            usage["prompt_tokens"] = usage["calls"] * (count_tokens(system_message) + count_tokens(prompt))
+            usage["estimated"] = True
+        stats = self.token_usage.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0})
+        stats["calls"] += usage.get("calls", 0)
+        stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        stats["completion_tokens"] += usage.get("completion_tokens", 0)
+        stats["seconds"] = round(stats["seconds"] + seconds, 2)
+        if usage.get("estimated"):
+            stats["estimated"] = True
 
-    def extract_json_from_response(self,response_content: str) -> List[Dict[str, Any]]:
-            """从LLM响应中提取JSON内容"""
+    def usage_summary(self) -> str:
+        lines = [f"{stage}: {s['calls']} 次调用，prompt {s['prompt_tokens']} tokens，"
+                 f"completion {s['completion_tokens']} tokens，{s['seconds']} 秒"
+                 for stage, s in self.token_usage.items()]
+        return "\n".join(lines)
+
+    def parse_reranked(self, content: str) -> List[Dict[str, Any]]:
+        reranked = self.extract_json_from_response(content)
+        if not reranked:
+            raise ValueError("重排序结果为空或无法解析")
+        return reranked
+
+    def extract_json_from_response(self, response_content: str) -> List[Dict[str, Any]]:
+        """
+        从LLM响应中提取重排序结果。
+
+        支持 ```json 代码块、不带语言标记的代码块和直接输出的 JSON（前后可以带说明文字）；
+        结果可以是列表，也可以是 {"related_results": [...]} 或 {"results": [...]}。
+        """
+        fenced = _JSON_FENCE.search(response_content or "")
+        json_str = (fenced.group(1) if fenced else response_content or "").strip()
+        try:
+            parsed = json.loads(json_str)
+        except json.JSONDecodeError:
+            # 前后带有说明文字时，从第一个 [ 或 { 开始解析
+            starts = [i for i in (json_str.find("["), json_str.find("{")) if i != -1]
             try:
-                # 找到JSON内容的开始和结束位置
-                start = response_content.find('```json\n') + 8
-                end = response_content.find('\n```', start)
-                if start == -1 or end == -1:
-                    print("未找到JSON内容的标记")
-                    return []
-                
-                json_str = response_content[start:end].strip()
-                print(f"提取的JSON字符串: {json_str}")  # 调试信息
-                
-                # 解析 JSON 字符串
-                parsed = json.loads(json_str)
-                
-                # 处理不同的JSON结构
-                if isinstance(parsed, dict) and "related_results" in parsed:
-                    return parsed["results"]
-                elif isinstance(parsed, list):
-                    return parsed
-                else:
-                    print("未找到预期的JSON结构")
-                    return []
-                
+                if not starts:
+                    raise json.JSONDecodeError("没有JSON内容", json_str, 0)
+                parsed, _ = json.JSONDecoder().raw_decode(json_str[min(starts):])
             except json.JSONDecodeError as e:
                 print(f"解析JSON失败: {str(e)}")
                 print(f"原始内容: {response_content}")
                 return []
-            except Exception as e:
-                print(f"发生错误: {str(e)}")
-                return []
 
-    def search_and_rerank(self) -> Dict[str, Any]:
-        """多次搜索并重排序，整合信息"""
-        city = self.city
-        days = self.days
-        all_results = {}
-    
-        # 第一次搜索：旅游攻略
-        try:
-            query = f"{city}{days}天旅游攻略 最佳路线"
-            
-            # --- GOOGLE API 调用开始 ---
-            # 这里使用了 self.search_toolkit 来调用 Google 搜索。
-            # 如果你要替换成其他搜索服务（如Bing、或Qwen自己的搜索工具），需要修改这一行。
-            # search_results = self.search_toolkit.search_duckduckgo(query=query, max_results=20)
-            search_results = search_serper(query=query, num_results=5)
-            # --- GOOGLE API 调用结束 ---
-            
-            prompt = f"请从以下搜索结果中筛选出最相关的{self.days}条{city}{days}天旅游攻略信息，并按照相关性排序：\n{json.dumps(search_results, ensure_ascii=False, indent=2)}"
-            
-            # --- OPENAI/LLM API 调用开始 ---
-            # reranker_agent.step 会调用你在 __init__ 中定义的模型 (当前是Qwen)。
-            response = self.reranker_agent.step(prompt)
-            # --- OPENAI/LLM API 调用结束 ---
-            
-            all_results["guides"] = self.extract_json_from_response(response.msgs[0].content)
-        except Exception as e:
-            print(f"旅游攻略搜索失败: {str(e)}")
-            all_results["guides"] = []
-        
-        # 第二次搜索：必去景点
-        try:
-            query = f"{city} 必去景点 top10 著名景点"
-            
-            # --- GOOGLE API 调用开始 ---
-            search_results = search_serper(query=query, num_results=5)
-            # --- GOOGLE API 调用结束 ---
-            
-            prompt = f"请从以下搜索结果中筛选出最多{self.days}条{city}最值得去的景点信息，并按照热门程度排序：\n{json.dumps(search_results, ensure_ascii=False, indent=2)}"
-            
-            # --- OPENAI/LLM API 调用开始 ---
-            response = self.reranker_agent.step(prompt)
-            # --- OPENAI/LLM API 调用结束 ---
-            
-            all_results["attractions"] = self.extract_json_from_response(response.msgs[0].content)
-        except Exception as e:
-            print(f"景点搜索失败: {str(e)}")
-            all_results["attractions"] = []
-        
-        # 第三次搜索：必吃美食
-        try:
-            query = f"{city} 必吃美食 特色小吃 推荐"
+        # 处理不同的JSON结构
+        if isinstance(parsed, dict):
+            for key in ("related_results", "results"):
+                if isinstance(parsed.get(key), list):
+                    return parsed[key]
+        elif isinstance(parsed, list):
+            return parsed
+        print("未找到预期的JSON结构")
+        return []
+
+    def _search_and_rerank_stage(self, stage: str, query: str, instruction: str, error_label: str) -> List[Dict[str, Any]]:
+        """执行一次"搜索 + 重排序"，两步的结果都写入检查点，重试时直接复用"""
+        reranked = self.checkpoints.load(f"rerank_{stage}")
+        if reranked is not None:
+            print(f"从检查点恢复重排序结果: {stage}")
+            return reranked
 
-            # --- GOOGLE API 调用开始 ---
-            search_results = search_serper(query=query, num_results=5)
-            # --- GOOGLE API 调用结束 ---
-            
-            prompt = f"请从以下搜索结果中筛选出最多{self.days}条{city}最具特色的美食信息，并按照推荐度排序：\n{json.dumps(search_results, ensure_ascii=False, indent=2)}"
-            
-            # --- OPENAI/LLM API 调用开始 ---
-            response = self.reranker_agent.step(prompt)
-            # --- OPENAI/LLM API 调用结束 ---
-            
-            all_results["must_eat"] = self.extract_json_from_response(response.msgs[0].content)
-        except Exception as e:
-            print(f"必吃美食搜索失败: {str(e)}")
-            all_results["must_eat"] = []
-        
-        # 第四次搜索：特色美食
         try:
-            query = f"{city} 特色美食 地方小吃 传统美食"
+            search_results = self.checkpoints.load(f"search_{stage}")
+            if search_results is None:
+                # --- GOOGLE API 调用开始 ---
+                # 如果你要替换成其他搜索服务（如Bing、或Qwen自己的搜索工具），需要修改这一行。
+                # search_results = self.search_toolkit.search_duckduckgo(query=query, max_results=20)
+                search_results = search_serper(query=query, num_results=5)
+                # --- GOOGLE API 调用结束 ---
+                # 空结果可能是接口失败，不写检查点，重试时重新搜索
+                if search_results:
+                    self.checkpoints.save(f"search_{stage}", search_results)
 
-            # --- GOOGLE API 调用开始 ---
-            search_results = search_serper(query=query, num_results=5)
-            # --- GOOGLE API 调用结束 ---
+            if not search_results:
+                print(f"{error_label}: 没有搜索结果，跳过重排序")
+                return []
+
+            prompt = f"{instruction}\n{json.dumps(search_results, ensure_ascii=False, indent=2)}"
 
-            prompt = f"请从以下搜索结果中筛选出最多{self.days}条{city}独特的地方特色美食信息，并按照特色程度排序：\n{json.dumps(search_results, ensure_ascii=False, indent=2)}"
-            
             # --- OPENAI/LLM API 调用开始 ---
-            response = self.reranker_agent.step(prompt)
+            # 重排序默认使用小模型，输出无法解析时升级到大模型
+            content = self.ask("reranker", prompt, parse=self.parse_reranked, stage=f"rerank_{stage}")
             # --- OPENAI/LLM API 调用结束 ---
-            
-            all_results["local_food"] = self.extract_json_from_response(response.msgs[0].content)
+
+            reranked = self.extract_json_from_response(content)
+            if reranked:
+                self.checkpoints.save(f"rerank_{stage}", reranked)
+            return reranked
         except Exception as e:
-            print(f"特色美食搜索失败: {str(e)}")
-            all_results["local_food"] = []
+            print(f"{error_label}: {str(e)}")
+            # 限流或超时不能当作空结果继续，否则残缺的攻略会被保存和缓存
+            if is_upstream_failure(e):
+                raise
+            return []
+
+    def rerank_stages(self) -> List[tuple]:
+        """搜索阶段列表：(阶段名, 搜索词, 重排序要求, 失败提示)"""
+        city = self.city
+        days = self.days
+        return [
+            # 第一次搜索：旅游攻略
+            ("guides", f"{city}{days}天旅游攻略 最佳路线",
+             f"请从以下搜索结果中筛选出最相关的{self.days}条{city}{days}天旅游攻略信息，并按照相关性排序：",
+             "旅游攻略搜索失败"),
+            # 第二次搜索：必去景点
+            ("attractions", f"{city} 必去景点 top10 著名景点",
+             f"请从以下搜索结果中筛选出最多{self.days}条{city}最值得去的景点信息，并按照热门程度排序：",
+             "景点搜索失败"),
+            # 第三次搜索：必吃美食
+            ("must_eat", f"{city} 必吃美食 特色小吃 推荐",
+             f"请从以下搜索结果中筛选出最多{self.days}条{city}最具特色的美食信息，并按照推荐度排序：",
+             "必吃美食搜索失败"),
+            # 第四次搜索：特色美食
+            ("local_food", f"{city} 特色美食 地方小吃 传统美食",
+             f"请从以下搜索结果中筛选出最多{self.days}条{city}独特的地方特色美食信息，并按照特色程度排序：",
+             "特色美食搜索失败"),
+        ]
+
+    def search_and_rerank(self) -> Dict[str, Any]:
+        """多次搜索并重排序，整合信息"""
+        city = self.city
+        days = self.days
+        all_results = {}
+
+        for stage, query, instruction, error_label in self.rerank_stages():
+            # 特色美食与必吃美食高度重合，剩余时间不够时跳过，把时间留给后面必需的步骤
+            if stage == "local_food" and not has_time(PLAN_OPTIONAL_STAGE_RESERVE_SECONDS):
+                all_results[stage] = self.checkpoints.load(f"rerank_{stage}", [])
+                if not all_results[stage]:
+                    self.degraded[stage] = "剩余时间不足，跳过特色美食搜索"
+                    print(f"剩余 {remaining():.0f} 秒，跳过 {stage} 阶段")
+                continue
+            try:
+                all_results[stage] = self._search_and_rerank_stage(stage, query, instruction, error_label)
+            except Exception as e:
+                # 可选的特色美食阶段被限流或超时时降级；必需的阶段直接失败，带上 run_id 重试
+                if stage != "local_food" or not is_upstream_failure(e):
+                    raise
+                all_results[stage] = []
+                self.degraded[stage] = f"上游限流或超时，跳过特色美食搜索: {str(e)}"
         
         # 整合所有信息
         # ... (这部分是数据处理，没有API调用)
@@ -279,63 +463,35 @@ class TravelPlanner:
             "city": city,
             "days": days,
             "travel_info": {
-                "guides": [
-                    {
-                        "result_id": item.get("result_id"),
-                        "title": item.get("title"),
-                        "description": item.get("description"),
-                        "long_description": item.get("long_description"),
-                    }
-                    for item in all_results["guides"]
-                ],
-                "attractions": [
-                    {
-                        "result_id": item.get("result_id"),
-                        "title": item.get("title"),
-                        "description": item.get("description"),
-                        "long_description": item.get("long_description"),
-                    }
-                    for item in all_results["attractions"]
-                ],
-                "must_eat": [
-                    {
-                        "result_id": item.get("result_id"),
-                        "title": item.get("title"),
-                        "description": item.get("description"),
-                        "long_description": item.get("long_description"),
-                    }
-                    for item in all_results["must_eat"]
-                ],
-                "local_food": [
-                    {
-                        "result_id": item.get("result_id"),
-                        "title": item.get("title"),
-                        "description": item.get("description"),
-                        "long_description": item.get("long_description"),
-                    }
-                    for item in all_results["local_food"]
-                ]
+                stage: summarize_results(all_results[stage])
+                for stage in ("guides", "attractions", "must_eat", "local_food")
             }
         }
         
+        self.guides = final_result["travel_info"]["guides"]
         return final_result
     
     def extract_attractions_and_food(self) -> Dict:
+        # 三个生成结果都已有检查点时，连搜索和重排序也不需要再执行
+        results = {stage: self.checkpoints.load(stage) for stage in ("base_guide", "attractions", "foods")}
+        if all(content is not None for content in results.values()):
+            print("从检查点恢复 base攻略 与景点/美食提取结果")
+            # 跳过了搜索，攻略摘要（写入实体池用）从重排序的检查点恢复
+            self.guides = summarize_results(self.checkpoints.load("rerank_guides", []))
+            return results
+
         travel_info = self.search_and_rerank()
 
-        # 提供一个base攻略路线
-        prompt = f"""
-        参考以下信息，生成一个{self.city}{self.days}天攻略路线，直接根据整个travel_info生成
-        {travel_info}
-        【输出格式】
-        {{
-            "base_guide": "攻略内容"
-        }}
-        """
-        # --- OPENAI/LLM API 调用开始 ---
-        base_guide = self.base_guide_agent.step(prompt)
-        # --- OPENAI/LLM API 调用结束 ---
-        print(f"这是base攻略: {base_guide.msgs[0].content}")
+        if results["base_guide"] is None:
+            # 提供一个base攻略路线（去重、截断描述后在 token 预算内生成提示词）
+            prompt, prompt_report = build_base_guide_prompt(self.city, self.days, travel_info)
+            self.prompt_reports["base_guide"] = prompt_report
+            print(f"base攻略提示词: {prompt_report['tokens']} tokens，节省 {prompt_report['saved_tokens']} tokens")
+            # --- OPENAI/LLM API 调用开始 ---
+            results["base_guide"] = self.ask("base_guide", prompt)
+            # --- OPENAI/LLM API 调用结束 ---
+            self.checkpoints.save("base_guide", results["base_guide"])
+        print(f"这是base攻略: {results['base_guide']}")
 
         # ... (数据处理)
         attractions_text = " ".join([item["description"] for item in travel_info["travel_info"]["attractions"] + travel_info["travel_info"]["guides"]])
@@ -357,7 +513,29 @@ class TravelPlanner:
         }}
         """
         
-        food_prompt = f"""
+        food_prompt = self.build_food_prompt(food_text)
+        
+        # --- OPENAI/LLM API 调用开始 ---
+        # 使用不同的 Agent 处理不同的提取任务
+        if results["attractions"] is None:
+            results["attractions"] = self.ask(
+                "attraction", attractions_prompt, parse=lambda c: json.loads(clean_json_string(c))["attractions"]
+            )
+            self.checkpoints.save("attractions", results["attractions"])
+        if results["foods"] is None:
+            results["foods"] = self.ask("food", food_prompt, parse=self.parse_foods)
+            # 跳过了特色美食搜索时不写检查点，重试时带上完整的搜索结果重新提取
+            if "local_food" not in self.degraded:
+                self.checkpoints.save("foods", results["foods"])
+        # --- OPENAI/LLM API 调用结束 ---
+        
+        print(f"这是景点信息: {results['attractions']}")
+        print(f"这是美食信息: {results['foods']}")
+        
+        return results
+    
+    def build_food_prompt(self, food_text: str) -> str:
+        return f"""
         请从以下文本中提取出具体的美食名称或者美食店铺，注意不能遗漏美食信息，要尽量多提取美食信息，并为每个美食和店铺提供简短描述：
         {food_text}
         请以JSON格式返回，格式如下：
@@ -370,38 +548,192 @@ class TravelPlanner:
             ]
         }}
         """
-        
-        # --- OPENAI/LLM API 调用开始 ---
-        # 使用不同的 Agent 处理不同的提取任务
-        attractions_response = self.attraction_agent.step(attractions_prompt)
-        foods_response = self.food_agent.step(food_prompt)
-        # --- OPENAI/LLM API 调用结束 ---
-        
-        print(f"这是景点信息: {attractions_response.msgs[0].content}")
-        print(f"这是美食信息: {foods_response.msgs[0].content}")
-        
-        return {
-            "base_guide": base_guide.msgs[0].content,
-            "attractions": attractions_response.msgs[0].content,
-            "foods": foods_response.msgs[0].content
+
+    def parse_foods(self, content: str) -> List[List[Dict[str, Any]]]:
+        parsed = json.loads(clean_json_string(content))
+        return [parsed[key] for key in ("foods", "food_shop")]
+
+    def find_image(self, image_query: str, name: Optional[str] = None) -> str:
+        """查找一张图片，查到的结果记录在 images 检查点中，重试时不再重复搜索"""
+        image_map = self.checkpoints.load("images", {})
+        if image_query in image_map:
+            return image_map[image_query]
+
+        # 已保存的攻略里有同城市同名实体的图片时直接复用，不请求 Serper
+        if name:
+            try:
+                image_url = get_plan_index().find_image(self.city, name)
+            except Exception as e:
+                print(f"查询攻略索引失败: {str(e)}")
+                image_url = ""
+            if image_url:
+                return image_url
+
+        if has_time(PLAN_IMAGE_RESERVE_SECONDS):
+            try:
+                images = search_serper_images(query=image_query, num_results=1)
+            except Exception as e:
+                if not is_upstream_failure(e):
+                    raise
+                # 被限流或超时的图片记为降级，攻略不保存也不缓存，重试时补上
+                print(f"查找图片 {image_query} 失败: {str(e)}")
+                images = []
+                self.degraded["images"] = self.degraded.get("images", 0) + 1
+        else:
+            # 剩余时间不足：只取共享缓存中已有的图片，不再请求 Serper
+            images = get_shared_cache().get(serper_images_key(image_query, 1)) or []
+            if not images:
+                self.degraded["images"] = self.degraded.get("images", 0) + 1
+        image_url = images[0]["image"] if images else ""
+        if image_url:
+            image_map[image_query] = image_url
+            self.checkpoints.save("images", image_map)
+        return image_url
+
+    def save_plan(self, result: Dict) -> None:
+        try:
+            os.makedirs(STORAGE_DIR, exist_ok=True)
+            filename = plan_path(self.city, self.days)
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=4)
+            print(f"旅游攻略已保存到文件：{filename}")
+        except Exception as e:
+            print(f"保存JSON文件时出错: {str(e)}")
+            return
+        # 增量更新攻略索引
+        try:
+            get_plan_index().index_plan(filename, result)
+        except Exception as e:
+            print(f"更新攻略索引失败: {str(e)}")
+
+    def plan_from_pool(self, pool: Dict) -> Dict:
+        """城市实体池已就绪时，只生成 base 攻略，景点、美食和图片直接取自实体池（按天数挑选）"""
+        print(f"使用{self.city}的实体池生成{self.days}天攻略，跳过搜索与提取")
+        pool = select_for_days(pool, self.days)
+        content = self.checkpoints.load("base_guide")
+        if content is None:
+            prompt, prompt_report = build_pool_guide_prompt(self.city, self.days, pool)
+            self.prompt_reports["base_guide"] = prompt_report
+            print(f"base攻略提示词（实体池）: {prompt_report['tokens']} tokens，节省 {prompt_report['saved_tokens']} tokens")
+            # --- OPENAI/LLM API 调用开始 ---
+            content = self.ask("base_guide", prompt)
+            # --- OPENAI/LLM API 调用结束 ---
+            self.checkpoints.save("base_guide", content)
+
+        try:
+            base_guide = json.loads(clean_json_string(content))
+        except json.JSONDecodeError:
+            self.checkpoints.discard("base_guide")
+            raise
+
+        result = {
+            "city": self.city,
+            "days": self.days,
+            "base路线": base_guide,
+            "景点": pool.get("attractions", []),
+            "美食": pool.get("foods", []),
+            "美食店铺": pool.get("shops", [])
         }
-    
+        self.save_plan(result)
+        return result
+
+    def resolve_image(self, name: str) -> str:
+        """重新查找一张能访问的图片，绕过缓存和索引中已失效的结果"""
+        image_query = f"{self.city} {name} 实景图"
+        candidates = [item["image"] for item in fetch_serper_images(image_query, IMAGE_REFRESH_CANDIDATES) if item.get("image")]
+        alive = check_image_urls(candidates)
+        for url in candidates:
+            if alive.get(url):
+                get_shared_cache().set(serper_images_key(image_query, 1), [{"image": url}], SERPER_CACHE_TTL_HOURS * 3600)
+                return url
+        return ""
+
+    def refresh_images(self, plan: Dict) -> Dict[str, int]:
+        """并发检查攻略中所有图片链接，只为缺失或失效的条目重新查找图片"""
+        entries = [item for section in POOL_SECTIONS.values() for item in plan.get(section, [])]
+        alive = check_image_urls(item.get("图片url", "") for item in entries)
+        broken = [item for item in entries if not alive.get(item.get("图片url", ""), False)]
+        with ThreadPoolExecutor(max_workers=IMAGE_CHECK_WORKERS) as pool:
+            replacements = list(pool.map(lambda item: self.resolve_image(item["name"]), broken))
+        replaced = 0
+        for item, image_url in zip(broken, replacements):
+            # 找不到可用的新图片时保留原链接
+            if image_url:
+                item["图片url"] = image_url
+                replaced += 1
+        return {"checked": len(entries), "broken": len(broken), "replaced": replaced}
+
+    def refresh_foods(self, plan: Dict) -> Dict[str, int]:
+        """只重新执行美食相关的搜索、重排序和提取，替换攻略中的美食和店铺，其余部分保持不变"""
+        food_results = []
+        for stage, query, instruction, error_label in self.rerank_stages():
+            if stage in ("must_eat", "local_food"):
+                # 不使用缓存的旧搜索结果
+                get_shared_cache().delete(serper_search_key(query))
+                food_results += self._search_and_rerank_stage(stage, query, instruction, error_label)
+        if not food_results:
+            raise ValueError("美食搜索没有结果，保留原有的美食信息")
+
+        food_text = " ".join(item.get("description") or "" for item in food_results)
+        foods_list, shops_list = self.parse_foods(self.ask("food", self.build_food_prompt(food_text), parse=self.parse_foods))
+        for section, items in (("美食", foods_list), ("美食店铺", shops_list)):
+            plan[section] = [
+                {
+                    "name": item["name"],
+                    "describe": item.get("description", ""),
+                    "图片url": self.find_image(f"{self.city} {item['name']} 实景图", item["name"]),
+                }
+                for item in items if item.get("name")
+            ]
+        return {"foods": len(plan["美食"]), "shops": len(plan["美食店铺"])}
+
+    def refresh_plan(self, plan: Dict, sections: List[str]) -> Dict[str, Any]:
+        """
+        局部刷新已保存的攻略。
+
+        Args:
+            plan (dict): 已保存的攻略，原地更新.
+            sections (list): 要刷新的部分："foods"（重新搜索和提取美食、店铺）、"images"（修复缺失或失效的图片）.
+
+        Returns:
+            dict: 每个部分的刷新统计。
+        """
+        stats = {}
+        # 先刷新美食，新的美食条目也会经过图片检查
+        if "foods" in sections:
+            stats["foods"] = self.refresh_foods(plan)
+        if "images" in sections:
+            stats["images"] = self.refresh_images(plan)
+        # 新美食的图片被限流或超时时不保存，保留原来的攻略
+        if self.degraded:
+            raise RuntimeError(f"上游限流或超时，攻略未更新: {self.degraded}")
+        update_pool(self.city, plan, replace=("foods", "shops") if "foods" in sections else ())
+        self.save_plan(plan)
+        self.checkpoints.clear()
+        return stats
+
     def process_attractions_and_food(self) -> Dict:
-        def clean_json_string(json_str: str) -> str:
-            # ... (数据清理)
-            if '```json' in json_str:
-                json_str = json_str.split('```json')[-1]
-            if '```' in json_str:
-                json_str = json_str.split('```')[0]
-            return json_str.strip()
-        
         city = self.city
+
+        # 城市实体池足够时，N天攻略只需要最后的 base 攻略生成这一步
+        pool = load_pool(city) if self.use_pool else None
+        if is_pool_sufficient(pool, self.days):
+            return self.plan_from_pool(pool)
+
         results = self.extract_attractions_and_food()
         
+        def parse_stage(stage: str) -> Any:
+            # 解析失败时丢弃该阶段的检查点，重试时只重新生成这一步
+            try:
+                return json.loads(clean_json_string(results[stage]))
+            except json.JSONDecodeError:
+                self.checkpoints.discard(stage)
+                raise
+
         # ... (JSON 解析)
-        base_guide = json.loads(clean_json_string(results['base_guide']))
-        attractions_data = json.loads(clean_json_string(results['attractions']))
-        foods_data= json.loads(clean_json_string(results['foods']))
+        base_guide = parse_stage('base_guide')
+        attractions_data = parse_stage('attractions')
+        foods_data = parse_stage('foods')
         foods_list = foods_data['foods']
         food_shops_list = foods_data['food_shop']
         
@@ -422,9 +754,8 @@ class TravelPlanner:
         # 处理景点信息
         for attraction in attractions_data['attractions']:
             try:
-                image_query = f"{city} {attraction['name']} 实景图"
-                # 2. 调用我们新的 Serper 图片搜索函数
-                images = search_serper_images(query=image_query, num_results=1)
+                # 调用 Serper 图片搜索（已查到的图片从检查点读取）
+                image_url = self.find_image(f"{city} {attraction['name']} 实景图", attraction['name'])
 
                 # --- DUCKDUCKGO (类比GOOGLE) API 调用开始 ---
                 # 这里使用了 DuckDuckGo 进行图片搜索。
@@ -439,7 +770,7 @@ class TravelPlanner:
                 attraction_with_image = {
                     "name": attraction['name'],
                     "describe": attraction['description'],
-                    "图片url": images[0]["image"] if images else "",
+                    "图片url": image_url,
                 }
                 result['景点'].append(attraction_with_image)
                 
@@ -454,14 +785,13 @@ class TravelPlanner:
         # 处理美食信息
         for food in foods_list:
             try:
-                image_query = f"{city} {attraction['name']} 实景图"
-                # 2. 调用我们新的 Serper 图片搜索函数
-                images = search_serper_images(query=image_query, num_results=1)
+                # 调用 Serper 图片搜索（已查到的图片从检查点读取）
+                image_url = self.find_image(f"{city} {food['name']} 实景图", food['name'])
                 
                 food_with_image = {
                     "name": food["name"],
                     "describe": food["description"],
-                    "图片url": images[0]["image"] if images else "",
+                    "图片url": image_url,
                 }
                 result['美食'].append(food_with_image)
                 
@@ -475,13 +805,12 @@ class TravelPlanner:
         # 处理美食店铺信息
         for food_shop in food_shops_list:
             try:
-                image_query = f"{city} {attraction['name']} 实景图"
-                # 2. 调用我们新的 Serper 图片搜索函数
-                images = search_serper_images(query=image_query, num_results=1)
+                # 调用 Serper 图片搜索（已查到的图片从检查点读取）
+                image_url = self.find_image(f"{city} {food_shop['name']} 实景图", food_shop['name'])
                 food_shop_with_image = {
                     "name": food_shop["name"],
                     "describe": food_shop["description"],
-                    "图片url": images[0]["image"] if images else "",
+                    "图片url": image_url,
                 }
                 result['美食店铺'].append(food_shop_with_image)
             except Exception as e:
@@ -492,21 +821,218 @@ class TravelPlanner:
                     "图片url": ""
                 })
         
+        if "images" in self.degraded:
+            print(f"剩余时间不足或上游限流，{self.degraded['images']} 张图片未查找")
+            self.degraded["images"] = f"剩余时间不足或上游限流，{self.degraded['images']} 张图片未查找"
+
+        # 降级的攻略只返回给本次请求，不写入实体池和文件，也不清理检查点，
+        # 之后带上 run_id 重试即可补全
+        if self.degraded:
+            return result
+
+        if self.token_usage:
+            print(f"各阶段模型用量:\n{self.usage_summary()}")
+
+        # 景点、美食与图片写入城市实体池，供同城市其他天数的攻略复用
+        update_pool(city, result, self.guides)
+
         # ... (文件保存)
-        try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            storage_dir = os.path.join(current_dir, "storage")
-            os.makedirs(storage_dir, exist_ok=True)
-            filename = os.path.join(storage_dir, f"{self.city}{self.days}天旅游信息.json")
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=4)
-            print(f"旅游攻略已保存到文件：{filename}")
-        except Exception as e:
-            print(f"保存JSON文件时出错: {str(e)}")
+        self.save_plan(result)
         
         return result
 
+def parse_timeout(data: Dict[str, Any]) -> float:
+    """请求体中的 timeout（秒）：不传时为 PLAN_SLA_SECONDS，0 表示不限时，负数或非数字抛出 ValueError"""
+    timeout = data.get('timeout')
+    if timeout is None:
+        return PLAN_SLA_SECONDS
+    if isinstance(timeout, bool):
+        raise ValueError(timeout)
+    timeout = float(timeout)
+    if timeout < 0:
+        raise ValueError(timeout)
+    return timeout
+
 # --- Flask App 部分 (无API调用) ---
+def build_travel_plan(city: str, days: int, refresh: bool = False, run_id: Optional[str] = None,
+                      timeout: float = PLAN_SLA_SECONDS,
+                      max_age_hours: Optional[float] = None) -> Tuple[Dict[str, Any], int]:
+    """
+    生成（或读取已保存的）攻略，供 /get_travel_plan、批量接口和预热调度器共用。
+
+    Args:
+        refresh (bool): 忽略已保存的攻略和实体池，完整重新生成.
+        max_age_hours (float): 已保存的攻略超过该时长视为过期（默认 PLAN_CACHE_TTL_HOURS），
+            与 refresh 不同，重新生成时仍使用实体池和检查点.
+
+    Returns:
+        tuple: (响应内容, HTTP 状态码)
+    """
+    # 已保存且未过期的攻略直接返回（热门目的地由预热调度器提前生成），refresh=true 强制重新生成
+    if not refresh:
+        cached_plan = load_fresh_plan(city, days, PLAN_CACHE_TTL_HOURS if max_age_hours is None else max_age_hours)
+        if cached_plan is not None:
+            return {
+                'status': 'success',
+                'data': cached_plan,
+                'cached': True
+            }, 200
+
+    # 带上失败响应里返回的 run_id 重试，可从上一个成功的阶段继续；顺带清理过期的检查点
+    maybe_purge_expired()
+    try:
+        travel_planner = TravelPlanner(city=city, days=days, run_id=run_id, use_pool=not refresh)
+    except ValueError as e:
+        return {
+            'status': 'error',
+            'message': str(e)
+        }, 400
+
+    def compute_plan() -> Dict:
+        results = travel_planner.process_attractions_and_food()
+        if not travel_planner.degraded:
+            travel_planner.checkpoints.clear()
+        return results
+
+    # 多个工作进程同时收到同一个 (city, days) 时，只有一个进程执行流水线，其余等待结果
+    cache_key = f"plan:{city}:{days}"
+    if refresh or max_age_hours is not None:
+        get_shared_cache().delete(cache_key)
+    # 整个请求的时限：请求体中的 timeout（秒），默认 PLAN_SLA_SECONDS；
+    # 时间不够时跳过可选步骤，返回降级但可用的攻略
+    try:
+        with request_deadline(timeout):
+            results = get_shared_cache().get_or_compute(
+                cache_key, compute_plan, PLAN_CACHE_TTL_HOURS * 3600,
+                should_cache=lambda value: value is not None and not travel_planner.degraded,
+                max_wait=remaining()
+            )
+    except Exception as e:
+        return {
+            'status': 'error',
+            'message': f'处理请求时发生错误: {str(e)}',
+            'run_id': travel_planner.run_id,
+            'completed_stages': travel_planner.checkpoints.stages(),
+            'token_usage': travel_planner.token_usage
+        }, 504 if isinstance(e, TimeoutError) else 503 if is_throttled(e) else 500
+
+    payload = {
+        'status': 'success',
+        'data': results
+    }
+    # 本进程实际执行了流水线时附带各阶段的 token 用量，以及提示词压缩前后的 token 数
+    if travel_planner.token_usage:
+        payload['token_usage'] = travel_planner.token_usage
+    if travel_planner.prompt_reports:
+        payload['prompt_reports'] = travel_planner.prompt_reports
+    if travel_planner.degraded:
+        payload.update(degraded=travel_planner.degraded, run_id=travel_planner.run_id)
+    return payload, 200
+
+@app.route('/travel_plan/<city>/<int:days>', methods=['GET'])
+def get_stored_travel_plan(city: str, days: int):
+    """读取已保存的攻略；响应带 ETag，内容未变时返回 304"""
+    plan = load_plan(city, days)
+    if plan is None:
+        return jsonify({
+            'status': 'error',
+            'message': f'{city}{days}天的攻略尚未生成'
+        }), 404
+    return jsonify({
+        'status': 'success',
+        'data': plan,
+        'cached': True
+    })
+
+REFRESH_SECTIONS = ("foods", "images")
+
+@app.route('/refresh_travel_plan', methods=['POST'])
+def refresh_travel_plan():
+    """
+    局部刷新已保存的攻略，只更新指定的部分。
+
+    请求体：{"city": "深圳", "days": 3, "sections": ["images", "foods"]}，sections 默认为 ["images"]
+    """
+    data = request.get_json(silent=True) or {}
+    sections = data.get('sections') or ['images']
+    try:
+        city, days = data['city'], int(data['days'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': '请求必须包含city和整数days参数'
+        }), 400
+    if not isinstance(sections, list) or not set(sections) <= set(REFRESH_SECTIONS):
+        return jsonify({
+            'status': 'error',
+            'message': f'sections只能包含 {"/".join(REFRESH_SECTIONS)}'
+        }), 400
+
+    plan = load_plan(city, days)
+    if plan is None:
+        return jsonify({
+            'status': 'error',
+            'message': f'{city}{days}天的攻略尚未生成'
+        }), 404
+
+    try:
+        travel_planner = TravelPlanner(city=city, days=days)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    try:
+        stats = travel_planner.refresh_plan(plan, sections)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'刷新攻略时发生错误: {str(e)}'
+        }), 500
+    # 其他工作进程缓存的旧攻略失效；行程 HTML 会因攻略文件更新而重新生成
+    get_shared_cache().delete(f"plan:{city}:{days}")
+    return jsonify({
+        'status': 'success',
+        'data': plan,
+        'refreshed': stats
+    })
+
+@app.route('/search/entities', methods=['GET'])
+def search_entities():
+    """
+    在已保存的攻略中检索景点、美食和店铺。
+
+    参数：q（关键词，可为空）、city、kind（attractions / foods / shops）、limit。
+    例如 /search/entities?city=深圳&kind=foods 或 /search/entities?q=海鲜
+    """
+    kind = request.args.get('kind') or None
+    if kind is not None and kind not in POOL_SECTIONS:
+        return jsonify({
+            'status': 'error',
+            'message': f'kind参数必须为 {"/".join(POOL_SECTIONS)} 之一'
+        }), 400
+    try:
+        limit = min(200, max(1, int(request.args.get('limit', 20))))
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'limit参数必须为整数'
+        }), 400
+    results = get_plan_index().search(request.args.get('q', ''), city=request.args.get('city') or None,
+                                      kind=kind, limit=limit)
+    return jsonify({
+        'status': 'success',
+        'data': results
+    })
+
+@app.route('/search/cities', methods=['GET'])
+def search_cities():
+    """索引中各城市的景点、美食、店铺数量"""
+    return jsonify({
+        'status': 'success',
+        'data': get_plan_index().cities()
+    })
+
 @app.route('/get_travel_plan', methods=['POST'])
 def get_travel_plan():
     try:
@@ -528,13 +1054,26 @@ def get_travel_plan():
                 'message': 'days参数必须为整数'
             }), 400
             
-        travel_planner = TravelPlanner(city=city, days=days)
-        results = travel_planner.process_attractions_and_food()
-        
-        return jsonify({
-            'status': 'success',
-            'data': results
-        })
+        try:
+            timeout = parse_timeout(data)
+        except (TypeError, ValueError):
+            return jsonify({
+                'status': 'error',
+                'message': 'timeout参数必须为非负的秒数（0 表示不限时）'
+            }), 400
+
+        # run_id 会拼进检查点目录，只接受服务端生成的格式
+        run_id = data.get('run_id')
+        if run_id is not None and not is_valid_run_id(run_id):
+            return jsonify({
+                'status': 'error',
+                'message': 'run_id参数无效，请使用失败响应中返回的run_id'
+            }), 400
+
+        log_request('get_travel_plan', city, days)
+        payload, status_code = build_travel_plan(city, days, refresh=bool(data.get('refresh')),
+                                                 run_id=run_id, timeout=timeout)
+        return jsonify(payload), status_code
         
     except Exception as e:
         return jsonify({
@@ -542,5 +1081,122 @@ def get_travel_plan():
             'message': f'处理请求时发生错误: {str(e)}'
         }), 500
 
+@app.route('/get_travel_plans', methods=['POST'])
+def get_travel_plans():
+    """
+    批量规划多个 (city, days)，以 NDJSON 流式返回，每完成一个城市输出一行。
+
+    请求体：{"items": [{"city": "深圳", "days": 3}, ...], "refresh": false, "timeout": 240}
+    重复的 (city, days) 只规划一次；同一城市的多个天数按天数从多到少依次规划，
+    后面的天数可以直接使用前面写入的城市实体池。相同的 Serper 查询由共享缓存去重。
+    最后一行是汇总：{"status": "done", "total": ..., "succeeded": ..., "failed": ...}
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'status': 'error',
+            'message': '请求必须包含非空的items列表'
+        }), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({
+            'status': 'error',
+            'message': f'items最多{BATCH_MAX_ITEMS}个'
+        }), 400
+    try:
+        timeout = parse_timeout(data)
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': 'timeout参数必须为非负的秒数（0 表示不限时）'
+        }), 400
+    refresh = bool(data.get('refresh'))
+
+    invalid = []
+    by_city: Dict[str, List[int]] = {}
+    for item in items:
+        try:
+            city, days = item['city'], int(item['days'])
+        except (TypeError, KeyError, ValueError):
+            invalid.append({'status': 'error', 'item': item, 'message': '每一项必须包含city和整数days'})
+            continue
+        if days not in by_city.setdefault(city, []):
+            by_city[city].append(days)
+            log_request('get_travel_plans', city, days)
+
+    results: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+
+    def plan_city(city: str, days_list: List[int]) -> None:
+        # 批量任务以后台优先级使用上游配额，不挤占单个用户的在线请求
+        with priority(BACKGROUND):
+            for days in sorted(days_list, reverse=True):
+                started = time.monotonic()
+                try:
+                    payload, _ = build_travel_plan(city, days, refresh=refresh, timeout=timeout)
+                except Exception as e:
+                    payload = {'status': 'error', 'message': f'处理请求时发生错误: {str(e)}'}
+                payload.update(city=city, days=days, elapsed_seconds=round(time.monotonic() - started, 2))
+                results.put(payload)
+
+    for city, days_list in by_city.items():
+        batch_executor.submit(plan_city, city, days_list)
+    total = sum(len(days_list) for days_list in by_city.values())
+
+    def generate():
+        started = time.monotonic()
+        succeeded = failed = 0
+        for payload in invalid:
+            failed += 1
+            yield dumps_json(payload) + "\n"
+        for _ in range(total):
+            payload = results.get()
+            if payload['status'] == 'success':
+                succeeded += 1
+            else:
+                failed += 1
+            yield dumps_json(payload) + "\n"
+        yield dumps_json({
+            'status': 'done',
+            'total': total + len(invalid),
+            'succeeded': succeeded,
+            'failed': failed,
+            'elapsed_seconds': round(time.monotonic() - started, 2)
+        }) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def prewarm_plan(city: str, days: int) -> int:
+    """
+    预热调度器的 plan_fn：已保存的攻略进入刷新窗口（距过期不足 PREWARM_REFRESH_MARGIN_HOURS）时重新生成，
+    仍使用实体池；与在线请求共用 single-flight，成功后清理检查点。
+    上次预热失败时带上它的 run_id，从已完成的阶段继续。
+
+    Returns:
+        int: 本次实际消耗的模型调用次数（攻略仍新鲜时为 0），失败或降级时抛出 PrewarmFailed
+    """
+    run_key = f"prewarm:run:{city}:{days}"
+    payload, status_code = build_travel_plan(
+        city, days, run_id=get_shared_cache().get(run_key), timeout=0,
+        max_age_hours=max(0.0, PLAN_CACHE_TTL_HOURS - PREWARM_REFRESH_MARGIN_HOURS)
+    )
+    cost = sum(stats.get('calls', 0) for stats in (payload.get('token_usage') or {}).values())
+    if status_code != 200 or payload.get('degraded'):
+        if payload.get('run_id'):
+            get_shared_cache().set(run_key, payload['run_id'], CHECKPOINT_TTL_HOURS * 3600)
+        raise PrewarmFailed(payload.get('message') or f"攻略生成不完整: {payload.get('degraded')}", cost)
+    get_shared_cache().delete(run_key)
+    return cost
+
+def warm_up():
+    """可选的预热：提前导入 camel 并创建模型，设置 WARMUP_ON_START=1 时在启动时调用"""
+    warm_up_models(task for task, _ in AGENT_ROLES.values())
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
+    if os.getenv('WARMUP_ON_START') == '1':
+        warm_up()
+    # PREWARM_ENABLED=1 时在后台预热热门目的地
+    if os.getenv('PREWARM_ENABLED') == '1':
+        PrewarmScheduler(plan_fn=prewarm_plan, itinerary_fn=itinerary_warmer()).start()
+    # 单进程多线程运行；多进程部署用 gunicorn（见 README）
+    # 不使用 reloader：reloader 会把 __main__ 再执行一遍，启动第二个预热调度器
+    app.run(host='0.0.0.0', port=5002, debug=True, use_reloader=False)
\ No newline at end of file
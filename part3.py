@@ -1,27 +1,22 @@
 import os
 import json
 import re
-from flask import Flask, request, jsonify
-import pdfkit
+from typing import Optional
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask import send_file
-from camel.configs import QwenConfig
-from camel.models import ModelFactory
-from camel.types import ModelPlatformType
-from camel.agents import ChatAgent
 from dotenv import load_dotenv
+from model_registry import create_agent, run_task, stream_task, warm_up as warm_up_models
+from service_routes import install as install_service_routes
+from shared_cache import get_shared_cache
+from storage import PLAN_CACHE_TTL_HOURS, file_age, plan_path, report_path
+from geo_planner import GEO_MEALS_PER_DAY, format_skeleton, plan_days
+from prompt_budget import UrlMapper, count_tokens, dedupe_items, fit_to_budget, truncate_text
 
 load_dotenv()
 
 app = Flask(__name__)
-
-# 模型初始化
-qwen_model = ModelFactory.create(
-    model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
-    model_type="Qwen/Qwen2.5-72B-Instruct",
-    api_key=os.getenv("QWEN_API_KEY"),
-    url="https://api-inference.modelscope.cn/v1",
-    model_config_dict=QwenConfig(temperature=0.2).as_dict(),
-)
+# 压缩、条件请求、采样分析和 /metrics/* 路由，见 service_routes
+install_service_routes(app)
 
 # 移除谷歌API相关工具
 tools_list = []
@@ -36,33 +31,42 @@ sys_msg = """
    - 名称
    - 描述
    - 预计游玩/就餐时长（如果用户未提供，可以不写或自行估计）
-   - 图片URL（如果有）
+   - 图片URL（如果有；输入中的图片以 IMG1、IMG2 这样的编号给出，请原样保留编号）
 4. 请利用你自身的知识在行程中对移动或出行所需时长做出合理估计。
 5. 输出语言为中文。
 6. 保持回复简洁、有条理，但必须包含用户想要的所有信息。
 """
 
-agent = ChatAgent(
-    system_message=sys_msg,
-    model=qwen_model,
-    message_window_size=10,
-    output_language='Chinese',
-    tools=tools_list
-)
+# 模型初始化：行程生成属于 itinerary 任务，默认路由到大模型（见 model_registry.TASK_TIERS）
+# 每次生成都新建 Agent（模型在进程内共享）：被 hedged_step 放弃的调用返回时只会写入它自己的 Agent，
+# 不会把上一份行程带进下一个请求的会话历史。服务启动时不导入 camel、不连接模型
+
+def create_itinerary_agent(tier=None):
+    return create_agent(
+        "itinerary",
+        sys_msg,
+        tier=tier,
+        temperature=0.2,
+        message_window_size=10,
+        output_language='Chinese',
+        tools=tools_list
+    )
 
-def create_usr_msg(data: dict) -> str:
-    city = data.get("city", "")
-    days_str = data.get("days", "1")
-    try:
-        days = int(days_str)
-    except ValueError:
-        days = 1
+def warm_up():
+    """可选的预热：提前导入 camel 并创建模型，设置 WARMUP_ON_START=1 时在启动时调用"""
+    warm_up_models(["itinerary"], temperature=0.2)
+
+def render_usr_msg(city: str, days: int, scenic_spots: list, foods: list,
+                   desc_chars: Optional[int] = None,
+                   url_mapper: Optional[UrlMapper] = None) -> str:
+    def describe(text) -> str:
+        return truncate_text(text, desc_chars) if desc_chars else text
+
+    def picurl(url) -> str:
+        return url_mapper.shorten(url) if url_mapper is not None else url
 
     lines = []
     lines.append(f"我准备去{city}旅行，共 {days} 天。下面是我提供的旅行信息：\n")
-    
-    scenic_spots = data.get("景点", [])
-    foods = data.get("美食", [])
 
     if scenic_spots:
         lines.append("- 景点：")
@@ -71,18 +75,18 @@ def create_usr_msg(data: dict) -> str:
             if '距离' in spot:
                 lines.append(f"     - 距离：{spot['距离']}")
             if 'describe' in spot:
-                lines.append(f"     - 描述：{spot['describe']}")
+                lines.append(f"     - 描述：{describe(spot['describe'])}")
             if '图片url' in spot:
-                lines.append(f"     - 图片URL：{spot['图片url']}")
+                lines.append(f"     - 图片URL：{picurl(spot['图片url'])}")
 
     if foods:
         lines.append("\n- 美食：")
         for i, food in enumerate(foods, 1):
             lines.append(f"  {i}. {food.get('name', '未知美食名称')}")
             if 'describe' in food:
-                lines.append(f"     - 描述：{food['describe']}")
+                lines.append(f"     - 描述：{describe(food['describe'])}")
             if '图片url' in food:
-                lines.append(f"     - 图片URL：{food['图片url']}")
+                lines.append(f"     - 图片URL：{picurl(food['图片url'])}")
 
     lines.append(f"""
     \n请你根据以上信息，规划一个 {days} 天的行程表。
@@ -106,6 +110,71 @@ def create_usr_msg(data: dict) -> str:
     )
     return "\n".join(lines)
 
+def render_skeleton_msg(city: str, days: int, skeleton: str) -> str:
+    return f"""我准备去{city}旅行，共 {days} 天。下面是已经按地理位置排好的每日行程骨架，每天去哪些景点、先后顺序和距离都已确定，请不要调整：
+
+{skeleton}
+
+请你根据以上骨架撰写 {days} 天的行程表：为每一站补充游玩说明和站与站之间的出行方式，
+早餐、午餐、晚餐优先从当天的可选餐饮中选择。请按以下格式输出：
+
+Day1:
+- 早餐：
+- 上午：
+- 午餐：
+- 下午：
+- 晚餐：
+...
+
+Day{days}:
+...
+"""
+
+def create_usr_msg(data: dict, url_mapper: Optional[UrlMapper] = None) -> str:
+    city = data.get("city", "")
+    days_str = data.get("days", "1")
+    try:
+        days = int(days_str)
+    except ValueError:
+        days = 1
+
+    scenic_spots = data.get("景点", [])
+    foods = data.get("美食", [])
+
+    original_tokens = count_tokens(render_usr_msg(city, days, scenic_spots, foods))
+
+    # 能从离线地名库解析出坐标时，先在本地把景点按天聚类、排好路线，
+    # 模型只需要按固定骨架撰写行程说明
+    day_plan = plan_days(data, days)
+    if day_plan is not None:
+        # 骨架中的景点和顺序不变：超出 token 预算时先压缩描述，再减少每天的可选餐饮
+        sections = {str(day["day"]): day["meals"][:GEO_MEALS_PER_DAY] for day in day_plan}
+        usr_msg, report = fit_to_budget(
+            sections,
+            lambda current, desc_chars: render_skeleton_msg(city, days, format_skeleton(
+                [dict(day, meals=current[str(day["day"])]) for day in day_plan], url_mapper, desc_chars
+            )),
+        )
+        print(f"行程提示词（本地路线骨架）: {report['tokens']} tokens，原始 {original_tokens} tokens，"
+              f"节省 {max(0, original_tokens - report['tokens'])} tokens")
+        return usr_msg
+
+    # 按名称去重、截断描述，图片URL换成短id（生成后由 url_mapper.restore 还原），
+    # 在 token 预算内渲染提示词
+    sections = {
+        "景点": dedupe_items(scenic_spots, "name"),
+        "美食": dedupe_items(foods, "name"),
+    }
+    usr_msg, report = fit_to_budget(
+        sections,
+        lambda current, desc_chars: render_usr_msg(
+            city, days, current["景点"], current["美食"], desc_chars, url_mapper
+        ),
+    )
+    print(f"行程提示词: {report['tokens']} tokens，原始 {original_tokens} tokens，"
+          f"节省 {max(0, original_tokens - report['tokens'])} tokens")
+    return usr_msg
+
 def fix_exclamation_link(text: str) -> str:
     md_pattern = re.compile(r'!\[.*?\]\((https?://\S+)\)')
     return md_pattern.sub(lambda m: m.group(1), text)
@@ -180,7 +249,7 @@ def generate_cards_html(data_dict):
 
     return "\n".join(html_parts)
 
-def generate_html_report(itinerary_text, data_dict):
+def generate_html_head() -> str:
     html_parts = []
     html_parts.append("<!DOCTYPE html>")
     html_parts.append("<html><head><meta charset='utf-8'><title>旅行推荐</title>")
@@ -252,6 +321,10 @@ def generate_html_report(itinerary_text, data_dict):
     html_parts.append("</style></head><body>")
     html_parts.append("<h1>旅行行程与推荐</h1>")
     html_parts.append('<div class="itinerary-text">')
+    return "\n".join(html_parts)
+
+def generate_itinerary_html_parts(itinerary_text: str) -> list:
+    html_parts = []
     for line in itinerary_text.split("\n"):
         if not line.strip():
             continue
@@ -259,11 +332,55 @@ def generate_html_report(itinerary_text, data_dict):
             html_parts.append(f"<h2>{line.strip()}</h2>")
         else:
             html_parts.append(f"<p>{line}</p>")
+    return html_parts
+
+def generate_html_tail(data_dict) -> str:
+    html_parts = []
     html_parts.append('</div>')
     html_parts.append(generate_cards_html(data_dict))
     html_parts.append("</body></html>")
     return "\n".join(html_parts)
 
+def generate_html_report(itinerary_text, data_dict):
+    html_parts = [generate_html_head()]
+    html_parts.extend(generate_itinerary_html_parts(itinerary_text))
+    html_parts.append(generate_html_tail(data_dict))
+    return "\n".join(html_parts)
+
+class ItineraryStreamRenderer:
+    """
+    把模型输出的 token 流按行转换成 HTML 片段。
+
+    只处理已经完整的行（Day 标题、"- 图片URL：" 等），未完成的行留在缓冲区，
+    拼接后的结果与一次性调用 generate_html_report 的结果一致。
+    """
+
+    def __init__(self, url_mapper: Optional[UrlMapper] = None):
+        self.url_mapper = url_mapper
+        self.buffer = ""
+        self.lines = []
+
+    def _render_line(self, line: str) -> str:
+        if self.url_mapper is not None:
+            line = self.url_mapper.restore(line)
+        self.lines.append(line)
+        parts = generate_itinerary_html_parts(convert_picurl_to_img_tag(line))
+        return "".join("\n" + part for part in parts)
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        *complete, self.buffer = self.buffer.split("\n")
+        return "".join(self._render_line(line) for line in complete)
+
+    def close(self) -> str:
+        html = self._render_line(self.buffer) if self.buffer else ""
+        self.buffer = ""
+        return html
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
 def save_html_file(city: str, days: str, html_content: str) -> str:
     # 保存路径改为和JSON文件同目录（第五章文件夹下）
     current_dir = os.path.dirname(os.path.abspath(__file__))  # 当前脚本所在目录
@@ -320,6 +437,16 @@ def save_html_file(city: str, days: str, html_content: str) -> str:
 #     }), 200
 # ✨✨✨ 这是修正后的完整函数，请直接复制替换 ✨✨✨
 
+def load_cached_report(city: str, days, json_filename: str, refresh: bool = False) -> Optional[str]:
+    """行程 HTML 比攻略 JSON 新且未过期时返回其路径，否则返回 None"""
+    cached_file = report_path(city, days)
+    report_age = file_age(cached_file)
+    if (not refresh and report_age is not None
+            and report_age <= PLAN_CACHE_TTL_HOURS * 3600
+            and report_age <= file_age(json_filename)):
+        return cached_file
+    return None
+
 @app.route("/generate_itinerary_html", methods=["POST"])
 def generate_itinerary_html():
     req_data = request.json or {}
@@ -354,18 +481,103 @@ def generate_itinerary_html():
             "error": f"文件 {json_filename} 格式错误，请检查文件内容！"
         }), 400
 
-    # 生成行程并返回结果 (这部分逻辑保持不变)
-    usr_msg = create_usr_msg(data)
-    response = agent.step(usr_msg)
-    model_output = response.msgs[0].content
-    end_output = convert_picurl_to_img_tag(model_output)
-    html_content = generate_html_report(end_output, data)
-    saved_file = save_html_file(city, days, html_content)
-
-    return jsonify({
-        "file_path": saved_file,
-        "html_content": html_content
-    }), 200
+    # 行程 HTML 比攻略 JSON 新且未过期时直接返回（可由预热调度器提前生成），refresh=true 强制重新生成
+    # include_html=false 时只返回文件路径和 GET 地址，HTML 由 /itinerary_html 单独获取（支持 ETag/304）
+    include_html = req_data.get("include_html", True) is not False
+
+    cached_file = load_cached_report(city, days, json_filename, req_data.get("refresh"))
+    if cached_file is not None:
+        with open(cached_file, "r", encoding="utf-8") as f:
+            return jsonify(report_payload(city, days, {
+                "file_path": cached_file,
+                "html_content": f.read(),
+                "cached": True
+            }, include_html)), 200
+
+    # 生成行程并返回结果；提示词里的图片短id在这里还原成原始URL
+    def compute_report() -> dict:
+        url_mapper = UrlMapper()
+        usr_msg = create_usr_msg(data, url_mapper)
+        model_output = url_mapper.restore(run_task("itinerary", usr_msg, create_itinerary_agent,
+                                                   hedge_factory=create_itinerary_agent))
+        end_output = convert_picurl_to_img_tag(model_output)
+        html_content = generate_html_report(end_output, data)
+        saved_file = save_html_file(city, days, html_content)
+        return {
+            "file_path": saved_file,
+            "html_content": html_content
+        }
+
+    # 多个工作进程同时请求同一份攻略的行程时只生成一次；攻略 JSON 更新后 key 随之变化
+    cache_key = f"itinerary:{city}:{days}:{int(os.path.getmtime(json_filename))}"
+    if req_data.get("refresh"):
+        get_shared_cache().delete(cache_key)
+    report = get_shared_cache().get_or_compute(cache_key, compute_report, PLAN_CACHE_TTL_HOURS * 3600)
+
+    return jsonify(report_payload(city, days, report, include_html)), 200
+
+def report_payload(city: str, days, report: dict, include_html: bool = True) -> dict:
+    payload = dict(report, html_url=f"/itinerary_html/{city}/{days}")
+    if not include_html:
+        payload.pop("html_content", None)
+    return payload
+
+@app.route("/itinerary_html/<city>/<int:days>", methods=["GET"])
+def get_itinerary_html(city: str, days: int):
+    """读取已生成的行程 HTML；响应带 ETag，内容未变时返回 304"""
+    html_file = report_path(city, days)
+    if not os.path.exists(html_file):
+        return jsonify({"error": f"行程 {html_file} 尚未生成"}), 404
+    with open(html_file, "r", encoding="utf-8") as f:
+        return Response(f.read(), mimetype="text/html")
+@app.route("/generate_itinerary_html/stream", methods=["POST"])
+def generate_itinerary_html_stream():
+    """
+    流式生成行程 HTML：模型每生成完整的一行就转换成 HTML 推送给客户端（chunked 传输），
+    生成结束后再把完整的 HTML 保存到文件。
+    """
+    req_data = request.json or {}
+    city = req_data.get("city", "")
+    days = req_data.get("days", "1")
+
+    json_filename = plan_path(city, days)
+    if not os.path.exists(json_filename):
+        return jsonify({
+            "error": f"文件 {json_filename} 不存在，请检查 'storage' 目录下是否存在该文件！"
+        }), 404
+    try:
+        with open(json_filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except json.JSONDecodeError:
+        return jsonify({
+            "error": f"文件 {json_filename} 格式错误，请检查文件内容！"
+        }), 400
+
+    cached_file = load_cached_report(city, days, json_filename, req_data.get("refresh"))
+    if cached_file is not None:
+        return send_file(cached_file, mimetype="text/html; charset=utf-8")
+
+    url_mapper = UrlMapper()
+    usr_msg = create_usr_msg(data, url_mapper)
+
+    def generate():
+        renderer = ItineraryStreamRenderer(url_mapper)
+        html_parts = [generate_html_head()]
+        yield html_parts[0]
+        for chunk in stream_task("itinerary", sys_msg, usr_msg, temperature=0.2):
+            html = renderer.feed(chunk)
+            if html:
+                html_parts.append(html)
+                yield html
+        html_parts.append(renderer.close())
+        html_parts.append("\n" + generate_html_tail(data))
+        yield html_parts[-2] + html_parts[-1]
+
+        saved_file = save_html_file(city, days, "".join(html_parts))
+        print(f"流式生成的行程已保存到: {saved_file}")
+
+    return Response(stream_with_context(generate()), mimetype="text/html; charset=utf-8")
+
 # @app.route("/generate_itinerary_pdf", methods=["POST"])
 # def generate_itinerary_pdf():
 #     req_data = request.json or {}
@@ -398,6 +610,9 @@ def generate_itinerary_pdf():
     response_data = html_response.get_json()
     html_content = response_data.get("html_content")
     html_file_path = response_data.get("file_path")
+    if not html_content and html_file_path and os.path.exists(html_file_path):
+        with open(html_file_path, "r", encoding="utf-8") as f:
+            html_content = f.read()
 
     if not html_content or not html_file_path:
         return jsonify({"error": "生成HTML时未能获取到有效内容或路径"}), 500
@@ -416,6 +631,7 @@ def generate_itinerary_pdf():
             ],
             'no-outline': None
         }
+        import pdfkit  # 只有生成 PDF 时才需要
         pdfkit.from_string(html_content, pdf_file_path, options=options)
 
         print(f"PDF文件已成功生成: {pdf_file_path}")
@@ -439,4 +655,7 @@ def index():
     return "Welcome to the Travel Itinerary Generator!"
 
 if __name__ == "__main__":
+    if os.getenv("WARMUP_ON_START") == "1":
+        warm_up()
+    # 单进程多线程运行；多进程部署用 gunicorn（见 README）
     app.run(host="0.0.0.0", port=5004, debug=True,use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,248 @@
+import os
+import re
+import glob
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from entity_pool import POOL_SECTIONS
+from storage import STORAGE_DIR
+
+# 已保存攻略中景点、美食、店铺的倒排索引（SQLite），支持中文 n-gram 检索
+PLAN_INDEX_PATH = os.getenv("PLAN_INDEX_PATH", os.path.join(STORAGE_DIR, "plan_index.sqlite3"))
+PLAN_FILE_PATTERN = "*天旅游信息.json"
+# 名称命中的权重高于描述命中；城市名也写入索引（权重为 0），"深圳 海鲜" 这样带城市的查询也能命中
+NAME_WEIGHT = 3
+DESCRIBE_WEIGHT = 1
+CITY_WEIGHT = 0
+# 索引格式版本，变化时已有的索引会在下一次 sync 时全部重建
+INDEX_VERSION = 1
+
+_CJK = re.compile(r"[㐀-鿿豈-﫿]+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> Set[str]:
+    """中文切成单字和相邻二字（bigram），英文和数字按单词切分并转小写"""
+    text = (text or "").lower()
+    terms: Set[str] = set(_WORD.findall(text))
+    for run in _CJK.findall(text):
+        terms.update(run)
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def query_terms(text: str) -> Set[str]:
+    """查询词：中文只用 bigram（单字查询才用单字），减少候选数量"""
+    text = (text or "").lower()
+    terms: Set[str] = set(_WORD.findall(text))
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            terms.add(run)
+        else:
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+class PlanIndex:
+    """
+    攻略实体的倒排索引。
+
+    entities 表每行是某份攻略中的一个景点/美食/店铺；postings 表是 (词, 实体, 权重)。
+    每份攻略文件按修改时间增量索引：重新保存的攻略先删掉旧的实体再写入新的。
+    """
+
+    def __init__(self, path: str = PLAN_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, mtime REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS entities (
+                    id INTEGER PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    city TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    describe TEXT NOT NULL,
+                    image_url TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entities_source ON entities (source);
+                CREATE INDEX IF NOT EXISTS entities_city ON entities (city, kind);
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    entity_id INTEGER NOT NULL,
+                    weight INTEGER NOT NULL,
+                    PRIMARY KEY (term, entity_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_entity ON postings (entity_id);
+            """)
+            if conn.execute("PRAGMA user_version").fetchone()[0] < INDEX_VERSION:
+                # 旧版本的索引：全部清空，sync 时按新格式重新索引所有攻略
+                with conn:
+                    for table in ("postings", "entities", "sources"):
+                        conn.execute(f"DELETE FROM {table}")
+                conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def index_plan(self, source: str, plan: Dict[str, Any], mtime: Optional[float] = None) -> int:
+        """把一份攻略中的实体写入索引（替换该文件之前的内容），返回写入的实体数"""
+        city = plan.get("city", "")
+        mtime = mtime if mtime is not None else (os.path.getmtime(source) if os.path.exists(source) else 0.0)
+        conn = self._conn()
+        count = 0
+        with conn:
+            self._remove(conn, source)
+            for kind, section in POOL_SECTIONS.items():
+                for item in plan.get(section, []) or []:
+                    name = item.get("name", "")
+                    if not name:
+                        continue
+                    describe = item.get("describe", "") or ""
+                    cursor = conn.execute(
+                        "INSERT INTO entities (source, city, kind, name, describe, image_url) VALUES (?, ?, ?, ?, ?, ?)",
+                        (source, city, kind, name, describe, item.get("图片url", "") or ""),
+                    )
+                    weights = {term: CITY_WEIGHT for term in tokenize(city)}
+                    weights.update({term: DESCRIBE_WEIGHT for term in tokenize(describe)})
+                    weights.update({term: NAME_WEIGHT for term in tokenize(name)})
+                    conn.executemany(
+                        "INSERT INTO postings (term, entity_id, weight) VALUES (?, ?, ?)",
+                        [(term, cursor.lastrowid, weight) for term, weight in weights.items()],
+                    )
+                    count += 1
+            conn.execute("INSERT OR REPLACE INTO sources (path, mtime) VALUES (?, ?)", (source, mtime))
+        return count
+
+    def _remove(self, conn: sqlite3.Connection, source: str) -> None:
+        conn.execute(
+            "DELETE FROM postings WHERE entity_id IN (SELECT id FROM entities WHERE source = ?)", (source,)
+        )
+        conn.execute("DELETE FROM entities WHERE source = ?", (source,))
+        conn.execute("DELETE FROM sources WHERE path = ?", (source,))
+
+    def sync(self, directory: str = STORAGE_DIR) -> Dict[str, int]:
+        """增量同步目录下的攻略文件：只重新索引新增或修改过的文件，删除已不存在的文件"""
+        conn = self._conn()
+        known = dict(conn.execute("SELECT path, mtime FROM sources").fetchall())
+        stats = {"indexed": 0, "removed": 0, "unchanged": 0}
+        current = set()
+        for path in glob.glob(os.path.join(directory, PLAN_FILE_PATTERN)):
+            current.add(path)
+            mtime = os.path.getmtime(path)
+            if known.get(path) == mtime:
+                stats["unchanged"] += 1
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    plan = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"索引攻略 {path} 失败: {str(e)}")
+                continue
+            self.index_plan(path, plan, mtime)
+            stats["indexed"] += 1
+        for path in set(known) - current:
+            with conn:
+                self._remove(conn, path)
+            stats["removed"] += 1
+        return stats
+
+    def search(self, query: str = "", city: Optional[str] = None, kind: Optional[str] = None,
+               limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        检索实体。
+
+        Args:
+            query (str): 关键词，匹配名称和描述，多个关键词用空格分隔（需全部命中）；为空时按城市/类别列出全部实体.
+            city (str): 只检索该城市.
+            kind (str): attractions / foods / shops.
+            limit (int): 最多返回条数.
+
+        Returns:
+            list: [{"city", "kind", "name", "describe", "图片url", "score"}, ...]，同城市同名的实体只保留一条
+        """
+        filters, params = [], []
+        if city:
+            filters.append("e.city = ?")
+            params.append(city)
+        if kind:
+            filters.append("e.kind = ?")
+            params.append(kind)
+
+        terms = sorted(query_terms(query))
+        if terms:
+            where = " AND ".join(["p.term IN (%s)" % ",".join("?" * len(terms))] + filters)
+            sql = (
+                "SELECT e.city, e.kind, e.name, e.describe, e.image_url, SUM(p.weight) AS score "
+                "FROM postings p JOIN entities e ON e.id = p.entity_id "
+                f"WHERE {where} GROUP BY e.id HAVING COUNT(*) = ? ORDER BY score DESC, e.id DESC"
+            )
+            rows = self._conn().execute(sql, terms + params + [len(terms)]).fetchall()
+        else:
+            where = " AND ".join(filters) or "1"
+            sql = (f"SELECT e.city, e.kind, e.name, e.describe, e.image_url, 0 FROM entities e "
+                   f"WHERE {where} ORDER BY e.id DESC")
+            rows = self._conn().execute(sql, params).fetchall()
+
+        needles = (query or "").lower().split()
+        results, seen = [], set()
+        for city_, kind_, name, describe, image_url, score in rows:
+            # bigram 都命中但不连续时（如"海鲜饭"拆成"海鲜""鲜饭"分散出现）过滤掉；
+            # 多个关键词各自在城市、名称或描述中连续出现即可，不要求彼此相邻
+            text = f"{city_.lower()}\n{name.lower()}\n{describe.lower()}"
+            if any(needle not in text for needle in needles):
+                continue
+            key = (city_, kind_, name)
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append({"city": city_, "kind": kind_, "name": name, "describe": describe,
+                            "图片url": image_url, "score": score})
+            if len(results) >= limit:
+                break
+        return results
+
+    def find_image(self, city: str, name: str) -> str:
+        """已保存攻略中同城市同名实体的图片，供规划时代替 Serper 图片搜索"""
+        row = self._conn().execute(
+            "SELECT image_url FROM entities WHERE city = ? AND name = ? AND image_url != '' ORDER BY id DESC LIMIT 1",
+            (city, name),
+        ).fetchone()
+        return row[0] if row else ""
+
+    def cities(self) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT city, kind, COUNT(DISTINCT name) FROM entities GROUP BY city, kind ORDER BY city"
+        ).fetchall()
+        summary: Dict[str, Dict[str, Any]] = {}
+        for city, kind, count in rows:
+            summary.setdefault(city, {"city": city})[kind] = count
+        return list(summary.values())
+
+
+_plan_index: Optional[PlanIndex] = None
+_plan_index_lock = threading.Lock()
+
+
+def get_plan_index() -> PlanIndex:
+    """进程内共享的索引，第一次使用时同步一次 storage 目录"""
+    global _plan_index
+    with _plan_index_lock:
+        if _plan_index is None:
+            index = PlanIndex()
+            try:
+                print(f"攻略索引同步: {index.sync()}")
+            except Exception as e:
+                print(f"攻略索引同步失败: {str(e)}")
+            _plan_index = index
+    return _plan_index
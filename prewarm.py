@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from rate_limit import BACKGROUND, priority
+from shared_cache import get_shared_cache
+from storage import STORAGE_DIR, PLAN_CACHE_TTL_HOURS, plan_path, file_age
+
+load_dotenv()
+
+# 请求历史：每行一个 {"ts", "source", "city", "days"}
+REQUEST_LOG_FILE = os.path.join(STORAGE_DIR, "request_log.jsonl")
+# 请求历史超过该字节数时轮转为 request_log.jsonl.1（只保留一份旧文件）
+REQUEST_LOG_MAX_BYTES = int(os.getenv("REQUEST_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# --- 预热配置（可在 .env 中修改） ---
+PREWARM_TOP_K = int(os.getenv("PREWARM_TOP_K", "10"))
+# 统计最近多少天的请求
+PREWARM_HISTORY_DAYS = float(os.getenv("PREWARM_HISTORY_DAYS", "7"))
+# 低峰时段，格式为 "开始小时-结束小时"，可以跨零点，例如 "23-6"
+PREWARM_OFFPEAK_HOURS = os.getenv("PREWARM_OFFPEAK_HOURS", "1-6")
+# 每天预热允许消耗的模型调用次数，以及生成一份攻略前预扣的调用次数（生成后按实际用量结算）
+PREWARM_DAILY_BUDGET = int(os.getenv("PREWARM_DAILY_BUDGET", "200"))
+PREWARM_COST_PER_PLAN = int(os.getenv("PREWARM_COST_PER_PLAN", "25"))
+# 在攻略过期前多少小时提前刷新
+PREWARM_REFRESH_MARGIN_HOURS = float(os.getenv("PREWARM_REFRESH_MARGIN_HOURS", "12"))
+# 调度器检查间隔（秒）
+PREWARM_INTERVAL_SECONDS = float(os.getenv("PREWARM_INTERVAL_SECONDS", "600"))
+# 行程 HTML 服务地址（part3），配置后同时预热行程
+PREWARM_ITINERARY_URL = os.getenv("PREWARM_ITINERARY_URL", "")
+
+_log_lock = threading.Lock()
+
+
+class PrewarmFailed(RuntimeError):
+    """预热失败；cost 为失败前实际消耗的模型调用次数，未知时为 None"""
+
+    def __init__(self, message: str, cost: Optional[int] = None):
+        super().__init__(message)
+        self.cost = cost
+
+
+def rotate_log(log_file: str = REQUEST_LOG_FILE, max_bytes: int = REQUEST_LOG_MAX_BYTES) -> None:
+    """文件超过 max_bytes 时改名为 <log_file>.1，覆盖上一份旧文件"""
+    if max_bytes <= 0:
+        return
+    try:
+        if os.path.getsize(log_file) >= max_bytes:
+            os.replace(log_file, log_file + ".1")
+    except FileNotFoundError:
+        pass
+
+
+def log_request(source: str, city: Optional[str], days) -> None:
+    """记录一次 (city, days) 请求，供预热调度器统计热门目的地；文件过大时自动轮转"""
+    if not city or not days:
+        return
+    try:
+        days = int(days)
+    except (TypeError, ValueError):
+        return
+    record = {"ts": time.time(), "source": source, "city": city, "days": days}
+    try:
+        with _log_lock:
+            os.makedirs(STORAGE_DIR, exist_ok=True)
+            rotate_log(REQUEST_LOG_FILE, REQUEST_LOG_MAX_BYTES)
+            with open(REQUEST_LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"记录请求历史失败: {str(e)}")
+
+
+def popular_keys(top_k: int = PREWARM_TOP_K, history_days: float = PREWARM_HISTORY_DAYS,
+                 log_file: str = REQUEST_LOG_FILE) -> List[Tuple[str, int, int]]:
+    """
+    统计最近的热门 (city, days)，轮转出去的 <log_file>.1 也参与统计。
+
+    Returns:
+        list: [(city, days, 请求次数), ...]，按请求次数从高到低排列
+    """
+    since = time.time() - history_days * 86400
+    counter = Counter()
+    for path in (log_file + ".1", log_file):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("ts", 0) >= since:
+                        counter[(record["city"], int(record["days"]))] += 1
+        except FileNotFoundError:
+            continue
+    return [(city, days, count) for (city, days), count in counter.most_common(top_k)]
+
+
+def parse_hours(spec: str) -> Tuple[int, int]:
+    start, end = spec.split("-")
+    return int(start) % 24, int(end) % 24
+
+
+def in_offpeak(now: Optional[datetime] = None, spec: str = PREWARM_OFFPEAK_HOURS) -> bool:
+    hour = (now or datetime.now()).hour
+    start, end = parse_hours(spec)
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def itinerary_warmer(url: str = PREWARM_ITINERARY_URL) -> Optional[Callable[[str, int], None]]:
+    """
+    通过 part3 的接口预热行程 HTML，未配置地址时返回 None。
+    不带 refresh：攻略 JSON 更新后 part3 会自动重新生成行程，攻略未变时直接复用已有的 HTML。
+    """
+    if not url:
+        return None
+
+    def warm(city: str, days: int) -> None:
+        response = requests.post(url, json={"city": city, "days": days, "include_html": False}, timeout=600)
+        response.raise_for_status()
+
+    return warm
+
+
+class PrewarmScheduler:
+    """
+    热门目的地预热调度器。
+
+    在低峰时段读取请求历史，为 top-K 的 (city, days) 预先生成攻略和行程，
+    并在已保存的攻略过期前提前刷新；每天的模型调用量不超过预算。
+    plan_fn 返回本次实际消耗的模型调用次数：生成前先预扣 cost_per_plan，生成后按实际用量多退少补。
+    当天已用的预算记录在 shared_cache 中，cron 多次运行和多个服务进程共用同一份预算。
+    """
+
+    def __init__(
+        self,
+        plan_fn: Callable[[str, int], Optional[int]],
+        itinerary_fn: Optional[Callable[[str, int], None]] = None,
+        top_k: int = PREWARM_TOP_K,
+        daily_budget: int = PREWARM_DAILY_BUDGET,
+        cost_per_plan: int = PREWARM_COST_PER_PLAN,
+        ttl_hours: float = PLAN_CACHE_TTL_HOURS,
+        refresh_margin_hours: float = PREWARM_REFRESH_MARGIN_HOURS,
+        offpeak_hours: str = PREWARM_OFFPEAK_HOURS,
+        interval_seconds: float = PREWARM_INTERVAL_SECONDS,
+    ):
+        self.plan_fn = plan_fn
+        self.itinerary_fn = itinerary_fn
+        self.top_k = top_k
+        self.daily_budget = daily_budget
+        self.cost_per_plan = cost_per_plan
+        self.ttl_hours = ttl_hours
+        self.refresh_margin_hours = refresh_margin_hours
+        self.offpeak_hours = offpeak_hours
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def due_keys(self) -> List[Tuple[str, int]]:
+        """需要预热的热门目的地：尚未生成，或即将过期"""
+        refresh_after = max(0.0, self.ttl_hours - self.refresh_margin_hours) * 3600
+        due = []
+        for city, days, _ in popular_keys(self.top_k):
+            age = file_age(plan_path(city, days))
+            if age is None or age >= refresh_after:
+                due.append((city, days))
+        return due
+
+    @staticmethod
+    def budget_key(now: datetime) -> str:
+        return f"prewarm:spent:{now.date().isoformat()}"
+
+    def spent(self, now: Optional[datetime] = None) -> int:
+        """当天已用的预热预算"""
+        return int(get_shared_cache().get(self.budget_key(now or datetime.now())) or 0)
+
+    def reserve_budget(self, now: datetime) -> bool:
+        """预扣一份攻略的预算，当天预算不足时返回 False"""
+        spent = get_shared_cache().incr(self.budget_key(now), self.cost_per_plan, 2 * 86400, limit=self.daily_budget)
+        return spent is not None
+
+    def settle_budget(self, now: datetime, cost: Optional[int]) -> None:
+        """按实际用量结算预扣的预算；用量未知（None）时保留预扣值"""
+        if cost is None or cost == self.cost_per_plan:
+            return
+        get_shared_cache().incr(self.budget_key(now), cost - self.cost_per_plan, 2 * 86400)
+
+    def run_once(self, now: Optional[datetime] = None, force: bool = False) -> List[Tuple[str, int]]:
+        """执行一轮预热，返回本轮生成的 (city, days)"""
+        now = now or datetime.now()
+        if not force and not in_offpeak(now, self.offpeak_hours):
+            return []
+
+        warmed = []
+        for city, days in self.due_keys():
+            if self._stop.is_set():
+                break
+            if not self.reserve_budget(now):
+                print(f"预热预算已用完（{self.spent(now)}/{self.daily_budget}），剩余目的地留到明天")
+                break
+            try:
+                print(f"预热攻略: {city}{days}天")
+                cost = self.plan_fn(city, days)
+            except Exception as e:
+                self.settle_budget(now, getattr(e, "cost", None))
+                print(f"预热 {city}{days}天 失败: {str(e)}")
+                continue
+            self.settle_budget(now, cost)
+            try:
+                if self.itinerary_fn is not None:
+                    self.itinerary_fn(city, days)
+                warmed.append((city, days))
+            except Exception as e:
+                print(f"预热 {city}{days}天 行程失败: {str(e)}")
+        return warmed
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                # 预热属于后台任务，上游配额优先让给在线请求
+                with priority(BACKGROUND):
+                    self.run_once()
+            except Exception as e:
+                print(f"预热调度出错: {str(e)}")
+            self._stop.wait(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="prewarm", daemon=True)
+        self._thread.start()
+        print(f"预热调度器已启动：top {self.top_k}，低峰时段 {self.offpeak_hours} 点")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def generate_plan(city: str, days: int) -> int:
+    """
+    cron 方式运行时的 plan_fn：通过 part2.build_travel_plan 生成攻略，
+    与在线请求共用 single-flight，成功后清理检查点。part2 作为服务运行时直接传入 part2.prewarm_plan。
+    """
+    from part2 import prewarm_plan
+    return prewarm_plan(city, days)
+
+
+if __name__ == "__main__":
+    # 供 cron 调用：python prewarm.py [--force]，--force 忽略低峰时段限制
+    scheduler = PrewarmScheduler(plan_fn=generate_plan, itinerary_fn=itinerary_warmer())
+    with priority(BACKGROUND):
+        warmed = scheduler.run_once(force="--force" in sys.argv)
+    for city, days in warmed:
+        print(f"已预热: {city}{days}天")
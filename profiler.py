@@ -0,0 +1,217 @@
+import os
+import sys
+import hmac
+import time
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import Flask, Response, abort, g, jsonify, request
+
+# --- 采样分析器配置 ---
+# PROFILE_ENABLED=1 时分析该服务的所有请求；否则只分析带 X-Profile: 1 请求头的请求
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+# 采样间隔（毫秒），越大开销越小
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+# 每条调用栈最多保留的帧数
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "64"))
+# 服务监听 0.0.0.0，/debug/profile 和 X-Profile 请求头默认关闭，PROFILE_CONTROL=1 时才注册；
+# 同时设置 PROFILE_TOKEN 时，这些请求还必须带上 X-Profile-Token: <PROFILE_TOKEN>
+PROFILE_CONTROL = os.getenv("PROFILE_CONTROL", "0") == "1"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    基于 sys._current_frames 的采样分析器。
+
+    只对登记过的线程（正在处理被分析请求的线程）采样，按"接口名;外层帧;...;内层帧"聚合，
+    可导出 collapsed stack（flamegraph.pl / speedscope 都能直接读取）和 speedscope JSON。
+    在等待模型或 Serper 的请求线程上采到的是 wait/recv 等帧，CPU 和 I/O 等待在火焰图中一目了然。
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, max_depth: int = PROFILE_MAX_DEPTH):
+        self.interval = interval_ms / 1000
+        self.max_depth = max_depth
+        self.enabled = PROFILE_ENABLED
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self._tracked: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def track(self, label: str, thread_id: Optional[int] = None) -> None:
+        with self._lock:
+            self._tracked[thread_id or threading.get_ident()] = label
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="profiler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def untrack(self, thread_id: Optional[int] = None) -> None:
+        with self._lock:
+            self._tracked.pop(thread_id or threading.get_ident(), None)
+
+    def _stack(self, frame, label: str) -> Tuple[str, ...]:
+        names: List[str] = []
+        while frame is not None and len(names) < self.max_depth:
+            names.append(_frame_name(frame.f_code))
+            # 只保留接口函数及其内部的帧，省略 werkzeug/flask 的外层帧
+            if frame.f_code.co_name == label:
+                break
+            frame = frame.f_back
+        names.reverse()
+        return (label,) + tuple(names)
+
+    def sample(self) -> None:
+        with self._lock:
+            tracked = dict(self._tracked)
+        if not tracked:
+            return
+        frames = sys._current_frames()
+        stacks = [self._stack(frames[tid], label) for tid, label in tracked.items() if tid in frames]
+        with self._lock:
+            for stack in stacks:
+                self.stacks[stack] += 1
+            self.samples += len(stacks)
+
+    def _loop(self) -> None:
+        while True:
+            with self._lock:
+                idle = not self._tracked
+            if idle:
+                # 没有被分析的请求时不采样
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+            self.sample()
+            time.sleep(self.interval)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+
+    def collapsed(self) -> str:
+        """collapsed stack 格式：每行 "帧;帧;帧 次数" """
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in stacks) + "\n"
+
+    def speedscope(self, name: str = "profile") -> Dict[str, Any]:
+        """speedscope 的 sampled 格式，每个接口一个 profile，权重单位为毫秒"""
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        frames: List[Dict[str, str]] = []
+        index: Dict[str, int] = {}
+        profiles: Dict[str, Dict[str, Any]] = {}
+        interval_ms = self.interval * 1000
+        for stack, count in stacks:
+            label = stack[0]
+            for frame_name in stack:
+                if frame_name not in index:
+                    index[frame_name] = len(frames)
+                    frames.append({"name": frame_name})
+            profile = profiles.setdefault(label, {
+                "type": "sampled", "name": label, "unit": "milliseconds",
+                "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+            })
+            profile["samples"].append([index[frame_name] for frame_name in stack])
+            profile["weights"].append(count * interval_ms)
+            profile["endValue"] += count * interval_ms
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "navigator-ai profiler",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            per_endpoint = Counter()
+            for stack, count in self.stacks.items():
+                per_endpoint[stack[0]] += count
+            return {
+                "enabled": self.enabled,
+                "interval_ms": self.interval * 1000,
+                "samples": self.samples,
+                "since": self.started_at,
+                "endpoints": dict(per_endpoint),
+            }
+
+
+profiler = SamplingProfiler()
+
+
+def authorized() -> bool:
+    """PROFILE_TOKEN 为空时只依赖 PROFILE_CONTROL 开关，否则校验请求头中的 token"""
+    if not PROFILE_TOKEN:
+        return True
+    return hmac.compare_digest(request.headers.get(PROFILE_TOKEN_HEADER, ""), PROFILE_TOKEN)
+
+
+def install(app: Flask, control: bool = PROFILE_CONTROL) -> None:
+    """
+    为服务注册采样分析：
+
+    - PROFILE_ENABLED=1 时分析所有请求。
+    - control（PROFILE_CONTROL=1）时才注册 /debug/profile 并接受 X-Profile 请求头：
+      POST /debug/profile {"enabled": true} 分析所有请求，单个请求可带 X-Profile: 1 单独开启；
+      GET /debug/profile?format=collapsed|speedscope|summary 导出结果，DELETE /debug/profile 清空。
+      设置了 PROFILE_TOKEN 时这些请求必须带 X-Profile-Token，否则返回 403。
+    """
+
+    @app.before_request
+    def start_profiling():
+        if request.path.startswith("/debug/profile"):
+            return
+        requested = control and request.headers.get(PROFILE_HEADER) == "1" and authorized()
+        if profiler.enabled or requested:
+            profiler.track(request.endpoint or request.path)
+            g.profiling = True
+
+    @app.teardown_request
+    def stop_profiling(exc=None):
+        # 流式响应在生成结束、请求上下文弹出时才走到这里，整个生成过程都会被采样
+        if g.get("profiling"):
+            profiler.untrack()
+
+    if not control:
+        return
+
+    def get_profile():
+        fmt = request.args.get("format", "collapsed")
+        if fmt == "speedscope":
+            return jsonify(profiler.speedscope(name=app.name))
+        if fmt == "summary":
+            return jsonify(profiler.summary())
+        return Response(profiler.collapsed(), mimetype="text/plain")
+
+    def set_profile():
+        data = request.get_json(silent=True) or {}
+        profiler.enabled = bool(data.get("enabled", not profiler.enabled))
+        return jsonify(profiler.summary())
+
+    def reset_profile():
+        profiler.reset()
+        return jsonify(profiler.summary())
+
+    @app.before_request
+    def check_profile_token():
+        if request.path.startswith("/debug/profile") and not authorized():
+            abort(403)
+
+    app.add_url_rule("/debug/profile", "get_profile", get_profile, methods=["GET"])
+    app.add_url_rule("/debug/profile", "set_profile", set_profile, methods=["POST"])
+    app.add_url_rule("/debug/profile", "reset_profile", reset_profile, methods=["DELETE"])
@@ -0,0 +1,272 @@
+import os
+import re
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 提示词的 token 预算，可在 .env 中配置
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# 单条描述的初始截断长度（字符）
+PROMPT_DESC_MAX_CHARS = int(os.getenv("PROMPT_DESC_MAX_CHARS", "120"))
+# 为了满足预算，描述最多可以被压缩到的长度
+PROMPT_DESC_MIN_CHARS = int(os.getenv("PROMPT_DESC_MIN_CHARS", "30"))
+
+# tiktoken 的词表加载较慢（首次还可能需要下载），在第一次计数时才初始化
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+_CJK_PATTERN = re.compile(r'[　-〿一-鿿＀-￯]')
+# 链接在空白、引号、括号或中文字符（包括中文标点）处结束
+_URL_PATTERN = re.compile(r'https?://[^\s"\'<>)　-〿一-鿿＀-￯]+')
+
+
+def count_tokens(text: str) -> int:
+    """
+    估算文本的 token 数量。
+
+    安装了 tiktoken 时使用真实分词器；否则按中文字符约 1 token、
+    其余字符约 4 个 1 token 估算（与 Qwen 分词器的量级接近）。
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_text(text: Optional[str], max_chars: int) -> str:
+    """把描述截断到 max_chars 个字符，超出部分用省略号表示"""
+    if not text:
+        return ""
+    text = " ".join(str(text).split())
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "…"
+
+
+def dedupe_items(items: List[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    """按 key 字段去重，保留第一次出现的条目"""
+    seen = set()
+    deduped = []
+    for item in items:
+        marker = str(item.get(key) or "").strip().lower()
+        if marker and marker in seen:
+            continue
+        seen.add(marker)
+        deduped.append(item)
+    return deduped
+
+
+class UrlMapper:
+    """
+    把长链接替换成短 id（如 IMG1），模型生成后再映射回原始链接。
+
+    模型并不需要阅读完整的图片 URL，替换后既节省 token，
+    也避免模型抄写长链接时出错。
+    """
+
+    def __init__(self, prefix: str = "IMG"):
+        self.prefix = prefix
+        self.url_to_id: Dict[str, str] = {}
+        self.id_to_url: Dict[str, str] = {}
+        # 不能用 \b：中文字符也算作单词字符，"见IMG1。" 里的 IMG1 两侧都没有单词边界
+        self._pattern = re.compile(rf'(?<![A-Za-z0-9_]){re.escape(prefix)}\d+(?![A-Za-z0-9_])')
+
+    def shorten(self, url: Optional[str]) -> str:
+        if not url:
+            return ""
+        if url not in self.url_to_id:
+            short_id = f"{self.prefix}{len(self.url_to_id) + 1}"
+            self.url_to_id[url] = short_id
+            self.id_to_url[short_id] = url
+        return self.url_to_id[url]
+
+    def shorten_text(self, text: str) -> str:
+        """替换文本中出现的所有链接"""
+        return _URL_PATTERN.sub(lambda m: self.shorten(m.group(0)), text or "")
+
+    def restore(self, text: str) -> str:
+        """把模型输出中的短 id 还原成原始链接，未知 id 保持原样"""
+        return self._pattern.sub(
+            lambda m: self.id_to_url.get(m.group(0), m.group(0)),
+            text or ""
+        )
+
+
+def fit_to_budget(
+    sections: Dict[str, List[Dict[str, Any]]],
+    render: Callable[[Dict[str, List[Dict[str, Any]]], int], str],
+    budget: int = PROMPT_TOKEN_BUDGET,
+    max_chars: int = PROMPT_DESC_MAX_CHARS,
+    min_chars: int = PROMPT_DESC_MIN_CHARS,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    在 token 预算内渲染提示词。
+
+    先按 max_chars 渲染；超出预算时逐步减半描述长度（不低于 min_chars），
+    仍然超出时从条目最多的分组末尾开始裁掉条目。
+
+    Args:
+        sections (dict): 分组名 -> 条目列表，条目已经完成去重与清洗.
+        render (callable): render(sections, desc_chars) -> 提示词文本.
+        budget (int): token 上限，<= 0 表示不限制.
+        max_chars (int): 描述的初始截断长度.
+        min_chars (int): 描述允许压缩到的最小长度.
+
+    Returns:
+        tuple: (提示词文本, 压缩报告)
+    """
+    sections = {name: list(items) for name, items in sections.items()}
+    desc_chars = max_chars
+    prompt = render(sections, desc_chars)
+    tokens = count_tokens(prompt)
+    dropped = 0
+
+    if budget > 0:
+        while tokens > budget and desc_chars > min_chars:
+            desc_chars = max(min_chars, desc_chars // 2)
+            prompt = render(sections, desc_chars)
+            tokens = count_tokens(prompt)
+
+        while tokens > budget:
+            largest = max(sections, key=lambda name: len(sections[name]), default=None)
+            if largest is None or not sections[largest]:
+                break
+            sections[largest].pop()
+            dropped += 1
+            prompt = render(sections, desc_chars)
+            tokens = count_tokens(prompt)
+
+    report = {
+        "tokens": tokens,
+        "budget": budget,
+        "desc_chars": desc_chars,
+        "dropped_items": dropped,
+        "over_budget": budget > 0 and tokens > budget,
+    }
+    return prompt, report
+
+
+def build_base_guide_prompt(
+    city: str,
+    days: int,
+    travel_info: Dict[str, Any],
+    budget: int = PROMPT_TOKEN_BUDGET,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    生成 base 攻略的提示词。
+
+    只保留搜索结果的标题和描述，去掉 result_id、空的 long_description
+    以及链接，按标题去重后在预算内渲染。
+    """
+    info = travel_info.get("travel_info", {})
+    sections = {}
+    for name in ("guides", "attractions", "must_eat", "local_food"):
+        items = [
+            {"title": item.get("title") or "", "description": item.get("description") or ""}
+            for item in info.get(name, [])
+        ]
+        sections[name] = dedupe_items(items, "title")
+
+    def render(current: Dict[str, List[Dict[str, Any]]], desc_chars: int) -> str:
+        compact = {
+            name: [
+                {
+                    "title": _URL_PATTERN.sub("", item["title"]).strip(),
+                    "description": truncate_text(_URL_PATTERN.sub("", item["description"]), desc_chars),
+                }
+                for item in items
+            ]
+            for name, items in current.items()
+        }
+        return f"""
+        参考以下信息，生成一个{city}{days}天攻略路线，直接根据整个travel_info生成
+        {json.dumps(compact, ensure_ascii=False, separators=(',', ':'))}
+        【输出格式】
+        {{
+            "base_guide": "攻略内容"
+        }}
+        """
+
+    original = f"""
+        参考以下信息，生成一个{city}{days}天攻略路线，直接根据整个travel_info生成
+        {travel_info}
+        【输出格式】
+        {{
+            "base_guide": "攻略内容"
+        }}
+        """
+    prompt, report = fit_to_budget(sections, render, budget=budget)
+    report["original_tokens"] = count_tokens(original)
+    report["saved_tokens"] = max(0, report["original_tokens"] - report["tokens"])
+    return prompt, report
+
+
+def build_pool_guide_prompt(
+    city: str,
+    days: int,
+    pool: Dict[str, Any],
+    budget: int = PROMPT_TOKEN_BUDGET,
+) -> Tuple[str, Dict[str, Any]]:
+    """根据城市实体池生成 base 攻略的提示词（不含图片链接）"""
+    sections = {
+        "attractions": dedupe_items(pool.get("attractions", []), "name"),
+        "foods": dedupe_items(pool.get("foods", []), "name"),
+        "food_shops": dedupe_items(pool.get("shops", []), "name"),
+        "guides": dedupe_items(pool.get("guides", []), "title"),
+    }
+
+    def render(current: Dict[str, List[Dict[str, Any]]], desc_chars: int) -> str:
+        compact = {
+            name: [
+                {
+                    "name": item.get("name") or item.get("title") or "",
+                    "description": truncate_text(
+                        _URL_PATTERN.sub("", item.get("describe") or item.get("description") or ""), desc_chars
+                    ),
+                }
+                for item in items
+            ]
+            for name, items in current.items()
+        }
+        return f"""
+        参考以下{city}的景点、美食和攻略信息，生成一个{city}{days}天攻略路线，只使用其中的景点和美食
+        {json.dumps(compact, ensure_ascii=False, separators=(',', ':'))}
+        【输出格式】
+        {{
+            "base_guide": "攻略内容"
+        }}
+        """
+
+    # 对比基准：不做去重和截断，把实体池的原始内容（含图片链接）直接放进提示词
+    raw = {
+        "attractions": pool.get("attractions", []),
+        "foods": pool.get("foods", []),
+        "food_shops": pool.get("shops", []),
+        "guides": pool.get("guides", []),
+    }
+    original = f"""
+        参考以下{city}的景点、美食和攻略信息，生成一个{city}{days}天攻略路线，只使用其中的景点和美食
+        {json.dumps(raw, ensure_ascii=False)}
+        【输出格式】
+        {{
+            "base_guide": "攻略内容"
+        }}
+        """
+    prompt, report = fit_to_budget(sections, render, budget=budget)
+    report["original_tokens"] = count_tokens(original)
+    report["saved_tokens"] = max(0, report["original_tokens"] - report["tokens"])
+    return prompt, report
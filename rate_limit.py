@@ -0,0 +1,223 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from deadline import remaining
+
+# 请求优先级：数值越小越优先。用户在线请求优先于预热等后台任务
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# 每个上游的默认限制：(每秒令牌数, 桶容量, 最大并发)
+# 可以用环境变量覆盖，例如 RATE_LIMIT_SERPER="5,10,4"
+DEFAULT_LIMITS = {
+    "serper": (5.0, 10, 4),
+    "modelscope": (2.0, 4, 4),
+}
+# 被限流（HTTP 429）后的最大重试次数与初始退避秒数
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv("RATE_LIMIT_BACKOFF_SECONDS", "1"))
+
+_priority = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """在 with 块内发出的上游调用都使用给定的优先级"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class UpstreamLimiter:
+    """
+    单个上游的令牌桶限速 + 并发信号量。
+
+    等待者按 (优先级, 到达顺序) 排队，只有队首能拿到令牌，
+    因此后台任务不会插到在线请求前面。
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.tokens = float(burst)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        # 统计数据
+        self.acquired = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, level: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        level = current_priority() if level is None else level
+        start = time.monotonic()
+        entry = (level, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if (self._waiters[0] == entry and self.in_flight < self.concurrency
+                            and self.tokens >= 1 and now >= self.paused_until):
+                        break
+                    # 估算下一次可能满足条件的时间，避免忙等
+                    wait = max(self.paused_until - now, (1 - self.tokens) / self.rate if self.rate > 0 else 1.0, 0.01)
+                    if timeout is not None:
+                        remaining = timeout - (now - start)
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            return False
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+                heapq.heappop(self._waiters)
+                self.tokens -= 1
+                self.in_flight += 1
+                waited = time.monotonic() - start
+                self.acquired += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                return True
+            finally:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def has_capacity(self) -> bool:
+        """当前没有排队者、并发也未占满：再发一个请求不会挤占其他调用"""
+        with self._cond:
+            return not self._waiters and self.in_flight < self.concurrency
+
+    def pause(self, seconds: float) -> None:
+        """收到 429 后暂停发放令牌"""
+        with self._cond:
+            self.throttled += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, level: Optional[int] = None, timeout: Optional[float] = None):
+        if not self.acquire(level, timeout):
+            raise TimeoutError(f"等待 {self.name} 限流配额超时")
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            self._refill(time.monotonic())
+            queued = {}
+            for level, _ in self._waiters:
+                queued[level] = queued.get(level, 0) + 1
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "concurrency": self.concurrency,
+                "in_flight": self.in_flight,
+                "saturation": round(self.in_flight / self.concurrency, 3) if self.concurrency else 0,
+                "tokens": round(self.tokens, 2),
+                "queued": len(self._waiters),
+                "queued_by_priority": queued,
+                "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2),
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "timeouts": self.timeouts,
+                "avg_wait": round(self.total_wait / self.acquired, 4) if self.acquired else 0,
+                "max_wait": round(self.max_wait, 4),
+            }
+
+
+_limiters: Dict[str, UpstreamLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> UpstreamLimiter:
+    """获取进程内共享的上游限流器，配置读取自 RATE_LIMIT_<NAME>"""
+    with _limiters_lock:
+        if name not in _limiters:
+            rate, burst, concurrency = DEFAULT_LIMITS.get(name, (5.0, 10, 4))
+            spec = os.getenv(f"RATE_LIMIT_{name.upper()}")
+            if spec:
+                parts = [p.strip() for p in spec.split(",")]
+                rate = float(parts[0])
+                burst = int(parts[1]) if len(parts) > 1 else burst
+                concurrency = int(parts[2]) if len(parts) > 2 else concurrency
+            _limiters[name] = UpstreamLimiter(name, rate, burst, concurrency)
+        return _limiters[name]
+
+
+def is_throttled(error: Exception) -> bool:
+    """判断异常是否是上游返回的 429（兼容 requests 与 openai 客户端）"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_upstream(name: str, fn: Callable[[], Any], level: Optional[int] = None,
+                  retries: int = RATE_LIMIT_RETRIES) -> Any:
+    """
+    在限流器控制下调用上游。
+
+    被限流时暂停该上游的令牌发放并按指数退避重试，重试用尽后抛出异常，
+    而不是让调用方拿到一个看似正常的空结果。
+    在 deadline.request_deadline 内调用时，排队等待名额的时间不超过请求剩余的时间，超时抛出 TimeoutError。
+    """
+    limiter = get_limiter(name)
+    backoff = RATE_LIMIT_BACKOFF_SECONDS
+    for attempt in range(retries + 1):
+        with limiter.slot(level, timeout=remaining()):
+            try:
+                return fn()
+            except Exception as e:
+                if not is_throttled(e) or attempt == retries:
+                    raise
+                wait = _retry_after(e) or backoff
+                print(f"{name} 返回 429，{wait:.1f} 秒后重试（第 {attempt + 1} 次）")
+                limiter.pause(wait)
+                backoff *= 2
+
+
+def upstream_metrics() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.metrics() for name, limiter in limiters.items()}
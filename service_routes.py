@@ -0,0 +1,30 @@
+from flask import Flask, jsonify
+
+from http_payload import install as install_http_payload
+from model_registry import llm_metrics
+from profiler import install as install_profiler
+from rate_limit import upstream_metrics
+
+
+def get_upstream_metrics():
+    """各上游（Serper、ModelScope）的限流与排队情况"""
+    return jsonify(upstream_metrics())
+
+
+def get_llm_metrics():
+    """各 (任务, 档位) 的模型调用延迟分位数、对冲次数和对冲胜出率"""
+    return jsonify(llm_metrics())
+
+
+def install(app: Flask) -> None:
+    """
+    为服务注册三个服务共用的部分：
+
+    - orjson 紧凑序列化、gzip/br 压缩、ETag 条件请求，见 http_payload。
+    - 采样分析：PROFILE_ENABLED=1 或请求头 X-Profile: 1，结果见 /debug/profile，见 profiler。
+    - GET /metrics/upstreams 和 GET /metrics/llm，统计是每个工作进程各自一份，只反映处理该请求的进程。
+    """
+    install_http_payload(app)
+    install_profiler(app)
+    app.add_url_rule("/metrics/upstreams", "get_upstream_metrics", get_upstream_metrics, methods=["GET"])
+    app.add_url_rule("/metrics/llm", "get_llm_metrics", get_llm_metrics, methods=["GET"])
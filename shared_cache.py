@@ -0,0 +1,184 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Any, Callable, Optional
+
+from fast_json import dumps, loads
+from storage import STORAGE_DIR
+
+# 多个工作进程共享的本地缓存（SQLite WAL 模式），支持 TTL 和跨进程的 single-flight
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(STORAGE_DIR, "shared_cache.sqlite3"))
+# 计算租约的有效期：持有者崩溃后，其他进程最多等这么久就会接手计算
+SHARED_CACHE_LEASE_SECONDS = float(os.getenv("SHARED_CACHE_LEASE_SECONDS", "600"))
+# 等待其他进程计算结果时的轮询间隔
+SHARED_CACHE_POLL_SECONDS = float(os.getenv("SHARED_CACHE_POLL_SECONDS", "0.5"))
+
+
+class SharedCache:
+    """
+    基于 SQLite 的跨进程缓存。
+
+    - get/set 都是单条语句，天然原子；值以 JSON 保存，带过期时间。
+    - get_or_compute 用 leases 表实现跨进程 single-flight：同一个 key 同时只有一个进程在计算，
+      其他进程轮询等待结果，不会出现 N 个 worker 重复生成同一份攻略。
+    """
+
+    def __init__(self, path: str = SHARED_CACHE_PATH):
+        self.path = path
+        self._token = uuid.uuid4().hex[:8]
+        self._local = threading.local()
+
+    @property
+    def owner(self) -> str:
+        # fork 出的子进程和同进程的不同线程都算作不同的租约持有者
+        return f"{os.getpid()}-{threading.get_ident()}-{self._token}"
+
+    def _conn(self) -> sqlite3.Connection:
+        # 每个线程、每个进程（fork 之后）各用一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, dumps(value), time.time() + ttl),
+        )
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: float, ttl: float, limit: Optional[float] = None) -> Optional[float]:
+        """
+        原子地累加一个计数器（所有进程共享）。
+
+        Args:
+            key (str): 计数器的键.
+            amount (float): 累加的数量.
+            ttl (float): 计数器的有效秒数，只在新建计数器时生效.
+            limit (float): 累加后超过该值时不修改计数器.
+
+        Returns:
+            累加后的值；超过 limit 时返回 None。
+        """
+        conn = self._conn()
+        now = time.time()
+        # BEGIN IMMEDIATE 先拿写锁，读取和写入之间不会插入其他进程的累加
+        conn.execute("BEGIN IMMEDIATE")
+        committed = False
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            value = (loads(row[0]) if row else 0) + amount
+            if limit is not None and value > limit:
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, dumps(value), row[1] if row else now + ttl),
+            )
+            conn.execute("COMMIT")
+            committed = True
+            return value
+        finally:
+            if not committed:
+                conn.execute("ROLLBACK")
+
+    def purge_expired(self) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+
+    def _acquire_lease(self, key: str, lease_seconds: float) -> bool:
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at <= ?",
+            (key, self.owner, now + lease_seconds, now),
+        )
+        return cursor.rowcount == 1
+
+    def _release_lease(self, key: str) -> None:
+        self._conn().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner))
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Any],
+        ttl: float,
+        should_cache: Callable[[Any], bool] = lambda value: value is not None,
+        lease_seconds: float = SHARED_CACHE_LEASE_SECONDS,
+        max_wait: Optional[float] = None,
+    ) -> Any:
+        """
+        读取缓存，未命中时在所有进程中只计算一次。
+
+        Args:
+            key (str): 缓存键.
+            compute (callable): 未命中时执行的计算.
+            ttl (float): 结果的缓存秒数.
+            should_cache (callable): 结果是否写入缓存（例如失败的空结果不缓存）.
+            lease_seconds (float): 计算租约有效期.
+            max_wait (float): 等待其他进程计算结果的最长秒数，超过时抛出 TimeoutError；None 表示一直等待.
+
+        Returns:
+            缓存中的值或本次计算的结果。
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        started = time.monotonic()
+        while True:
+            if self._acquire_lease(key, lease_seconds):
+                try:
+                    # 拿到租约后再查一次，可能刚好有其他进程算完
+                    value = self.get(key)
+                    if value is not None:
+                        return value
+                    value = compute()
+                    if should_cache(value):
+                        self.set(key, value, ttl)
+                    return value
+                finally:
+                    self._release_lease(key)
+
+            # 其他进程正在计算：等待结果写入，或租约释放/过期后自己接手
+            if max_wait is not None and time.monotonic() - started >= max_wait:
+                raise TimeoutError(f"等待其他进程计算 {key} 超时")
+            time.sleep(SHARED_CACHE_POLL_SECONDS)
+            value = self.get(key)
+            if value is not None:
+                return value
+
+
+_shared_cache: Optional[SharedCache] = None
+
+
+def get_shared_cache() -> SharedCache:
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SharedCache()
+    return _shared_cache
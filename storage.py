@@ -0,0 +1,47 @@
+import os
+import json
+import time
+from typing import Any, Dict, Optional
+
+# 生成的旅游信息 JSON 保存在 storage 目录，行程 HTML 保存在"第五章"目录
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+STORAGE_DIR = os.path.join(CURRENT_DIR, "storage")
+REPORT_DIR = os.path.join(CURRENT_DIR, "第五章")
+
+# 已保存的攻略在多少小时内视为新鲜，可直接返回；<= 0 表示每次都重新生成
+PLAN_CACHE_TTL_HOURS = float(os.getenv("PLAN_CACHE_TTL_HOURS", "72"))
+
+
+def plan_path(city: str, days: Any) -> str:
+    return os.path.join(STORAGE_DIR, f"{city}{days}天旅游信息.json")
+
+
+def report_path(city: str, days: Any) -> str:
+    return os.path.join(REPORT_DIR, f"{city}{days}天旅游攻略.html")
+
+
+def file_age(path: str) -> Optional[float]:
+    """文件距最后一次写入的秒数，文件不存在时返回 None"""
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def load_plan(city: str, days: Any) -> Optional[Dict[str, Any]]:
+    """读取已保存的攻略，不存在或格式错误时返回 None"""
+    try:
+        with open(plan_path(city, days), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def load_fresh_plan(city: str, days: Any, ttl_hours: float = PLAN_CACHE_TTL_HOURS) -> Optional[Dict[str, Any]]:
+    """读取未过期的已保存攻略，不存在、已过期或格式错误时返回 None"""
+    if ttl_hours <= 0:
+        return None
+    age = file_age(plan_path(city, days))
+    if age is None or age > ttl_hours * 3600:
+        return None
+    return load_plan(city, days)
@@ -0,0 +1,68 @@
+import os
+import time
+import functools
+
+import pytest
+
+import checkpoint
+import part2
+from checkpoint import CheckpointStore, maybe_purge_expired, purge_expired
+
+
+def write_run(root, city, days, age_hours):
+    store = CheckpointStore(city, days, root=str(root))
+    store.save("search_guides", [{"title": "攻略"}])
+    old = time.time() - age_hours * 3600
+    for name in os.listdir(store.path):
+        os.utime(os.path.join(store.path, name), (old, old))
+    os.utime(store.path, (old, old))
+    return store
+
+
+@pytest.mark.parametrize("run_id", ["../../etc", "ABCDEF123456", "0123456789a", 12345])
+def test_invalid_run_ids_are_rejected(tmp_path, run_id):
+    with pytest.raises(ValueError):
+        CheckpointStore("深圳", 3, run_id, root=str(tmp_path))
+
+
+def test_city_cannot_escape_the_checkpoint_root(tmp_path):
+    with pytest.raises(ValueError):
+        CheckpointStore("../深圳", 3, root=str(tmp_path))
+
+
+def test_purge_removes_only_expired_runs(tmp_path):
+    expired = write_run(tmp_path, "深圳", 3, age_hours=72)
+    fresh = write_run(tmp_path, "深圳", 4, age_hours=1)
+
+    assert purge_expired(str(tmp_path), ttl_hours=48) == 1
+    assert not os.path.exists(expired.path)
+    assert not os.path.exists(os.path.dirname(expired.path))
+    assert fresh.stages() == ["search_guides"]
+
+
+def test_purge_is_disabled_with_zero_ttl(tmp_path):
+    expired = write_run(tmp_path, "深圳", 3, age_hours=1000)
+    assert purge_expired(str(tmp_path), ttl_hours=0) == 0
+    assert os.path.exists(expired.path)
+
+
+def test_maybe_purge_runs_at_most_once_per_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, "_last_purge", 0.0)
+    write_run(tmp_path, "深圳", 3, age_hours=72)
+    assert maybe_purge_expired(str(tmp_path), ttl_hours=48, interval=3600) == 1
+    write_run(tmp_path, "深圳", 5, age_hours=72)
+    assert maybe_purge_expired(str(tmp_path), ttl_hours=48, interval=3600) == 0
+
+
+def test_guides_are_restored_when_all_stages_come_from_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(part2, "CheckpointStore", functools.partial(CheckpointStore, root=str(tmp_path)))
+    monkeypatch.setattr(part2.TravelPlanner, "search_and_rerank",
+                        lambda self: pytest.fail("检查点齐全时不应重新搜索"))
+    planner = part2.TravelPlanner("深圳", 3, use_pool=False)
+    planner.checkpoints.save("rerank_guides", [{"result_id": 1, "title": "深圳三日游", "description": "路线", "url": "u"}])
+    for stage in ("base_guide", "attractions", "foods"):
+        planner.checkpoints.save(stage, "{}")
+
+    resumed = part2.TravelPlanner("深圳", 3, run_id=planner.run_id, use_pool=False)
+    resumed.extract_attractions_and_food()
+    assert resumed.guides == [{"result_id": 1, "title": "深圳三日游", "description": "路线", "long_description": None}]
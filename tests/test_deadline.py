@@ -0,0 +1,98 @@
+import time
+import functools
+
+import pytest
+
+import deadline
+import part2
+import rate_limit
+from checkpoint import CheckpointStore
+from deadline import DeadlineExceeded, check, has_time, remaining, request_deadline, time_left
+from rate_limit import UpstreamLimiter, call_upstream
+
+
+def test_no_deadline_outside_a_request():
+    assert remaining() is None
+    assert has_time(10 ** 6)
+    assert time_left(30) == 30
+    check()
+
+
+def test_nested_deadline_keeps_the_earlier_end():
+    with request_deadline(5):
+        with request_deadline(60):
+            assert remaining() <= 5
+        with request_deadline(1):
+            assert remaining() <= 1
+            assert time_left(30) <= 1
+        # 0 表示不限时，不会放宽外层的时限
+        with request_deadline(0):
+            assert remaining() <= 5
+    assert remaining() is None
+
+
+def test_check_raises_once_the_deadline_is_spent():
+    with request_deadline(0.01):
+        time.sleep(0.02)
+        assert not has_time(0.001)
+        with pytest.raises(DeadlineExceeded):
+            check("Serper: ")
+
+
+def test_waiting_for_an_upstream_slot_is_bounded_by_the_deadline(monkeypatch):
+    limiter = UpstreamLimiter("serper", 1000, 100, 1)
+    monkeypatch.setitem(rate_limit._limiters, "serper", limiter)
+    assert limiter.acquire()
+    try:
+        started = time.monotonic()
+        with request_deadline(0.2):
+            with pytest.raises(TimeoutError):
+                call_upstream("serper", lambda: "ok")
+        assert time.monotonic() - started < 2
+    finally:
+        limiter.release()
+
+
+@pytest.mark.parametrize("data, expected", [({}, deadline.PLAN_SLA_SECONDS), ({"timeout": 0}, 0), ({"timeout": "30"}, 30)])
+def test_parse_timeout(data, expected):
+    assert part2.parse_timeout(data) == expected
+
+
+@pytest.mark.parametrize("timeout", [-1, "abc", True])
+def test_parse_timeout_rejects_invalid_values(timeout):
+    with pytest.raises(ValueError):
+        part2.parse_timeout({"timeout": timeout})
+
+
+def planner(tmp_path, monkeypatch):
+    monkeypatch.setattr(part2, "CheckpointStore", functools.partial(CheckpointStore, root=str(tmp_path)))
+    travel_planner = part2.TravelPlanner("深圳", 3, use_pool=False)
+    stages = []
+
+    def fake_stage(stage, query, instruction, error_label):
+        stages.append(stage)
+        return [{"result_id": 1, "title": f"{stage}结果"}]
+
+    monkeypatch.setattr(travel_planner, "_search_and_rerank_stage", fake_stage)
+    return travel_planner, stages
+
+
+def test_optional_stage_is_skipped_when_time_is_short(tmp_path, monkeypatch):
+    travel_planner, stages = planner(tmp_path, monkeypatch)
+
+    with request_deadline(deadline.PLAN_OPTIONAL_STAGE_RESERVE_SECONDS / 2):
+        result = travel_planner.search_and_rerank()
+
+    assert stages == ["guides", "attractions", "must_eat"]
+    assert "local_food" in travel_planner.degraded
+    assert result["travel_info"]["local_food"] == []
+
+
+def test_all_stages_run_without_a_deadline(tmp_path, monkeypatch):
+    travel_planner, stages = planner(tmp_path, monkeypatch)
+
+    result = travel_planner.search_and_rerank()
+
+    assert stages == ["guides", "attractions", "must_eat", "local_food"]
+    assert not travel_planner.degraded
+    assert result["travel_info"]["local_food"][0]["title"] == "local_food结果"
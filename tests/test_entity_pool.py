@@ -0,0 +1,62 @@
+import functools
+
+import pytest
+
+import entity_pool
+import part2
+from checkpoint import CheckpointStore
+from entity_pool import ENTITY_POOL_PER_DAY, load_pool, pool_path, select_for_days, update_pool
+
+
+@pytest.fixture(autouse=True)
+def pool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(entity_pool, "ENTITY_POOL_DIR", str(tmp_path / "entity_pool"))
+    return tmp_path / "entity_pool"
+
+
+def make_plan(count):
+    return {
+        "景点": [{"name": f"景点{i}", "describe": "", "图片url": f"https://example.com/{i}.jpg" if i % 2 else ""}
+                 for i in range(count)],
+        "美食": [{"name": f"美食{i}", "describe": "", "图片url": ""} for i in range(count)],
+        "美食店铺": [{"name": f"店铺{i}", "describe": "", "图片url": ""} for i in range(count)],
+    }
+
+
+@pytest.mark.parametrize("city", ["../深圳", "深圳/../../etc", "/etc/passwd", "a/b", ""])
+def test_city_cannot_escape_the_pool_directory(city):
+    with pytest.raises(ValueError):
+        pool_path(city)
+    assert load_pool(city) is None
+
+
+def test_pool_round_trip(pool_dir):
+    update_pool("深圳", make_plan(3), guides=[{"title": "攻略", "description": ""}])
+    pool = load_pool("深圳")
+    assert [item["name"] for item in pool["attractions"]] == ["景点0", "景点1", "景点2"]
+    assert pool_path("深圳") == str((pool_dir / "深圳.json").resolve())
+
+
+def test_select_for_days_limits_and_prefers_entities_with_images():
+    update_pool("深圳", make_plan(20))
+    pool = load_pool("深圳")
+
+    one_day = select_for_days(pool, 1)
+    three_days = select_for_days(pool, 3)
+    assert len(one_day["attractions"]) == ENTITY_POOL_PER_DAY["attractions"]
+    assert len(three_days["attractions"]) == 3 * ENTITY_POOL_PER_DAY["attractions"]
+    assert len(three_days["foods"]) == 3 * ENTITY_POOL_PER_DAY["foods"]
+    assert all(item["图片url"] for item in one_day["attractions"])
+    assert len(pool["attractions"]) == 20
+
+
+def test_plan_from_pool_depends_on_days(tmp_path, monkeypatch):
+    update_pool("深圳", make_plan(20))
+    monkeypatch.setattr(part2, "CheckpointStore", functools.partial(CheckpointStore, root=str(tmp_path)))
+    monkeypatch.setattr(part2.TravelPlanner, "ask", lambda self, role, prompt, **kwargs: '{"base_guide": "路线"}')
+    monkeypatch.setattr(part2.TravelPlanner, "save_plan", lambda self, result: None)
+
+    plans = {days: part2.TravelPlanner("深圳", days).plan_from_pool(load_pool("深圳")) for days in (1, 2)}
+    assert len(plans[1]["景点"]) == ENTITY_POOL_PER_DAY["attractions"]
+    assert len(plans[2]["景点"]) == 2 * ENTITY_POOL_PER_DAY["attractions"]
+    assert len(plans[2]["美食店铺"]) == 2 * ENTITY_POOL_PER_DAY["shops"]
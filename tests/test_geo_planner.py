@@ -0,0 +1,130 @@
+import json
+import random
+import itertools
+
+import pytest
+
+import geo_planner
+from geo_planner import (Gazetteer, JsonGazetteer, _route_length, distance_matrix, k_medoids, order_stops,
+                         plan_days)
+
+WEST = {"世界之窗": (22.536, 113.973), "欢乐谷": (22.541, 113.982), "深圳湾公园": (22.523, 113.951)}
+EAST = {"大梅沙": (22.594, 114.305), "小梅沙": (22.603, 114.324), "东部华侨城": (22.629, 114.289)}
+
+
+class DictGazetteer(Gazetteer):
+    def __init__(self, places):
+        self.places = places
+
+    def lookup(self, city, name):
+        return self.places.get(name)
+
+
+@pytest.fixture(params=["numpy", "pure"])
+def backend(request, monkeypatch):
+    """没有安装 numpy 时两个参数都走纯 Python 实现"""
+    if request.param == "pure":
+        monkeypatch.setattr(geo_planner, "np", None)
+    elif geo_planner.np is None:
+        pytest.skip("numpy 未安装")
+    return request.param
+
+
+def test_distance_matrix(backend):
+    dist = distance_matrix([(0.0, 0.0), (1.0, 0.0), (0.0, 1.0)])
+
+    assert dist[0][1] == pytest.approx(111.19, abs=0.01)
+    assert dist[0][2] == pytest.approx(111.19, abs=0.01)
+    for i, j in itertools.product(range(3), repeat=2):
+        assert dist[i][j] == pytest.approx(dist[j][i])
+    assert all(dist[i][i] == 0 for i in range(3))
+
+
+def test_numpy_and_pure_python_agree(monkeypatch):
+    if geo_planner.np is None:
+        pytest.skip("numpy 未安装")
+    coords = list(WEST.values()) + list(EAST.values())
+    vectorized = distance_matrix(coords)
+    monkeypatch.setattr(geo_planner, "np", None)
+    assert distance_matrix(coords) == pytest.approx(vectorized)
+
+
+def test_k_medoids_separates_clusters_and_balances_sizes(backend):
+    coords = list(WEST.values()) + list(EAST.values())
+    clusters = k_medoids(distance_matrix(coords), 2)
+    assert sorted(map(sorted, clusters)) == [[0, 1, 2], [3, 4, 5]]
+
+    # 五个点挤在一起、一个点很远时，每簇仍不超过 ceil(6/2) 个
+    crowded = [(22.54, 113.97 + 0.001 * i) for i in range(5)] + [(23.5, 115.0)]
+    clusters = k_medoids(distance_matrix(crowded), 2)
+    assert sorted(len(members) for members in clusters) == [3, 3]
+    assert sorted(i for members in clusters for i in members) == list(range(6))
+
+
+def test_k_medoids_caps_k_at_the_number_of_points(backend):
+    clusters = k_medoids(distance_matrix(list(WEST.values())), 5)
+    assert sorted(map(len, clusters)) == [1, 1, 1]
+
+
+def test_order_stops_follows_a_line(backend):
+    coords = [(0.0, 0.03), (0.0, 0.0), (0.0, 0.04), (0.0, 0.01), (0.0, 0.02)]
+    route = order_stops(distance_matrix(coords), list(range(5)))
+
+    assert [coords[i][1] for i in route] in ([0.0, 0.01, 0.02, 0.03, 0.04], [0.04, 0.03, 0.02, 0.01, 0.0])
+
+
+def test_order_stops_is_two_opt_optimal(backend):
+    rng = random.Random(7)
+    coords = [(22.5 + rng.random() * 0.2, 113.9 + rng.random() * 0.4) for _ in range(9)]
+    dist = distance_matrix(coords)
+    route = order_stops(dist, list(range(9)))
+
+    assert sorted(route) == list(range(9))
+    length = _route_length(dist, route)
+    for i in range(1, len(route) - 1):
+        for j in range(i + 1, len(route)):
+            candidate = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+            assert _route_length(dist, candidate) >= length - 1e-9
+
+
+def test_plan_days_groups_nearby_stops_and_meals(backend):
+    gazetteer = DictGazetteer(dict(WEST, **EAST, 海鲜街=(22.598, 114.31)))
+    data = {
+        "city": "深圳",
+        "景点": [{"name": name} for name in ["大梅沙", "世界之窗", "东部华侨城", "欢乐谷", "小梅沙", "深圳湾公园", "未知景点"]],
+        "美食": [{"name": "海鲜街"}, {"name": "肠粉"}],
+        "美食店铺": [{"name": "糖水铺"}],
+    }
+
+    plan = plan_days(data, 2, gazetteer)
+
+    assert [day["day"] for day in plan] == [1, 2]
+    # 西边的一天排在前面（按第一站经度排序）
+    located = [{stop["name"] for stop in day["stops"] if "lat" in stop} for day in plan]
+    assert located == [set(WEST), set(EAST)]
+    # 无法定位的景点放到景点最少（数量相同时靠前）的那天末尾
+    assert plan[0]["stops"][-1] == {"name": "未知景点", "leg_km": None}
+    assert "海鲜街" in [meal["name"] for meal in plan[1]["meals"]]
+    assert sorted(meal["name"] for day in plan for meal in day["meals"]) == sorted(["海鲜街", "肠粉", "糖水铺"])
+    for day in plan:
+        assert day["stops"][0]["leg_km"] == 0.0
+        assert day["total_km"] > 0
+    assert plan_days(data, 2, gazetteer) == plan
+
+
+def test_plan_days_needs_enough_located_stops(backend):
+    data = {"city": "深圳", "景点": [{"name": "世界之窗"}, {"name": "未知景点"}]}
+    assert plan_days(data, 2, DictGazetteer(WEST)) is None
+
+
+def test_json_gazetteer_prefers_exact_then_longest_match(tmp_path):
+    (tmp_path / "深圳.json").write_text(
+        json.dumps({"世界之窗": [22.536, 113.973], "世界": [0, 0], "欢乐谷": [22.541, 113.982]}, ensure_ascii=False),
+        encoding="utf-8",
+    )
+    gazetteer = JsonGazetteer([str(tmp_path / "missing"), str(tmp_path)])
+
+    assert gazetteer.lookup("深圳", "世界") == (0.0, 0.0)
+    assert gazetteer.lookup("深圳", "世界之窗景区") == (22.536, 113.973)
+    assert gazetteer.lookup("深圳", "莲花山") is None
+    assert gazetteer.lookup("广州", "世界之窗") is None
@@ -0,0 +1,102 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import model_registry
+import rate_limit
+from model_registry import LARGE, hedged_step, latency_stats
+from rate_limit import UpstreamLimiter
+
+
+class FakeAgent:
+    """按给定延迟返回固定内容的 Agent，记录被调用的次数"""
+
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.calls = 0
+
+    def step(self, prompt):
+        self.calls += 1
+        time.sleep(self.delay)
+        return SimpleNamespace(msgs=[SimpleNamespace(content=self.name)], info={})
+
+
+@pytest.fixture
+def task(request, monkeypatch):
+    # 各测试用独立的限流器，不受其他测试在后台跑完的慢请求影响
+    monkeypatch.setitem(rate_limit._limiters, "modelscope", UpstreamLimiter("modelscope", 1000, 100, 16))
+    monkeypatch.setattr(model_registry, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(model_registry, "LLM_HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(model_registry, "LLM_HEDGE_MIN_DELAY_SECONDS", 0.05)
+    # 每个测试使用单独的任务名，延迟统计互不影响
+    name = f"test-{request.node.name}"
+    stats = latency_stats(name, LARGE)
+    for _ in range(5):
+        stats.record(0.05)
+    return name
+
+
+def test_hedge_wins_when_primary_is_slow(task):
+    primary = FakeAgent("primary", delay=1.0)
+    hedges = []
+
+    def hedge_factory(tier):
+        hedges.append(FakeAgent("hedge", delay=0.01))
+        return hedges[-1]
+
+    started = time.monotonic()
+    response = hedged_step(task, primary, "prompt", LARGE, hedge_factory=hedge_factory, deadline=5)
+    assert response.msgs[0].content == "hedge"
+    assert time.monotonic() - started < 0.5
+    assert len(hedges) == 1 and hedges[0] is not primary
+
+    metrics = latency_stats(task, LARGE).metrics()
+    assert metrics["hedged"] == 1
+    assert metrics["hedge_wins"] == 1
+
+
+def test_fast_primary_is_not_hedged(task):
+    primary = FakeAgent("primary", delay=0.0)
+    response = hedged_step(task, primary, "prompt", LARGE,
+                           hedge_factory=lambda tier: pytest.fail("不应发出对冲请求"), deadline=5)
+    assert response.msgs[0].content == "primary"
+    assert latency_stats(task, LARGE).metrics()["hedged"] == 0
+
+
+def test_deadline_expiry_raises_timeout(task):
+    primary = FakeAgent("primary", delay=1.0)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        hedged_step(task, primary, "prompt", LARGE, deadline=0.2)
+    assert time.monotonic() - started < 0.6
+    assert latency_stats(task, LARGE).metrics()["timeouts"] == 1
+
+
+def test_no_hedge_when_upstream_is_saturated(task, monkeypatch):
+    monkeypatch.setattr(model_registry, "get_limiter",
+                        lambda name: SimpleNamespace(has_capacity=lambda: False))
+    primary = FakeAgent("primary", delay=0.3)
+    response = hedged_step(task, primary, "prompt", LARGE,
+                           hedge_factory=lambda tier: pytest.fail("上游满载时不应对冲"), deadline=5)
+    assert response.msgs[0].content == "primary"
+
+
+def test_abandoned_call_is_never_sent(task, monkeypatch):
+    # 主请求超时被放弃时，还在排队等名额的调用拿到名额后不再发出
+    gate = threading.Event()
+    original = model_registry.call_upstream
+
+    def queued_call_upstream(name, fn, *args, **kwargs):
+        gate.wait(5)
+        return original(name, fn, *args, **kwargs)
+
+    monkeypatch.setattr(model_registry, "call_upstream", queued_call_upstream)
+    primary = FakeAgent("primary", delay=0.0)
+    with pytest.raises(TimeoutError):
+        hedged_step(task, primary, "prompt", LARGE, deadline=0.1)
+    gate.set()
+    time.sleep(0.1)
+    assert primary.calls == 0
@@ -0,0 +1,81 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, jsonify
+
+import http_payload
+from http_payload import choose_encoding, install
+
+BIG = {"items": [{"name": f"景点{i}", "desc": "一段较长的介绍文字" * 5} for i in range(40)]}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(http_payload, "brotli", None)
+    app = Flask(__name__)
+    install(app)
+
+    @app.route("/big")
+    def big():
+        return jsonify(BIG)
+
+    @app.route("/small")
+    def small():
+        return jsonify({"status": "ok"})
+
+    @app.route("/big", methods=["POST"])
+    def big_post():
+        return jsonify(BIG)
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    ("identity", None),
+    ("", None),
+])
+def test_choose_encoding_without_brotli(monkeypatch, header, expected):
+    monkeypatch.setattr(http_payload, "brotli", None)
+    assert choose_encoding(header) == expected
+
+
+def test_large_json_is_gzipped_when_accepted(client):
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert json.loads(gzip.decompress(response.get_data())) == BIG
+
+
+def test_uncompressed_when_not_accepted_or_small(client):
+    plain = client.get("/big")
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in plain.headers
+    assert json.loads(plain.get_data()) == BIG
+    assert "Content-Encoding" not in small.headers
+
+
+def test_etag_returns_304_per_representation(client):
+    gzipped = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/big")
+    assert gzipped.headers["ETag"] != plain.headers["ETag"]
+
+    again = client.get("/big", headers={"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.get_data() == b""
+    # 压缩表示的 ETag 不能让未压缩的请求命中 304
+    mismatch = client.get("/big", headers={"If-None-Match": gzipped.headers["ETag"]})
+    assert mismatch.status_code == 200
+
+
+def test_post_responses_have_no_etag(client):
+    response = client.post("/big", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert response.headers["Content-Encoding"] == "gzip"
@@ -0,0 +1,58 @@
+import os
+import json
+
+import pytest
+
+from part3 import (ItineraryStreamRenderer, convert_picurl_to_img_tag, generate_html_head,
+                   generate_html_report, generate_html_tail)
+from prompt_budget import UrlMapper
+
+PLAN_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "深圳3天旅游信息.json")
+
+
+@pytest.fixture
+def plan():
+    with open(PLAN_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def model_output(url_mapper):
+    image = url_mapper.shorten("https://example.com/images/世界之窗.jpg")
+    return (
+        "Day 1：南山\n"
+        "上午：世界之窗\n"
+        f"- 图片URL：{image}\n"
+        "\n"
+        "中午：![海鲜](https://example.com/images/海鲜.jpg) 沙井蚝\n"
+        "Day 2：福田\n"
+        "  晚上：莲花山公园"
+    )
+
+
+def render_stream(text, url_mapper, data, chunk_size):
+    renderer = ItineraryStreamRenderer(url_mapper)
+    parts = [generate_html_head()]
+    for i in range(0, len(text), chunk_size):
+        parts.append(renderer.feed(text[i:i + chunk_size]))
+    parts.append(renderer.close())
+    parts.append("\n" + generate_html_tail(data))
+    return "".join(parts), renderer.text
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1000])
+def test_stream_matches_non_stream_report(plan, chunk_size):
+    url_mapper = UrlMapper()
+    text = model_output(url_mapper)
+    expected = generate_html_report(convert_picurl_to_img_tag(url_mapper.restore(text)), plan)
+
+    html, restored = render_stream(text, url_mapper, plan, chunk_size)
+    assert html == expected
+    assert restored == url_mapper.restore(text)
+    assert "https://example.com/images/世界之窗.jpg" in html
+
+
+def test_trailing_newline_matches(plan):
+    url_mapper = UrlMapper()
+    text = model_output(url_mapper) + "\n"
+    expected = generate_html_report(convert_picurl_to_img_tag(url_mapper.restore(text)), plan)
+    assert render_stream(text, url_mapper, plan, 5)[0] == expected
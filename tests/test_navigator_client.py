@@ -0,0 +1,104 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+
+from navigator_client import NavigatorClient, NavigatorError
+
+
+class ScriptedServer:
+    """本地 HTTP 服务：每个路径按顺序返回预设的 (状态码, 响应体)，最后一个响应重复使用"""
+
+    def __init__(self):
+        self.scripts = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self):
+                path = unquote(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                server.requests.append((self.command, path, body))
+                script = server.scripts[path]
+                status, payload = script.pop(0) if len(script) > 1 else script[0]
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _reply
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def calls(self, path):
+        return [request for request in self.requests if request[1] == path]
+
+
+@pytest.fixture
+def server():
+    server = ScriptedServer()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+@pytest.fixture
+def client(server):
+    with NavigatorClient(server.url, server.url, server.url, retries=2, backoff=0) as client:
+        yield client
+
+
+THROTTLED = (503, {"status": "error", "message": "上游限流", "run_id": "0123456789ab"})
+
+
+def test_throttled_plan_resumes_with_run_id(server, client):
+    server.scripts["/get_travel_plan"] = [THROTTLED, (200, {"status": "success", "data": {"city": "深圳"}})]
+
+    assert client.plan("深圳", 3)["data"] == {"city": "深圳"}
+    calls = server.calls("/get_travel_plan")
+    # urllib3 不会原样重发 POST；第二次请求是带 run_id 的续跑
+    assert len(calls) == 2
+    assert "run_id" not in calls[0][2]
+    assert calls[1][2]["run_id"] == "0123456789ab"
+
+
+def test_plan_gives_up_after_configured_retries(server, client):
+    server.scripts["/get_travel_plan"] = [THROTTLED]
+
+    with pytest.raises(NavigatorError) as excinfo:
+        client.plan("深圳", 3)
+    assert excinfo.value.status_code == 503
+    assert len(server.calls("/get_travel_plan")) == client.retries + 1
+
+
+def test_post_without_run_id_is_not_retried(server, client):
+    server.scripts["/extract_travel_info"] = [(503, {"error": "繁忙"})]
+
+    with pytest.raises(NavigatorError):
+        client.extract("我想深圳玩3天")
+    assert len(server.calls("/extract_travel_info")) == 1
+
+
+def test_get_is_retried_on_503(server, client):
+    server.scripts["/travel_plan/深圳/3"] = [(503, {}), (503, {}), (200, {"status": "success", "data": {}})]
+
+    assert client.stored_plan("深圳", 3)["status"] == "success"
+    assert len(server.calls("/travel_plan/深圳/3")) == 3
+
+
+def test_run_chain_stops_when_more_info_is_needed(server, client):
+    server.scripts["/extract_travel_info"] = [(200, {"city": "", "days": None, "need_more_info": True})]
+
+    result = client.run_chain("我想去旅游")
+    assert result["error"] == "需要更多信息"
+    assert result["plan"] is None and server.calls("/get_travel_plan") == []
@@ -0,0 +1,102 @@
+import os
+import json
+
+import pytest
+
+from plan_index import PlanIndex, query_terms, tokenize
+
+SHENZHEN = {
+    "city": "深圳",
+    "景点": [
+        {"name": "世界之窗", "describe": "微缩世界名胜的主题公园", "图片url": "https://img.example.com/window.jpg"},
+        {"name": "大梅沙海滨公园", "describe": "免费的海滨沙滩", "图片url": ""},
+    ],
+    "美食": [
+        {"name": "潮汕牛肉火锅", "describe": "现切鲜牛肉，配沙茶酱", "图片url": "https://img.example.com/beef.jpg"},
+        {"name": "海鲜粥", "describe": "蛇口渔港的生滚粥", "图片url": ""},
+        {"name": "鲜饭团", "describe": "海鲜口味的饭团", "图片url": ""},
+    ],
+    "美食店铺": [
+        {"name": "八合里海记", "describe": "老牌牛肉火锅店", "图片url": ""},
+    ],
+}
+GUANGZHOU = {
+    "city": "广州",
+    "美食": [{"name": "牛肉火锅", "describe": "广州本地做法", "图片url": ""}],
+}
+
+
+def write_plan(directory, name, plan):
+    path = os.path.join(str(directory), name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False)
+    return path
+
+
+@pytest.fixture
+def index(tmp_path):
+    plans = tmp_path / "plans"
+    plans.mkdir()
+    write_plan(plans, "深圳3天旅游信息.json", SHENZHEN)
+    write_plan(plans, "广州2天旅游信息.json", GUANGZHOU)
+    index = PlanIndex(str(tmp_path / "index" / "plan_index.sqlite3"))
+    assert index.sync(str(plans)) == {"indexed": 2, "removed": 0, "unchanged": 0}
+    index.plans_dir = plans
+    return index
+
+
+def names(results):
+    return [item["name"] for item in results]
+
+
+def test_tokenize_uses_bigrams_and_words():
+    assert {"海", "鲜", "海鲜", "bbq"} <= tokenize("海鲜 BBQ")
+    assert query_terms("海鲜粥") == {"海鲜", "鲜粥"}
+    assert query_terms("粥") == {"粥"}
+
+
+def test_name_hits_rank_above_description_hits(index):
+    results = index.search("牛肉火锅", city="深圳")
+
+    assert names(results) == ["潮汕牛肉火锅", "八合里海记"]
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_filters_by_city_and_kind(index):
+    assert names(index.search("牛肉火锅", kind="shops")) == ["八合里海记"]
+    assert {item["city"] for item in index.search("牛肉火锅")} == {"深圳", "广州"}
+    assert names(index.search("", city="深圳", kind="attractions")) == ["大梅沙海滨公园", "世界之窗"]
+
+
+def test_multi_word_query_matches_each_term_anywhere(index):
+    # "深圳" 只出现在城市名，"海鲜" 在名称里，两个关键词各自命中即可
+    assert names(index.search("深圳 海鲜")) == ["海鲜粥", "鲜饭团"]
+    assert names(index.search("火锅 沙茶")) == ["潮汕牛肉火锅"]
+    assert index.search("广州 沙茶") == []
+
+
+def test_scattered_bigrams_do_not_match(index):
+    # "海鲜饭" 的 bigram "海鲜"、"鲜饭" 都出现在 鲜饭团 的描述和名称中，但"海鲜饭"本身没有连续出现
+    assert index.search("海鲜饭") == []
+    assert names(index.search("鲜饭")) == ["鲜饭团"]
+
+
+def test_sync_is_incremental(index):
+    plans = index.plans_dir
+    assert index.sync(str(plans)) == {"indexed": 0, "removed": 0, "unchanged": 2}
+
+    updated = dict(SHENZHEN, 美食=[{"name": "椰子鸡", "describe": "清甜的椰子鸡火锅", "图片url": ""}])
+    path = write_plan(plans, "深圳3天旅游信息.json", updated)
+    os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    os.remove(os.path.join(str(plans), "广州2天旅游信息.json"))
+
+    assert index.sync(str(plans)) == {"indexed": 1, "removed": 1, "unchanged": 0}
+    assert sorted(names(index.search("火锅"))) == sorted(["椰子鸡", "八合里海记"])
+    assert index.search("海鲜粥") == []
+
+
+def test_find_image_and_cities(index):
+    assert index.find_image("深圳", "世界之窗") == "https://img.example.com/window.jpg"
+    assert index.find_image("深圳", "海鲜粥") == ""
+    assert {"city": "广州", "foods": 1} in index.cities()
+    assert {"city": "深圳", "attractions": 2, "foods": 3, "shops": 1} in index.cities()
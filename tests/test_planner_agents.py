@@ -0,0 +1,90 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import model_registry
+import rate_limit
+import part2
+from model_registry import latency_stats, tier_for
+from rate_limit import UpstreamLimiter
+
+
+class MemoryAgent:
+    """记录会话历史的假 ChatAgent；step 进行中再次调用 step 视为并发使用"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.memory = []
+        self.active = 0
+        self.overlapped = False
+        self.lock = threading.Lock()
+
+    def reset(self):
+        self.memory = []
+
+    def step(self, prompt):
+        with self.lock:
+            self.active += 1
+            self.overlapped = self.overlapped or self.active > 1
+        self.memory.append(prompt)
+        time.sleep(self.delay)
+        self.memory.append("ans")
+        with self.lock:
+            self.active -= 1
+        return SimpleNamespace(msgs=[SimpleNamespace(content="ans")], info={})
+
+
+@pytest.fixture
+def agents(monkeypatch):
+    # 各测试用独立的限流器，不受其他测试在后台跑完的慢请求影响
+    monkeypatch.setitem(rate_limit._limiters, "modelscope", UpstreamLimiter("modelscope", 1000, 100, 16))
+    monkeypatch.setattr(model_registry, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(model_registry, "LLM_HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(model_registry, "LLM_HEDGE_MIN_DELAY_SECONDS", 0.05)
+    stats = latency_stats("rerank", tier_for("rerank"))
+    for _ in range(5):
+        stats.record(0.05)
+
+    created = []
+
+    def create_agent(task, system_message, **kwargs):
+        # 第一个 Agent 很慢，会被对冲请求超过；之后的都很快
+        created.append(MemoryAgent(delay=0.5 if not created else 0.0))
+        return created[-1]
+
+    monkeypatch.setattr(part2, "create_agent", create_agent)
+    return created
+
+
+def test_abandoned_primary_never_shares_an_agent_with_the_next_stage(agents, monkeypatch):
+    monkeypatch.setattr(part2, "PLANNER_STATELESS_AGENTS", True)
+    planner = part2.TravelPlanner("深圳", 3, use_pool=False)
+
+    assert planner.ask("reranker", "STAGE1 prompt", stage="guides") == "ans"
+    slow_primary = agents[0]
+    assert slow_primary.memory == ["STAGE1 prompt"]  # 对冲请求胜出时主请求还在进行
+
+    planner.ask("reranker", "STAGE2 prompt", stage="attractions")
+    stage2 = agents[-1]
+    time.sleep(0.6)  # 等被放弃的主请求在后台跑完
+
+    assert stage2 is not slow_primary
+    assert stage2.memory == ["STAGE2 prompt", "ans"]
+    assert slow_primary.memory == ["STAGE1 prompt", "ans"]
+    assert not any(agent.overlapped for agent in agents)
+    assert planner.agents == {}
+
+
+def test_shared_agents_are_not_hedged(agents, monkeypatch):
+    monkeypatch.setattr(part2, "PLANNER_STATELESS_AGENTS", False)
+    planner = part2.TravelPlanner("深圳", 3, use_pool=False)
+
+    planner.ask("reranker", "STAGE1 prompt", stage="guides")
+    planner.ask("reranker", "STAGE2 prompt", stage="attractions")
+
+    # 旧行为：同一个 Agent 保留历史；没有对冲，就没有在后台继续写入的调用
+    assert len(agents) == 1
+    assert agents[0].memory == ["STAGE1 prompt", "ans", "STAGE2 prompt", "ans"]
+    assert not agents[0].overlapped
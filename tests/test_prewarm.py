@@ -0,0 +1,102 @@
+import os
+import json
+from datetime import datetime
+
+import pytest
+
+import part2
+import prewarm
+import shared_cache
+from prewarm import PrewarmFailed, PrewarmScheduler, popular_keys
+from shared_cache import SharedCache
+from storage import PLAN_CACHE_TTL_HOURS
+
+NOW = datetime(2026, 10, 19, 3)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = SharedCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(shared_cache, "_shared_cache", cache)
+    return cache
+
+
+def scheduler_for(monkeypatch, keys, plan_fn, **kwargs):
+    scheduler = PrewarmScheduler(plan_fn=plan_fn, **kwargs)
+    monkeypatch.setattr(scheduler, "due_keys", lambda: list(keys))
+    return scheduler
+
+
+def test_budget_is_settled_with_actual_usage(cache, monkeypatch):
+    keys = [("深圳", 3), ("广州", 2), ("杭州", 4)]
+    scheduler = scheduler_for(monkeypatch, keys, lambda city, days: 5, daily_budget=30, cost_per_plan=25)
+
+    # 预扣 25 次只用了 5 次，多扣的部分退回：按固定估算只能预热一份，按实际用量能预热两份
+    assert scheduler.run_once(NOW, force=True) == keys[:2]
+    assert scheduler.spent(NOW) == 10
+
+
+def test_budget_keeps_the_estimate_when_usage_is_unknown(cache, monkeypatch):
+    keys = [("深圳", 3), ("广州", 2)]
+    scheduler = scheduler_for(monkeypatch, keys, lambda city, days: None, daily_budget=30, cost_per_plan=25)
+
+    assert scheduler.run_once(NOW, force=True) == keys[:1]
+    assert scheduler.spent(NOW) == 25
+
+
+def test_failed_prewarm_is_charged_what_it_used(cache, monkeypatch):
+    def plan_fn(city, days):
+        raise PrewarmFailed("上游超时", cost=3)
+
+    scheduler = scheduler_for(monkeypatch, [("深圳", 3)], plan_fn, daily_budget=100, cost_per_plan=25)
+
+    assert scheduler.run_once(NOW, force=True) == []
+    assert scheduler.spent(NOW) == 3
+
+
+def test_prewarm_plan_keeps_pool_and_resumes_failed_run(cache, monkeypatch):
+    calls = []
+    responses = [
+        ({'status': 'error', 'message': '超时', 'run_id': 'abc123def456',
+          'token_usage': {'search_guides': {'calls': 2}}}, 504),
+        ({'status': 'success', 'data': {},
+          'token_usage': {'rerank_guides': {'calls': 1}, 'extract_attractions': {'calls': 4}}}, 200),
+    ]
+
+    def fake_build(city, days, **kwargs):
+        calls.append(kwargs)
+        return responses[len(calls) - 1]
+
+    monkeypatch.setattr(part2, "build_travel_plan", fake_build)
+
+    with pytest.raises(PrewarmFailed) as excinfo:
+        part2.prewarm_plan("深圳", 3)
+    assert excinfo.value.cost == 2
+    assert part2.prewarm_plan("深圳", 3) == 5
+
+    assert all(not kwargs.get('refresh') for kwargs in calls)
+    assert calls[0]['max_age_hours'] == max(0.0, PLAN_CACHE_TTL_HOURS - prewarm.PREWARM_REFRESH_MARGIN_HOURS)
+    assert calls[0]['run_id'] is None
+    assert calls[1]['run_id'] == 'abc123def456'
+    assert cache.get("prewarm:run:深圳:3") is None
+
+
+def test_request_log_rotates_and_history_spans_both_files(tmp_path, monkeypatch):
+    log_file = str(tmp_path / "request_log.jsonl")
+    monkeypatch.setattr(prewarm, "STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(prewarm, "REQUEST_LOG_FILE", log_file)
+    monkeypatch.setattr(prewarm, "REQUEST_LOG_MAX_BYTES", 200)
+
+    for _ in range(10):
+        prewarm.log_request("plan", "深圳", 3)
+    prewarm.log_request("plan", "广州", 2)
+
+    assert os.path.getsize(log_file) < 200
+    assert os.path.getsize(log_file + ".1") < 400
+    assert not os.path.exists(log_file + ".2")
+    # 轮转后最近的请求仍参与统计
+    with open(log_file, encoding="utf-8") as f:
+        assert json.loads(f.readlines()[-1])["city"] == "广州"
+    counts = {(city, days): count for city, days, count in popular_keys(log_file=log_file)}
+    assert counts[("广州", 2)] == 1
+    assert counts[("深圳", 3)] >= 1
@@ -0,0 +1,101 @@
+import time
+import threading
+
+import pytest
+from flask import Flask, jsonify
+
+import profiler as profiler_module
+from profiler import SamplingProfiler, install
+
+
+def busy_endpoint(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def sampler(monkeypatch):
+    sampler = SamplingProfiler(interval_ms=1)
+    sampler.enabled = False
+    monkeypatch.setattr(profiler_module, "profiler", sampler)
+    monkeypatch.setattr(profiler_module, "PROFILE_TOKEN", "")
+    return sampler
+
+
+def make_app(control):
+    app = Flask(__name__)
+    install(app, control=control)
+
+    @app.route("/slow")
+    def slow():
+        time.sleep(0.1)
+        return jsonify({"status": "ok"})
+
+    return app.test_client()
+
+
+def test_samples_only_tracked_threads_and_exports_formats(sampler):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_endpoint, args=(stop,))
+    worker.start()
+    try:
+        sampler.track("busy_endpoint", worker.ident)
+        for _ in range(5):
+            sampler.sample()
+        sampler.untrack(worker.ident)
+        sampler.sample()
+    finally:
+        stop.set()
+        worker.join()
+
+    assert sampler.samples == 5
+    # 调用栈从接口函数开始，外层的线程启动帧被省略
+    for stack in sampler.stacks:
+        assert stack[0] == "busy_endpoint"
+        assert stack[1].startswith("busy_endpoint (")
+    line = sampler.collapsed().splitlines()[0]
+    assert line.startswith("busy_endpoint;busy_endpoint (")
+    assert int(line.rsplit(" ", 1)[1]) >= 1
+
+    profile = sampler.speedscope()["profiles"][0]
+    assert profile["name"] == "busy_endpoint"
+    assert profile["endValue"] == pytest.approx(5 * sampler.interval * 1000)
+
+
+def test_control_routes_and_header_are_off_by_default(sampler):
+    client = make_app(control=False)
+
+    assert client.get("/debug/profile").status_code == 404
+    client.get("/slow", headers={"X-Profile": "1"})
+    assert sampler.samples == 0
+
+
+def test_header_profiles_a_single_request_when_control_is_on(sampler):
+    client = make_app(control=True)
+
+    client.get("/slow")
+    assert sampler.samples == 0
+    client.get("/slow", headers={"X-Profile": "1"})
+    assert sampler.summary()["endpoints"].get("slow", 0) > 0
+    assert "slow;" in client.get("/debug/profile").get_data(as_text=True)
+
+    client.delete("/debug/profile")
+    assert sampler.samples == 0
+
+
+def test_token_is_required_when_configured(sampler, monkeypatch):
+    monkeypatch.setattr(profiler_module, "PROFILE_TOKEN", "secret")
+    client = make_app(control=True)
+
+    assert client.get("/debug/profile").status_code == 403
+    assert client.post("/debug/profile", json={"enabled": True}).status_code == 403
+    assert not sampler.enabled
+    # 没有 token 的 X-Profile 请求头被忽略
+    client.get("/slow", headers={"X-Profile": "1"})
+    assert sampler.samples == 0
+
+    headers = {"X-Profile-Token": "secret"}
+    response = client.post("/debug/profile", json={"enabled": True}, headers=headers)
+    assert response.status_code == 200
+    assert sampler.enabled
+    assert client.get("/debug/profile?format=summary", headers=headers).get_json()["enabled"] is True
@@ -0,0 +1,126 @@
+import functools
+
+import part3
+from checkpoint import CheckpointStore
+from prompt_budget import (PROMPT_TOKEN_BUDGET, UrlMapper, build_pool_guide_prompt, count_tokens, fit_to_budget,
+                           truncate_text)
+
+
+def render(sections, desc_chars):
+    return "\n".join(f"{name}：{truncate_text(item, desc_chars)}"
+                     for name, items in sections.items() for item in items)
+
+
+def test_prompt_within_budget_is_unchanged():
+    sections = {"景点": ["世界之窗", "莲花山公园"]}
+    prompt, report = fit_to_budget(sections, render, budget=1000, max_chars=120)
+    assert prompt == render(sections, 120)
+    assert report["desc_chars"] == 120 and report["dropped_items"] == 0
+    assert not report["over_budget"]
+
+
+def test_descriptions_shrink_before_items_are_dropped():
+    sections = {"景点": ["景" * 100] * 4, "美食": ["食" * 100] * 2}
+    prompt, report = fit_to_budget(sections, render, budget=350, max_chars=100, min_chars=30)
+    assert report["desc_chars"] == 50
+    assert report["dropped_items"] == 0
+    assert count_tokens(prompt) <= 350
+
+
+def test_items_are_dropped_from_the_largest_section():
+    sections = {"景点": ["景" * 100] * 6, "美食": ["食" * 100] * 2}
+    prompt, report = fit_to_budget(sections, render, budget=150, max_chars=100, min_chars=30)
+    assert report["desc_chars"] == 30
+    assert report["dropped_items"] == 4
+    assert prompt.count("景点：") == 2 and prompt.count("美食：") == 2
+    assert report["tokens"] <= 150 and not report["over_budget"]
+    # 调用方传入的列表不会被修改
+    assert len(sections["景点"]) == 6
+
+
+def test_zero_budget_means_unlimited():
+    sections = {"景点": ["景" * 1000] * 10}
+    _, report = fit_to_budget(sections, render, budget=0, max_chars=1000)
+    assert report["dropped_items"] == 0 and report["desc_chars"] == 1000
+
+
+def test_url_round_trip_next_to_chinese_text():
+    mapper = UrlMapper()
+    urls = [f"https://example.com/{i}.jpg" for i in range(1, 13)]
+    text = "、".join(f"图片{url}" for url in urls)
+    short = mapper.shorten_text(text)
+    assert "https://" not in short
+    assert "图片IMG1、" in short and short.endswith("图片IMG12")
+    assert mapper.restore(short) == text
+
+
+def test_restore_leaves_unknown_and_embedded_ids_alone():
+    mapper = UrlMapper()
+    mapper.shorten("https://example.com/1.jpg")
+    assert mapper.restore("见IMG1。") == "见https://example.com/1.jpg。"
+    assert mapper.restore("IMG99 XIMG1 IMG1x") == "IMG99 XIMG1 IMG1x"
+
+
+def test_skeleton_prompt_respects_token_budget(monkeypatch):
+    day_plan = [
+        {
+            "day": day,
+            "total_km": 10.0,
+            "stops": [{"name": f"景点{day}-{i}", "describe": "描述" * 300, "leg_km": 1.0} for i in range(4)],
+            "meals": [{"name": f"餐厅{day}-{i}", "describe": "好吃" * 200} for i in range(6)],
+        }
+        for day in (1, 2, 3)
+    ]
+    monkeypatch.setattr(part3, "plan_days", lambda data, days: day_plan)
+
+    usr_msg = part3.create_usr_msg({"city": "深圳", "days": 3, "景点": [], "美食": []}, UrlMapper())
+    assert count_tokens(usr_msg) <= PROMPT_TOKEN_BUDGET
+    # 骨架中的景点一个都不能少
+    for day in day_plan:
+        for stop in day["stops"]:
+            assert stop["name"] in usr_msg
+
+
+def pool_fixture():
+    return {
+        "attractions": [
+            {"name": f"景点{i}", "describe": "很值得一去的地方" * 40, "图片url": f"https://example.com/spot{i}.jpg"}
+            for i in range(8)
+        ] + [{"name": "景点0", "describe": "重复的条目", "图片url": ""}],
+        "foods": [{"name": f"美食{i}", "describe": "本地特色" * 30, "图片url": f"https://example.com/food{i}.jpg"}
+                  for i in range(6)],
+        "shops": [],
+        "guides": [{"title": "深圳三日游", "description": "攻略内容 https://example.com/guide"}],
+    }
+
+
+def test_pool_prompt_reports_real_savings():
+    pool = pool_fixture()
+    prompt, report = build_pool_guide_prompt("深圳", 3, pool)
+    assert report["tokens"] == count_tokens(prompt)
+    assert report["original_tokens"] > report["tokens"]
+    assert report["saved_tokens"] == report["original_tokens"] - report["tokens"]
+    assert "https://" not in prompt
+    assert prompt.count('"景点0"') == 1
+
+
+
+def test_prompt_reports_are_returned_with_the_plan(monkeypatch, tmp_path):
+    import part2
+    import shared_cache
+
+    monkeypatch.setattr(shared_cache, "_shared_cache", shared_cache.SharedCache(str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(part2, "CheckpointStore", functools.partial(CheckpointStore, root=str(tmp_path)))
+
+    def process(planner):
+        planner.plan_from_pool(pool_fixture())
+        return {"city": planner.city}
+
+    monkeypatch.setattr(part2.TravelPlanner, "process_attractions_and_food", process)
+    monkeypatch.setattr(part2.TravelPlanner, "ask", lambda self, role, prompt, **kwargs: '{"base_guide": "路线"}')
+    monkeypatch.setattr(part2.TravelPlanner, "save_plan", lambda self, result: None)
+
+    payload, status = part2.build_travel_plan("深圳", 3, refresh=True)
+    assert status == 200
+    report = payload["prompt_reports"]["base_guide"]
+    assert report["saved_tokens"] == report["original_tokens"] - report["tokens"] > 0
@@ -0,0 +1,89 @@
+import time
+import contextvars
+import threading
+
+import pytest
+
+from rate_limit import BACKGROUND, INTERACTIVE, UpstreamLimiter, call_upstream, get_limiter, priority
+
+
+def test_interactive_waiters_go_before_background():
+    limiter = UpstreamLimiter("test", rate=1000, burst=10, concurrency=1)
+    order = []
+    limiter.acquire()
+
+    def worker(name, level):
+        with limiter.slot(level, timeout=5):
+            order.append(name)
+
+    threads = [threading.Thread(target=worker, args=("background", BACKGROUND))]
+    threads[0].start()
+    while not limiter.metrics()["queued"]:
+        time.sleep(0.01)
+    threads.append(threading.Thread(target=worker, args=("interactive", INTERACTIVE)))
+    threads[1].start()
+    while limiter.metrics()["queued"] < 2:
+        time.sleep(0.01)
+
+    limiter.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["interactive", "background"]
+
+
+def test_priority_context_sets_default_level():
+    limiter = UpstreamLimiter("test", rate=1000, burst=10, concurrency=1)
+    limiter.acquire()
+    with priority(BACKGROUND):
+        # 和 model_registry._submit 一样，把调用方的上下文带进工作线程
+        context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(limiter.acquire,), kwargs={"timeout": 0.3})
+    thread.start()
+    while not limiter.metrics()["queued"]:
+        time.sleep(0.01)
+    assert limiter.metrics()["queued_by_priority"] == {BACKGROUND: 1}
+    thread.join(5)
+    assert limiter.timeouts == 1
+
+
+def test_pause_blocks_tokens_until_it_expires():
+    limiter = UpstreamLimiter("test", rate=1000, burst=10, concurrency=4)
+    limiter.pause(0.3)
+    assert not limiter.acquire(timeout=0.1)
+
+    started = time.monotonic()
+    assert limiter.acquire(timeout=2)
+    assert time.monotonic() - started >= 0.15
+    assert limiter.metrics()["throttled"] == 1
+
+
+def test_slot_timeout_raises_and_releases():
+    limiter = UpstreamLimiter("test", rate=1000, burst=10, concurrency=1)
+    with limiter.slot():
+        with pytest.raises(TimeoutError):
+            with limiter.slot(timeout=0.05):
+                pass
+    assert limiter.in_flight == 0
+    assert limiter.has_capacity()
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def test_call_upstream_retries_after_429(monkeypatch):
+    monkeypatch.setattr("rate_limit.RATE_LIMIT_BACKOFF_SECONDS", 0.01)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise Throttled()
+        return "ok"
+
+    assert call_upstream("test-retry", fn, retries=3) == "ok"
+    assert len(calls) == 3
+    assert get_limiter("test-retry").throttled == 2
+
+    with pytest.raises(Throttled):
+        call_upstream("test-exhausted", lambda: (_ for _ in ()).throw(Throttled()), retries=1)
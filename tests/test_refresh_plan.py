@@ -0,0 +1,116 @@
+import json
+import functools
+
+import pytest
+
+import entity_pool
+import part2
+import shared_cache
+from checkpoint import CheckpointStore
+from shared_cache import SharedCache
+
+ALIVE = {"https://img.example.com/ok.jpg", "https://img.example.com/new.jpg"}
+
+
+def stored_plan():
+    return {
+        "city": "深圳",
+        "days": 3,
+        "base路线": {"第1天": "世界之窗"},
+        "景点": [
+            {"name": "世界之窗", "describe": "主题公园", "图片url": "https://img.example.com/ok.jpg"},
+            {"name": "大梅沙", "describe": "海滨沙滩", "图片url": "https://img.example.com/dead.jpg"},
+        ],
+        "美食": [{"name": "肠粉", "describe": "早茶", "图片url": ""}],
+        "美食店铺": [{"name": "老店", "describe": "", "图片url": "https://img.example.com/dead2.jpg"}],
+    }
+
+
+@pytest.fixture
+def planner(tmp_path, monkeypatch):
+    monkeypatch.setattr(part2, "CheckpointStore", functools.partial(CheckpointStore, root=str(tmp_path / "checkpoints")))
+    monkeypatch.setattr(entity_pool, "ENTITY_POOL_DIR", str(tmp_path / "entity_pool"))
+    monkeypatch.setattr(shared_cache, "_shared_cache", SharedCache(str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(part2, "is_image_alive", lambda url: url in ALIVE)
+    travel_planner = part2.TravelPlanner("深圳", 3)
+    travel_planner.saved = []
+    monkeypatch.setattr(travel_planner, "save_plan", travel_planner.saved.append)
+    return travel_planner
+
+
+def test_refresh_images_replaces_only_broken_links(planner, monkeypatch):
+    searched = []
+
+    def fake_fetch(query, num_results):
+        searched.append(query)
+        # 老店找不到能访问的新图片
+        if "老店" in query:
+            return [{"image": "https://img.example.com/dead3.jpg"}]
+        return [{"image": "https://img.example.com/dead3.jpg"}, {"image": "https://img.example.com/new.jpg"}]
+
+    monkeypatch.setattr(part2, "fetch_serper_images", fake_fetch)
+    plan = stored_plan()
+
+    stats = planner.refresh_plan(plan, ["images"])
+
+    assert stats == {"images": {"checked": 4, "broken": 3, "replaced": 2}}
+    assert sorted(searched) == sorted(["深圳 大梅沙 实景图", "深圳 肠粉 实景图", "深圳 老店 实景图"])
+    assert plan["景点"][0]["图片url"] == "https://img.example.com/ok.jpg"
+    assert plan["景点"][1]["图片url"] == "https://img.example.com/new.jpg"
+    assert plan["美食店铺"][0]["图片url"] == "https://img.example.com/dead2.jpg"
+    assert planner.saved == [plan]
+    assert entity_pool.load_pool("深圳")["attractions"]
+
+
+def test_refresh_foods_keeps_the_rest_of_the_plan(planner, monkeypatch):
+    stages = []
+
+    def fake_stage(stage, query, instruction, error_label):
+        stages.append(stage)
+        return [{"result_id": 1, "description": f"{stage}搜索结果"}]
+
+    answer = json.dumps({"foods": [{"name": "椰子鸡", "description": "清甜"}],
+                         "food_shop": [{"name": "润园四季", "description": "椰子鸡老店"}]}, ensure_ascii=False)
+    monkeypatch.setattr(planner, "_search_and_rerank_stage", fake_stage)
+    monkeypatch.setattr(planner, "ask", lambda role, prompt, parse=None: answer)
+    monkeypatch.setattr(planner, "find_image", lambda query, name=None: f"https://img.example.com/{name}.jpg")
+    plan = stored_plan()
+    before = stored_plan()
+
+    stats = planner.refresh_plan(plan, ["foods"])
+
+    assert stages == ["must_eat", "local_food"]
+    assert stats == {"foods": {"foods": 1, "shops": 1}}
+    assert plan["美食"] == [{"name": "椰子鸡", "describe": "清甜", "图片url": "https://img.example.com/椰子鸡.jpg"}]
+    assert plan["美食店铺"][0]["name"] == "润园四季"
+    assert plan["景点"] == before["景点"]
+    assert plan["base路线"] == before["base路线"]
+    # 刷新美食时实体池中的旧美食被替换，而不是合并
+    assert [item["name"] for item in entity_pool.load_pool("深圳")["foods"]] == ["椰子鸡"]
+
+
+def test_degraded_refresh_does_not_save(planner, monkeypatch):
+    def throttled_fetch(query, num_results):
+        planner.degraded["images"] = 1
+        return []
+
+    monkeypatch.setattr(part2, "fetch_serper_images", throttled_fetch)
+
+    with pytest.raises(RuntimeError):
+        planner.refresh_plan(stored_plan(), ["images"])
+    assert planner.saved == []
+
+
+@pytest.mark.parametrize("body, status", [
+    ({"city": "深圳", "days": 3, "sections": ["attractions"]}, 400),
+    ({"city": "深圳", "days": 3, "sections": "images"}, 400),
+    ({"city": "深圳"}, 400),
+    ({"city": "深圳", "days": 3}, 404),
+])
+def test_refresh_endpoint_validates_the_request(monkeypatch, body, status):
+    monkeypatch.setattr(part2, "load_plan", lambda city, days: None)
+
+    response = part2.app.test_client().post("/refresh_travel_plan", json=body)
+
+    assert response.status_code == status
+    assert response.get_json()["status"] == "error"
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+import model_registry
+import part2
+from model_registry import LARGE, SMALL
+
+RESULTS = '[{"result_id": 1, "title": "世界之窗", "description": "主题公园", "url": "https://example.com"}]'
+
+
+@pytest.fixture
+def planner():
+    return part2.TravelPlanner("深圳", 3, use_pool=False)
+
+
+@pytest.mark.parametrize("content", [
+    RESULTS,
+    f"```json\n{RESULTS}\n```",
+    f"```\n{RESULTS}\n```",
+    f"以下是最相关的结果：\n{RESULTS}\n希望对你有帮助",
+    f'{{"related_results": {RESULTS}}}',
+    f"```json\n{RESULTS}",
+])
+def test_rerank_output_formats_are_parsed(planner, content):
+    assert planner.extract_json_from_response(content)[0]["title"] == "世界之窗"
+
+
+@pytest.mark.parametrize("content", ["", "没有找到相关结果", "```json\n[]\n```", '{"answer": 1}'])
+def test_unusable_rerank_output_is_empty(planner, content):
+    assert planner.extract_json_from_response(content) == []
+
+
+@pytest.fixture
+def tiers(monkeypatch):
+    """记录每次调用使用的档位；小模型按 small_output 回答，大模型总是回答带代码块的 JSON"""
+    monkeypatch.setattr(model_registry, "LLM_HEDGE_ENABLED", False)
+    calls = []
+
+    def create_agent(task, system_message, tier=None, **kwargs):
+        def step(prompt):
+            calls.append(tier)
+            content = tiers.small_output if tier == SMALL else f"```json\n{RESULTS}\n```"
+            return SimpleNamespace(msgs=[SimpleNamespace(content=content)], info={})
+        return SimpleNamespace(step=step)
+
+    monkeypatch.setattr(part2, "create_agent", create_agent)
+    tiers = SimpleNamespace(calls=calls, small_output="")
+    return tiers
+
+
+def test_bare_json_from_small_model_does_not_escalate(planner, tiers):
+    tiers.small_output = RESULTS
+    planner.ask("reranker", "prompt", parse=planner.parse_reranked, stage="rerank_guides")
+    assert tiers.calls == [SMALL]
+    assert planner.token_usage["rerank_guides"]["calls"] == 1
+
+
+def test_unparsable_small_model_output_escalates_once(planner, tiers):
+    tiers.small_output = "抱歉，我无法完成"
+    content = planner.ask("reranker", "prompt", parse=planner.parse_reranked, stage="rerank_guides")
+    assert tiers.calls == [SMALL, LARGE]
+    assert planner.extract_json_from_response(content)[0]["title"] == "世界之窗"
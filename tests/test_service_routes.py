@@ -0,0 +1,27 @@
+import pytest
+from flask import Flask
+
+import part1
+import part2
+import part3
+import service_routes
+
+
+@pytest.mark.parametrize("app", [part1.app, part2.app, part3.app], ids=["part1", "part2", "part3"])
+def test_every_service_exposes_the_shared_routes(app):
+    client = app.test_client()
+
+    upstreams = client.get("/metrics/upstreams")
+    assert upstreams.status_code == 200
+    assert isinstance(upstreams.get_json(), dict)
+    assert client.get("/metrics/llm").status_code == 200
+    assert "Accept-Encoding" in upstreams.headers["Vary"]
+    assert upstreams.headers["ETag"]
+
+
+def test_install_registers_metrics_on_a_new_app():
+    app = Flask(__name__)
+    service_routes.install(app)
+
+    rules = {rule.rule for rule in app.url_map.iter_rules()}
+    assert {"/metrics/upstreams", "/metrics/llm"} <= rules
@@ -0,0 +1,64 @@
+import time
+import threading
+
+import pytest
+
+import shared_cache
+from shared_cache import SharedCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_cache, "SHARED_CACHE_POLL_SECONDS", 0.02)
+    return SharedCache(str(tmp_path / "shared_cache.sqlite3"))
+
+
+def test_get_or_compute_runs_once_across_threads(cache):
+    calls = []
+    results = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"plan": "深圳"}
+
+    def worker():
+        results.append(cache.get_or_compute("plan:深圳:3", compute, ttl=60))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{"plan": "深圳"}] * 5
+
+
+def test_failed_result_is_not_cached(cache):
+    assert cache.get_or_compute("plan:x:1", lambda: None, ttl=60) is None
+    assert cache.get_or_compute("plan:x:1", lambda: "ok", ttl=60) == "ok"
+
+
+def test_expired_lease_is_taken_over(cache):
+    # 另一个进程拿到租约后崩溃：租约过期前等待，过期后接手计算
+    crashed = SharedCache(cache.path)
+    assert crashed._acquire_lease("plan:深圳:3", lease_seconds=0.3)
+
+    started = time.monotonic()
+    assert cache.get_or_compute("plan:深圳:3", lambda: "recomputed", ttl=60) == "recomputed"
+    assert time.monotonic() - started >= 0.25
+    assert cache.get("plan:深圳:3") == "recomputed"
+
+
+def test_max_wait_bounds_waiting_for_a_live_lease(cache):
+    other = SharedCache(cache.path)
+    assert other._acquire_lease("plan:深圳:3", lease_seconds=60)
+    with pytest.raises(TimeoutError):
+        cache.get_or_compute("plan:深圳:3", lambda: "never", ttl=60, max_wait=0.1)
+
+
+def test_incr_respects_limit(cache):
+    assert cache.incr("prewarm:spent:2026-10-19", 3, ttl=60, limit=5) == 3
+    assert cache.incr("prewarm:spent:2026-10-19", 3, ttl=60, limit=5) is None
+    assert cache.incr("prewarm:spent:2026-10-19", 2, ttl=60, limit=5) == 5